@@ -0,0 +1,153 @@
+"""
+Loss-aware adaptive sampling of the training set.
+
+train_epoch reports the per-utterance loss of every step to the sampler,
+which keeps an exponential moving average per utterance in one float32
+array. Each epoch draws (with replacement) from
+
+    p_i = (1 - uniform_mix) * loss_i^power / sum(loss^power) + uniform_mix / n
+
+so hard utterances are over-sampled and easy ones sub-sampled, and returns
+importance weights 1 / (n * p_i) (clipped at max_weight) that keep the
+expected gradient that of uniform sampling. Enabled by the config entry
+
+    "adaptive_sampler": {"epoch_fraction": 1.0, "power": 1.0,
+                         "uniform_mix": 0.2, "momentum": 0.9, "max_weight": 10.0}
+
+Draws come from a torch.Generator seeded with (seed, epoch), so runs with
+the same seed are reproducible alongside seed_worker.
+"""
+
+from typing import Iterator, Sequence
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+
+class IndexedDataset(Dataset):
+    """Appends the dataset index to every item of `dataset`"""
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        item = self.dataset[index]
+        return (*item, index) if isinstance(item, tuple) else (item, index)
+
+    def __getattr__(self, name):
+        # expose attributes of the wrapped dataset (e.g. cut)
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+
+class LossAwareSampler(Sampler):
+    def __init__(self, n: int, seed: int, epoch_fraction: float = 1.0, power: float = 1.0,
+                 uniform_mix: float = 0.2, momentum: float = 0.9, max_weight: float = 10.0):
+        self.n = n
+        self.seed = seed
+        self.num_samples = max(1, int(round(epoch_fraction * n)))
+        self.power = power
+        self.uniform_mix = uniform_mix
+        self.momentum = momentum
+        self.max_weight = max_weight
+        self.loss = np.zeros(n, dtype=np.float32)
+        self.seen = np.zeros(n, dtype=bool)
+        self.epoch = 0
+        self.probs = np.full(n, 1. / n)
+
+    def __len__(self):
+        return self.num_samples
+
+    def probabilities(self) -> np.ndarray:
+        if not self.seen.any():
+            return np.full(self.n, 1. / self.n)
+        loss = np.where(self.seen, self.loss, self.loss[self.seen].max())
+        hardness = np.power(np.maximum(loss, 1e-8).astype(np.float64), self.power)
+        return (1 - self.uniform_mix) * hardness / hardness.sum() + self.uniform_mix / self.n
+
+    def __iter__(self) -> Iterator[int]:
+        self.probs = self.probabilities()
+        gen = torch.Generator()
+        gen.manual_seed(self.seed * 1000003 + self.epoch)
+        self.epoch += 1
+        draws = torch.multinomial(torch.from_numpy(self.probs), self.num_samples,
+                                  replacement=True, generator=gen)
+        return iter(draws.tolist())
+
+    def weights(self, indices: Sequence[int]) -> torch.Tensor:
+        """Importance weights of the drawn indices for the current epoch"""
+        idx = np.asarray(indices)
+        w = 1. / (self.n * self.probs[idx])
+        return torch.from_numpy(np.minimum(w, self.max_weight).astype(np.float32))
+
+    def update(self, indices: Sequence[int], losses: Sequence[float]) -> None:
+        idx = np.asarray(indices)
+        losses = np.asarray(losses, dtype=np.float32)
+        # repeated draws of one index in a batch keep the last loss
+        old = np.where(self.seen[idx], self.loss[idx], losses)
+        self.loss[idx] = self.momentum * old + (1 - self.momentum) * losses
+        self.seen[idx] = True
+
+    def state_dict(self):
+        return {"loss": self.loss.copy(), "seen": self.seen.copy(), "epoch": self.epoch}
+
+    def load_state_dict(self, state):
+        self.loss[:] = state["loss"]
+        self.seen[:] = state["seen"]
+        self.epoch = int(state["epoch"])
+
+    def save(self, path) -> None:
+        np.savez(path, **self.state_dict())
+
+
+if __name__ == "__main__":
+    # synthetic check: time to a target validation EER, uniform vs adaptive
+    import time
+
+    from ifocalloss import FocalDistillationLoss
+    from metrics import compute_eer
+
+    def make_data(n, gen):
+        x = torch.randn(n, 32, generator=gen)
+        margin = x[:, 0] + 0.5 * x[:, 1] * x[:, 2]
+        return x, (margin > 0).long()
+
+    gen = torch.Generator().manual_seed(0)
+    x_trn, y_trn = make_data(50000, gen)
+    x_val, y_val = make_data(10000, gen)
+    target_eer, batch_size = 3.0, 256
+    for name, kwargs in [("uniform", None),
+                         ("adaptive", {"epoch_fraction": 0.5, "power": 1.0, "uniform_mix": 0.2})]:
+        torch.manual_seed(0)
+        net = torch.nn.Sequential(torch.nn.Linear(32, 64), torch.nn.ReLU(), torch.nn.Linear(64, 2))
+        optim = torch.optim.Adam(net.parameters(), lr=1e-3)
+        loss_fn = FocalDistillationLoss(beta=0.)
+        sampler = LossAwareSampler(len(x_trn), seed=0, **kwargs) if kwargs else None
+        start, reached, n_seen = time.perf_counter(), None, 0
+        for epoch in range(30):
+            order = list(sampler) if sampler else torch.randperm(len(x_trn)).tolist()
+            for i in range(0, len(order) - batch_size + 1, batch_size):
+                idx = order[i:i + batch_size]
+                n_seen += batch_size
+                out = net(x_trn[idx])
+                weight = sampler.weights(idx) if sampler else None
+                loss = loss_fn(out, y_trn[idx], out.detach(), weight)
+                optim.zero_grad()
+                loss.backward()
+                optim.step()
+                if sampler:
+                    sampler.update(idx, loss_fn.sample_loss.numpy())
+            with torch.no_grad():
+                score = net(x_val)[:, 1].numpy()
+            eer = 100 * compute_eer(score[y_val.numpy() == 1], score[y_val.numpy() == 0])[0]
+            if eer <= target_eer:
+                reached = (n_seen, time.perf_counter() - start)
+                break
+        print("{}: val EER {:.3f}%, target {}% reached at {}".format(
+            name, eer, target_eer,
+            "{} samples, {:.2f} s".format(*reached) if reached else "never"))
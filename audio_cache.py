@@ -0,0 +1,135 @@
+"""
+Read-only cache of decoded audio shared between training jobs.
+
+The utterances of one protocol are decoded once into a single int16 file
+(the flac sources are 16-bit PCM, so x / 32768 gives back exactly what
+soundfile returns), with per-utterance offsets. Jobs open it as a read-only
+memmap, so concurrent runs of a sweep share one copy through the page
+cache instead of each decoding the audio again. Caches live under
+$LSNET_CACHE_DIR/audio, keyed by the protocol (path, mtime, size) and the
+audio directory; a build holds a file lock, so jobs starting together wait
+for one build. Enabled in get_loader by the config entry "audio_cache": "True".
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import soundfile as sf
+import torch
+from torch.utils.data import Dataset
+
+from audio_io import audio_path, read_lengths
+from protocol_index import load_protocol
+
+CACHE_DIR = Path(os.environ.get("LSNET_CACHE_DIR",
+                                Path.home() / ".cache" / "lsnet")) / "audio"
+
+
+def _decode_chunk(paths: List[str]) -> List[np.ndarray]:
+    out = []
+    for path in paths:
+        x, _ = sf.read(path, dtype="int16")
+        out.append(x if x.ndim == 1 else x[:, 0])
+    return out
+
+
+class AudioCache:
+    """int16 waveforms of one protocol; the memmap is opened per process"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "meta.json", "r") as f_json:
+            meta = json.loads(f_json.read())
+        self.utt_ids = meta["utt_ids"]
+        self.offsets = np.load(self.path / "offsets.npy")
+        self.row = {u: i for i, u in enumerate(self.utt_ids)}
+        self._wave = None
+
+    def __len__(self):
+        return len(self.utt_ids)
+
+    def __getstate__(self):
+        # DataLoader workers map the file themselves
+        state = dict(self.__dict__)
+        state["_wave"] = None
+        return state
+
+    def read(self, utt_id: str) -> np.ndarray:
+        if self._wave is None:
+            self._wave = np.memmap(self.path / "wave.i16", dtype=np.int16, mode="r")
+        i = self.row[utt_id]
+        return self._wave[self.offsets[i]:self.offsets[i + 1]].astype(np.float32) / 32768.
+
+    @staticmethod
+    def build(path, utt_ids: List[str], base_dir, num_workers: int = 4,
+              chunk_size: int = 256) -> None:
+        path = Path(path)
+        os.makedirs(path, exist_ok=True)
+        paths = [audio_path(base_dir, u) for u in utt_ids]
+        lengths = read_lengths(base_dir, utt_ids)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        tmp = path / "wave.i16.tmp"
+        wave = np.memmap(tmp, dtype=np.int16, mode="w+", shape=(max(int(offsets[-1]), 1),))
+        chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            for c, decoded in enumerate(pool.map(_decode_chunk, chunks)):
+                for j, x in enumerate(decoded):
+                    i = c * chunk_size + j
+                    wave[offsets[i]:offsets[i] + len(x)] = x[:lengths[i]]
+        wave.flush()
+        del wave
+        os.replace(tmp, path / "wave.i16")
+        np.save(path / "offsets.npy", offsets)
+        # meta.json is written last and marks a complete cache
+        with open(path / "meta.json", "w") as f_json:
+            f_json.write(json.dumps({"utt_ids": utt_ids, "base_dir": str(base_dir)}))
+
+
+def get_audio_cache(protocol_path, base_dir, num_workers: int = 4) -> AudioCache:
+    """Cache of the utterances of protocol_path, built on first use"""
+    index = load_protocol(protocol_path)
+    key = hashlib.sha1(json.dumps([os.path.abspath(str(protocol_path)),
+                                   os.path.abspath(str(base_dir)),
+                                   index.stamp[:2]]).encode()).hexdigest()
+    path = CACHE_DIR / key
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(CACHE_DIR / "{}.lock".format(key), "w") as f_lock:
+        fcntl.flock(f_lock, fcntl.LOCK_EX)
+        if not (path / "meta.json").exists():
+            print("Decoding {} utterances of {} into {}".format(
+                len(index), protocol_path, path))
+            AudioCache.build(path, index.utt_ids.tolist(), base_dir, num_workers)
+    return AudioCache(path)
+
+
+class CachedDataset(Dataset):
+    """
+    Dataset_ASVspoof2019_train (train=True: random crop, returns x, y) or
+    Dataset_ASVspoof2019_devNeval (returns x, y, utt_id) over an AudioCache
+    """
+
+    def __init__(self, list_IDs: List[str], labels: Dict[str, int], cache: AudioCache,
+                 train: bool, cut: int = 64600):
+        self.list_IDs = list_IDs
+        self.labels = labels
+        self.cache = cache
+        self.train = train
+        self.cut = cut
+
+    def __len__(self):
+        return len(self.list_IDs)
+
+    def __getitem__(self, index):
+        from data_utils import pad, pad_random
+
+        key = self.list_IDs[index]
+        x = self.cache.read(key)
+        if self.train:
+            return torch.Tensor(pad_random(x, self.cut)), self.labels[key]
+        return torch.Tensor(pad(x, self.cut)), self.labels[key], key
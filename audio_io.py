@@ -0,0 +1,20 @@
+"""
+Locations and headers of the ASVspoof audio files, shared by the modules
+that read them without going through the data_utils datasets.
+"""
+
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import soundfile as sf
+
+
+def audio_path(base_dir, utt_id: str) -> str:
+    # same layout as the data_utils datasets
+    return str(Path(base_dir) / "flac" / "{}.flac".format(utt_id))
+
+
+def read_lengths(base_dir, utt_ids: List[str]) -> np.ndarray:
+    """Sample counts from the audio headers (no decoding)"""
+    return np.array([sf.info(audio_path(base_dir, u)).frames for u in utt_ids], dtype=np.int64)
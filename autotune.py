@@ -0,0 +1,235 @@
+"""
+CPU thread / batch autotuner for inference.
+
+Sweeps intra-op threads, inter-op threads, batch size and processes per
+socket against a real checkpoint and input length. Every setting runs in
+fresh worker processes (inter-op threads can only be set once per process),
+pinned to disjoint cores of the socket being tuned (--socket, default the
+first; read from /proc/cpuinfo); the processes of a setting warm up, then
+start their timed forwards together, and the sweep reports throughput and
+p99 latency. The best setting is stored per host profile in
+$LSNET_CACHE_DIR/autotune.json. apply_tuned_config() lets scoring entry
+points pick it up: it sets the thread counts, and score_corpus.py runs
+"processes" model-inference streams (threads, each with intra_threads).
+
+    python autotune.py --config config/LSNet.conf --model_path best.pth
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CACHE_FILE = Path(os.environ.get("LSNET_CACHE_DIR",
+                                 Path.home() / ".cache" / "lsnet")) / "autotune.json"
+_READY = "autotune-worker-ready"
+
+
+def host_profile() -> Dict:
+    cpu_model = platform.processor()
+    sockets = set()
+    try:
+        with open("/proc/cpuinfo", "r") as f_cpu:
+            for line in f_cpu:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                elif line.startswith("physical id"):
+                    sockets.add(line.split(":", 1)[1].strip())
+    except OSError:
+        pass
+    import torch
+    return {"cpu": cpu_model, "cores": os.cpu_count() or 1,
+            "sockets": max(1, len(sockets)), "torch": torch.__version__}
+
+
+def socket_cores() -> Dict[str, List[int]]:
+    """Cores this process may run on, per socket ("physical id")"""
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+        else list(range(os.cpu_count() or 1))
+    sockets: Dict[str, List[int]] = {}
+    try:
+        with open("/proc/cpuinfo", "r") as f_cpu:
+            processor = None
+            for line in f_cpu:
+                if line.startswith("processor"):
+                    processor = int(line.split(":", 1)[1])
+                elif line.startswith("physical id") and processor in allowed:
+                    sockets.setdefault(line.split(":", 1)[1].strip(), []).append(processor)
+    except OSError:
+        pass
+    return sockets or {"0": allowed}
+
+
+def profile_key(profile: Dict) -> str:
+    return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_tuned_config(profile: Optional[Dict] = None) -> Optional[Dict]:
+    if not CACHE_FILE.exists():
+        return None
+    with open(CACHE_FILE, "r") as f_json:
+        entries = json.loads(f_json.read())
+    entry = entries.get(profile_key(profile or host_profile()))
+    return entry["best"] if entry else None
+
+
+def apply_tuned_config() -> Optional[Dict]:
+    """
+    Set torch thread counts from the tuned config of this host, if any.
+    Returns the config; its batch_size and processes (concurrent inference
+    streams) are for the caller to apply.
+    """
+    import torch
+
+    tuned = load_tuned_config()
+    if tuned is None:
+        return None
+    torch.set_num_threads(tuned["intra_threads"])
+    try:
+        torch.set_num_interop_threads(tuned["interop_threads"])
+    except RuntimeError:
+        # inter-op pool already started in this process
+        pass
+    print("Using tuned CPU config: {}".format(tuned))
+    return tuned
+
+
+def _save(profile: Dict, best: Dict, results: List[Dict], args) -> None:
+    entries = {}
+    if CACHE_FILE.exists():
+        with open(CACHE_FILE, "r") as f_json:
+            entries = json.loads(f_json.read())
+    entries[profile_key(profile)] = {"profile": profile, "best": best, "results": results,
+                                     "model_path": args.model_path, "nb_samp": args.nb_samp}
+    os.makedirs(CACHE_FILE.parent, exist_ok=True)
+    tmp = "{}.tmp".format(CACHE_FILE)
+    with open(tmp, "w") as f_json:
+        f_json.write(json.dumps(entries, indent=4))
+    os.replace(tmp, CACHE_FILE)
+
+
+def run_worker(spec: Dict) -> None:
+    """Time `iters` forwards in this process and print latencies as JSON"""
+    if spec.get("cores") and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, spec["cores"])
+    import torch
+    torch.set_num_threads(spec["intra_threads"])
+    torch.set_num_interop_threads(spec["interop_threads"])
+
+    with open(spec["config"], "r") as f_json:
+        model_config = json.loads(f_json.read())["model_config"]
+    from model_factory import get_model
+    model = get_model(model_config, "cpu")
+    if spec.get("model_path"):
+        model.load_state_dict(torch.load(spec["model_path"], map_location="cpu"))
+    model.eval()
+
+    x = torch.randn(spec["batch_size"], spec["nb_samp"])
+    latencies = []
+    with torch.no_grad():
+        for _ in range(spec["warmup"]):
+            model(x)
+        # start barrier: measure() releases the processes of a setting
+        # together once all of them are warmed up
+        print(_READY, flush=True)
+        sys.stdin.readline()
+        for _ in range(spec["iters"]):
+            start = time.perf_counter()
+            model(x)
+            latencies.append(time.perf_counter() - start)
+    print(json.dumps(latencies))
+
+
+def measure(setting: Dict, cores: List[int], args) -> Dict:
+    """Runs the setting's processes on disjoint slices of `cores` (one socket)"""
+    procs = []
+    for p in range(setting["processes"]):
+        spec = dict(setting, config=args.config, model_path=args.model_path,
+                    nb_samp=args.nb_samp, warmup=args.warmup, iters=args.iters,
+                    cores=cores[p * setting["intra_threads"]:(p + 1) * setting["intra_threads"]])
+        procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                       "--worker", json.dumps(spec)],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      cwd=os.path.dirname(os.path.abspath(__file__))))
+    for proc in procs:
+        for line in proc.stdout:
+            if line.strip() == _READY.encode():
+                break
+        else:
+            for other in procs:
+                other.kill()
+            raise RuntimeError("autotune worker exited before timing: {}".format(setting))
+    for proc in procs:
+        proc.stdin.write(b"\n")
+        proc.stdin.flush()
+    latencies = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        latencies.append(json.loads(out.decode().strip().splitlines()[-1]))
+    throughput = sum(setting["batch_size"] / np.mean(lat) for lat in latencies)
+    p99 = float(np.percentile(np.concatenate(latencies), 99)) * 1e3
+    return dict(setting, throughput=float(throughput), p99_ms=p99)
+
+
+def main(args: argparse.Namespace) -> None:
+    profile = host_profile()
+    sockets = socket_cores()
+    socket = args.socket if args.socket is not None else sorted(sockets)[0]
+    if socket not in sockets:
+        raise ValueError("socket {} not available, have {}".format(socket, sorted(sockets)))
+    cores = sockets[socket]
+    cores_per_socket = len(cores)
+    print("tuning on socket {}: cores {}".format(socket, cores))
+    results = []
+    for intra, interop, batch_size, processes in itertools.product(
+            args.intra_threads or [t for t in (1, 2, 4, 8, 16, 32, 64) if t <= cores_per_socket],
+            args.interop_threads, args.batch_sizes, args.processes):
+        if intra * processes > cores_per_socket:
+            continue
+        setting = {"intra_threads": intra, "interop_threads": interop,
+                   "batch_size": batch_size, "processes": processes}
+        result = measure(setting, cores, args)
+        results.append(result)
+        print("{}: {:.1f} utt/s, p99 {:.1f} ms".format(setting, result["throughput"],
+                                                        result["p99_ms"]))
+
+    eligible = [r for r in results if args.max_p99_ms is None or r["p99_ms"] <= args.max_p99_ms]
+    if not eligible:
+        print("No setting meets p99 <= {} ms".format(args.max_p99_ms))
+        return
+    best = max(eligible, key=lambda r: r["throughput"])
+    _save(profile, best, results, args)
+    print("best: {}\nsaved to {}".format(best, CACHE_FILE))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU thread/batch autotuner")
+    parser.add_argument("--worker", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--config", type=str)
+    parser.add_argument("--model_path", type=str, default=None)
+    parser.add_argument("--nb_samp", type=int, default=64600)
+    parser.add_argument("--intra_threads", type=int, nargs="+", default=None)
+    parser.add_argument("--interop_threads", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4],
+                        help="concurrent processes per socket")
+    parser.add_argument("--socket", type=str, default=None,
+                        help="physical id of the socket to tune on (default: the first)")
+    parser.add_argument("--max_p99_ms", type=float, default=None,
+                        help="only settings within this p99 latency are eligible")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=20)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(json.loads(args.worker))
+    else:
+        main(args)
@@ -0,0 +1,228 @@
+"""
+Shared-memory slab transport for fixed-length waveform batches.
+
+A SlabPool preallocates `n_slabs` batch buffers (#slab, #bs, nb_samp) in
+shared memory before the workers start; on CUDA hosts the buffers are also
+page-locked once with cudaHostRegister, so no pin_memory copy is needed.
+The batch sampler hands each batch a free slab id; workers write every
+waveform straight into its row of that slab and only send back
+(slab id, #rows, labels, ...), and the trainer gets a view of the slab. A
+slab is recycled when the next batch is requested, so a batch is valid
+until then.
+
+n_slabs = num_workers * prefetch_factor + 2 covers the batches in flight,
+the one being consumed and the one just released.
+
+Inputs may be shorter than nb_samp (the crop-length curriculum) as long as
+all items of a batch have one length: they fill the head of their rows and
+the batch is the (#bs, length) view of the slab.
+
+Opt-in (config "shm_transport": "True"); get_loader defaults to the plain
+DataLoader. The gain depends on the host: on a 1-core CPU host with 4
+workers the benchmark below ranged from 567 vs 601 utt/s (slower) to
+906-1057 vs 746-912 utt/s (faster) across runs. Measure before enabling.
+
+    python batch_transport.py --batch_size 24 --num_workers 4
+
+    loader = SlabLoader(train_set, batch_size, nb_samp, sampler=RandomSampler(...),
+                        drop_last=True, num_workers=4)
+"""
+
+import argparse
+import collections
+import time
+from typing import Iterator, List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, RandomSampler, Sampler, SequentialSampler
+from torch.utils.data._utils.collate import default_collate
+
+
+class SlabPool:
+    def __init__(self, n_slabs: int, batch_size: int, nb_samp: int, pin: bool = True):
+        self.x = torch.zeros(n_slabs, batch_size, nb_samp).share_memory_()
+        self.pinned = False
+        if pin and torch.cuda.is_available():
+            nbytes = self.x.numel() * self.x.element_size()
+            err = torch.cuda.cudart().cudaHostRegister(self.x.data_ptr(), nbytes, 0)
+            self.pinned = int(getattr(err, "value", err)) == 0
+        self.free = collections.deque(range(n_slabs))
+        self.events = {}
+
+    def __len__(self):
+        return self.x.size(0)
+
+    def reset(self) -> None:
+        self.free = collections.deque(range(len(self)))
+        self.events = {}
+
+    def acquire(self) -> int:
+        if not self.free:
+            raise RuntimeError("No free slab: batches must be released (fetch the next one) "
+                               "before more than {} are in flight".format(len(self)))
+        slab = self.free.popleft()
+        event = self.events.pop(slab, None)
+        if event is not None:
+            # an async host-to-device copy out of this slab may still be running
+            event.synchronize()
+        return slab
+
+    def release(self, slab: int) -> None:
+        if self.pinned:
+            event = torch.cuda.Event()
+            event.record()
+            self.events[slab] = event
+        self.free.append(slab)
+
+
+class _SlabBatchSampler(Sampler):
+    """Batches of (slab id, row, dataset index)"""
+
+    def __init__(self, sampler, batch_size: int, drop_last: bool, pool: SlabPool):
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.pool = pool
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.sampler) // self.batch_size
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self) -> Iterator[List]:
+        batch = []
+        for idx in self.sampler:
+            batch.append(idx)
+            if len(batch) == self.batch_size:
+                slab = self.pool.acquire()
+                yield [(slab, row, i) for row, i in enumerate(batch)]
+                batch = []
+        if batch and not self.drop_last:
+            slab = self.pool.acquire()
+            yield [(slab, row, i) for row, i in enumerate(batch)]
+
+
+class _SlabDataset(Dataset):
+    """Writes the waveform of item i into its slab row; returns the rest"""
+
+    def __init__(self, dataset: Dataset, slabs: torch.Tensor):
+        self.dataset = dataset
+        self.slabs = slabs
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, key):
+        slab, row, index = key
+        item = self.dataset[index]
+        x = torch.as_tensor(item[0])
+        if x.numel() > self.slabs.size(2):
+            raise ValueError("slab transport needs inputs of at most {} samples, got {}".format(
+                self.slabs.size(2), x.numel()))
+        # shorter crops (length curriculum) fill the head of the row
+        self.slabs[slab, row, :x.numel()].copy_(x.view(-1))
+        return (slab, x.numel()) + tuple(item[1:])
+
+
+def _slab_collate(items):
+    lengths = {it[1] for it in items}
+    if len(lengths) != 1:
+        raise ValueError("slab transport needs one input length per batch, got {}".format(
+            sorted(lengths)))
+    return (items[0][0], len(items), items[0][1]) + \
+        tuple(default_collate([it[2:] for it in items]))
+
+
+class SlabLoader:
+    """
+    DataLoader replacement yielding (batch_x, *rest) like the wrapped
+    dataset's default collate, with batch_x a view of a shared slab.
+    """
+
+    def __init__(self, dataset: Dataset, batch_size: int, nb_samp: int,
+                 sampler: Optional[Sampler] = None, shuffle: bool = False,
+                 drop_last: bool = False, num_workers: int = 0, prefetch_factor: int = 2,
+                 worker_init_fn=None, generator=None, pin: bool = True):
+        self.dataset = dataset
+        if sampler is None:
+            sampler = RandomSampler(dataset, generator=generator) if shuffle \
+                else SequentialSampler(dataset)
+        self.sampler = sampler
+        n_slabs = (num_workers * prefetch_factor if num_workers else 1) + 2
+        self.pool = SlabPool(n_slabs, batch_size, nb_samp, pin=pin)
+        self.batch_sampler = _SlabBatchSampler(sampler, batch_size, drop_last, self.pool)
+        self.loader = DataLoader(_SlabDataset(dataset, self.pool.x),
+                                 batch_sampler=self.batch_sampler,
+                                 collate_fn=_slab_collate,
+                                 num_workers=num_workers,
+                                 prefetch_factor=prefetch_factor if num_workers else None,
+                                 worker_init_fn=worker_init_fn,
+                                 generator=generator,
+                                 pin_memory=False)
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        self.pool.reset()
+        held = None
+        try:
+            for slab, n, length, *rest in self.loader:
+                if held is not None:
+                    self.pool.release(held)
+                held = slab
+                yield (self.pool.x[slab, :n, :length],) + tuple(rest)
+        finally:
+            if held is not None:
+                self.pool.release(held)
+
+
+class _SyntheticWaveforms(Dataset):
+    """Random 'decoded' waveforms with a per-item decode cost"""
+
+    def __init__(self, n: int, nb_samp: int):
+        self.n = n
+        self.nb_samp = nb_samp
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        rng = np.random.default_rng(index)
+        return torch.from_numpy(rng.standard_normal(self.nb_samp, dtype=np.float32)), index % 2
+
+
+def _throughput(loader, device: str, n_batches: int) -> float:
+    start, seen = None, 0
+    for i, (batch_x, batch_y) in enumerate(loader):
+        if i == 2:
+            start = time.perf_counter()
+        batch_x = batch_x.to(device, non_blocking=True)
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        if i >= 2:
+            seen += batch_x.size(0)
+        if i + 1 >= n_batches:
+            break
+    return seen / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slab transport vs default collate throughput")
+    parser.add_argument("--batch_size", type=int, default=24)
+    parser.add_argument("--nb_samp", type=int, default=64600)
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--batches", type=int, default=100)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dataset = _SyntheticWaveforms(args.batch_size * (args.batches + 2), args.nb_samp)
+    default = DataLoader(dataset, batch_size=args.batch_size, shuffle=True, drop_last=True,
+                         num_workers=args.num_workers, pin_memory=device == "cuda")
+    slab = SlabLoader(dataset, args.batch_size, args.nb_samp, shuffle=True, drop_last=True,
+                      num_workers=args.num_workers)
+    for name, loader in [("default collate", default), ("slab transport", slab)]:
+        print("{}: {:.1f} utt/s (device {}, {} workers)".format(
+            name, _throughput(loader, device, args.batches), device, args.num_workers))
+    print("slabs: {}, pinned: {}".format(len(slab.pool), slab.pool.pinned))
@@ -0,0 +1,427 @@
+"""
+Model benchmarks that need no dataset.
+
+    python benchmark.py checkpointing --batch_size 8
+    python benchmark.py channels_last --batch_size 8
+    python benchmark.py fused_proj --batch_sizes 1 2 4 8 16 32 64 --repeats 20
+    python benchmark.py suite --output baseline.json
+    python benchmark.py compare baseline.json current.json --tolerance 0.1
+
+`suite` runs on random inputs with a fixed seed and thread count and
+records warm latency percentiles, throughput per batch size and input
+length, per-module forward time, peak RSS and train-step time. `compare`
+exits non-zero when a metric of the second file is worse than the baseline
+by more than the tolerance.
+"""
+
+import argparse
+import copy
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+from lsnetwork import (CONV, GraphAttentionLayer, GraphPool, HtrgGraphAttentionLayer, Model,
+                       Residual_block)
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# model_config of config/AASIST.conf
+DEFAULT_MODEL_CONFIG = {
+    "architecture": "LSNet",
+    "nb_samp": 64600,
+    "first_conv": 128,
+    "filts": [70, [1, 32], [32, 32], [32, 64], [64, 64]],
+    "gat_dims": [64, 32],
+    "pool_ratios": [0.5, 0.7, 0.5, 0.5],
+    "temperatures": [2.0, 2.0, 100.0, 100.0],
+}
+
+CHECKPOINT_POLICIES = {
+    "none": [],
+    "encoder": ["encoder"],
+    "gat": ["gat"],
+    "htrg": ["htrg"],
+    "all": ["encoder", "gat", "htrg"],
+}
+
+
+def _sync(device):
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def train_step(model, batch_x, batch_y):
+    """forward + backward; returns the number of bytes saved for backward"""
+    saved = {}
+
+    def pack(t):
+        saved[(t.untyped_storage().data_ptr(), t.device)] = t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        _, batch_out = model(batch_x)
+        loss = torch.nn.functional.cross_entropy(batch_out, batch_y)
+    loss.backward()
+    return sum(saved.values())
+
+
+def bench_checkpointing(args):
+    torch.manual_seed(args.seed)
+    base = Model(DEFAULT_MODEL_CONFIG).to(args.device)
+    batch_x = torch.randn(args.batch_size, args.nb_samp, device=args.device)
+    batch_y = torch.randint(0, 2, (args.batch_size,), device=args.device)
+
+    ref_grads = None
+    for name, segments in CHECKPOINT_POLICIES.items():
+        model = copy.deepcopy(base)
+        model.checkpoint_segments = set(segments)
+        model.train()
+
+        torch.manual_seed(args.seed)
+        model.zero_grad()
+        train_step(model, batch_x, batch_y)
+        grads = [p.grad.clone() for p in model.parameters() if p.grad is not None]
+        if ref_grads is None:
+            ref_grads = grads
+        max_diff = max((g - r).abs().max().item() for g, r in zip(grads, ref_grads))
+
+        if str(args.device).startswith("cuda"):
+            torch.cuda.reset_peak_memory_stats()
+        times = []
+        for _ in range(args.steps):
+            model.zero_grad()
+            _sync(args.device)
+            start = time.perf_counter()
+            saved_bytes = train_step(model, batch_x, batch_y)
+            _sync(args.device)
+            times.append(time.perf_counter() - start)
+        msg = "{:8s} saved activations {:8.1f} MB, step {:7.1f} ms, max |grad diff| {:.1e}".format(
+            name, saved_bytes / 2 ** 20, 1e3 * sorted(times)[len(times) // 2], max_diff)
+        if str(args.device).startswith("cuda"):
+            msg += ", peak {:.1f} MB".format(torch.cuda.max_memory_allocated() / 2 ** 20)
+        print(msg)
+
+
+def bench_channels_last(args):
+    """Encoder in NCHW vs channels_last: parity and median ms, inference and training"""
+    torch.manual_seed(args.seed)
+    base = Model(DEFAULT_MODEL_CONFIG).to(args.device)
+    batch_x = torch.randn(args.batch_size, args.nb_samp, device=args.device)
+    batch_y = torch.randint(0, 2, (args.batch_size,), device=args.device)
+    lengths = torch.linspace(args.nb_samp // 4, args.nb_samp, args.batch_size,
+                             device=args.device).long()
+
+    ref = None
+    for name, enabled in [("nchw", False), ("channels_last", True)]:
+        model = copy.deepcopy(base)
+        model.set_channels_last(enabled)
+        model.eval()
+        with torch.no_grad():
+            out = model(batch_x)[1]
+            out_masked = model(batch_x, lengths=lengths)[1]
+        infer = np.median(_timed_forwards(model, batch_x, args.warmup, args.iters))
+
+        model.train()
+        torch.manual_seed(args.seed)
+        model.zero_grad()
+        train_step(model, batch_x, batch_y)
+        grads = [p.grad.clone() for p in model.parameters() if p.grad is not None]
+        times = []
+        for _ in range(args.steps):
+            model.zero_grad()
+            _sync(args.device)
+            start = time.perf_counter()
+            train_step(model, batch_x, batch_y)
+            _sync(args.device)
+            times.append(time.perf_counter() - start)
+
+        if ref is None:
+            ref = (out, out_masked, grads, infer, np.median(times))
+        print("{:14s} infer {:8.1f} ms ({:4.2f}x), train step {:8.1f} ms ({:4.2f}x), "
+              "max |out diff| {:.1e} (masked {:.1e}), max |grad diff| {:.1e}".format(
+                  name, 1e3 * infer, ref[3] / infer, 1e3 * np.median(times),
+                  ref[4] / np.median(times), (out - ref[0]).abs().max().item(),
+                  (out_masked - ref[1]).abs().max().item(),
+                  max((g - r).abs().max().item() for g, r in zip(grads, ref[2]))))
+
+
+def check_fused_weight_updates(model, x) -> None:
+    """
+    Weights written through .data (as SWA swap_swa_sgd does) must reach the
+    fused projections: the eval output changes and matches the separate path.
+    """
+    model.eval()
+    with torch.no_grad():
+        before = model(x)[1]
+        for module in model.modules():
+            if isinstance(module, (GraphAttentionLayer, HtrgGraphAttentionLayer)):
+                for linear in (module.proj_with_att, module.proj_without_att):
+                    linear.weight.data.copy_(torch.randn_like(linear.weight))
+        after = model(x)[1]
+        model.set_fused_projections(False)
+        separate = model(x)[1]
+        model.set_fused_projections(True)
+    assert not torch.equal(before, after), "fused projections kept stale weights"
+    assert torch.allclose(after, separate, atol=1e-5), (after - separate).abs().max().item()
+
+
+def bench_fused_proj(args):
+    """
+    Per-layer GAT / Htrg forward ms with separate vs fused projection GEMMs,
+    on the inputs each layer receives in a model forward. The two variants
+    are timed alternately in rounds to cancel drift.
+    """
+    torch.manual_seed(args.seed)
+    check_fused_weight_updates(Model(DEFAULT_MODEL_CONFIG).to(args.device),
+                               torch.randn(1, args.nb_samp, device=args.device))
+    model = Model(DEFAULT_MODEL_CONFIG).to(args.device).eval()
+    layers = [(name, m) for name, m in model.named_modules()
+              if isinstance(m, (GraphAttentionLayer, HtrgGraphAttentionLayer))]
+    print("{:>4s} {:22s} {:>9s} {:>9s} {:>7s}".format("bs", "layer", "sep ms", "fused ms", "saved"))
+    for batch_size in args.batch_sizes:
+        inputs = {}
+
+        def capture(name):
+            def hook(_module, args_in, kwargs_in):
+                inputs[name] = (args_in, kwargs_in)
+            return hook
+
+        hooks = [m.register_forward_pre_hook(capture(name), with_kwargs=True)
+                 for name, m in layers]
+        with torch.no_grad():
+            model(torch.randn(batch_size, args.nb_samp, device=args.device))
+        for h in hooks:
+            h.remove()
+
+        totals = {False: 0., True: 0.}
+        for name, layer in layers:
+            args_in, kwargs_in = inputs[name]
+            times = {False: [], True: []}
+            with torch.no_grad():
+                for i in range(args.warmup + args.iters):
+                    for fused in (False, True):
+                        layer.fused = fused
+                        _sync(args.device)
+                        start = time.perf_counter()
+                        for _ in range(args.repeats):
+                            layer(*args_in, **kwargs_in)
+                        _sync(args.device)
+                        if i >= args.warmup:
+                            times[fused].append((time.perf_counter() - start) / args.repeats)
+            sep, fused = (1e3 * np.median(times[f]) for f in (False, True))
+            totals[False] += sep
+            totals[True] += fused
+            print("{:4d} {:22s} {:9.3f} {:9.3f} {:7.1%}".format(
+                batch_size, name, sep, fused, 1 - fused / sep))
+        print("{:4d} {:22s} {:9.3f} {:9.3f} {:7.1%}".format(
+            batch_size, "all", totals[False], totals[True], 1 - totals[True] / totals[False]))
+    model.set_fused_projections(True)
+
+
+LAYER_GROUPS = {"CONV": CONV, "encoder": Residual_block, "GAT": GraphAttentionLayer,
+                "Htrg": HtrgGraphAttentionLayer, "GraphPool": GraphPool}
+
+
+def _timed_forwards(model, x, warmup: int, iters: int):
+    """Per-forward wall times (s) after `warmup` untimed forwards"""
+    times = []
+    with torch.no_grad():
+        for i in range(warmup + iters):
+            _sync(x.device)
+            start = time.perf_counter()
+            model(x)
+            _sync(x.device)
+            if i >= warmup:
+                times.append(time.perf_counter() - start)
+    return np.asarray(times)
+
+
+def layer_times(model, x, warmup: int, iters: int):
+    """Mean forward ms per forward pass, summed over the modules of each group"""
+    totals = defaultdict(float)
+    starts = {}
+
+    def pre(module, _inputs):
+        _sync(x.device)
+        starts[id(module)] = time.perf_counter()
+
+    def post(group):
+        def hook(module, _inputs, _output):
+            _sync(x.device)
+            totals[group] += time.perf_counter() - starts.pop(id(module))
+        return hook
+
+    hooks = []
+    for module in model.modules():
+        for group, cls in LAYER_GROUPS.items():
+            if isinstance(module, cls):
+                hooks.append(module.register_forward_pre_hook(pre))
+                hooks.append(module.register_forward_hook(post(group)))
+    _timed_forwards(model, x, warmup, 0)
+    totals.clear()
+    _timed_forwards(model, x, 0, iters)
+    for h in hooks:
+        h.remove()
+    return {group: 1e3 * totals[group] / iters for group in LAYER_GROUPS}
+
+
+def peak_rss_mb(mode: str, batch_size: int, nb_samp: int, threads: int) -> float:
+    """Peak RSS of a fresh process doing one inference forward or train step"""
+    out = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), "rss", "--rss_mode", mode,
+        "--batch_size", str(batch_size), "--nb_samp", str(nb_samp),
+        "--threads", str(threads), "--device", "cpu"], cwd=_HERE)
+    return float(out.decode().split()[-1])
+
+
+def _rss_worker(args):
+    torch.manual_seed(args.seed)
+    model = Model(DEFAULT_MODEL_CONFIG)
+    x = torch.randn(args.batch_size, args.nb_samp)
+    if args.rss_mode == "train":
+        model.train()
+        train_step(model, x, torch.randint(0, 2, (args.batch_size,)))
+    else:
+        model.eval()
+        with torch.no_grad():
+            model(x)
+    # VmHWM is per address space; ru_maxrss survives exec from the parent
+    try:
+        with open("/proc/self/status", "r") as f_status:
+            hwm = [line for line in f_status if line.startswith("VmHWM:")]
+        print(int(hwm[0].split()[1]) / 1024)
+    except (OSError, IndexError):
+        print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def run_suite(args):
+    torch.manual_seed(args.seed)
+    metrics = {}
+
+    def record(name, value, better="lower"):
+        metrics[name] = {"value": float(value), "better": better}
+        print("{:40s} {:10.3f}".format(name, value))
+
+    model = Model(DEFAULT_MODEL_CONFIG).to(args.device).eval()
+    x = torch.randn(1, args.nb_samp, device=args.device)
+    lat = 1e3 * _timed_forwards(model, x, args.warmup, args.iters)
+    for q in (50, 90, 99):
+        record("latency_bs1_p{}_ms".format(q), np.percentile(lat, q))
+    record("latency_bs1_mean_ms", lat.mean())
+
+    for nb_samp in args.lengths:
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, nb_samp, device=args.device)
+            t = _timed_forwards(model, x, args.warmup, max(3, args.iters // batch_size))
+            record("throughput_bs{}_len{}_utt_s".format(batch_size, nb_samp),
+                   batch_size / np.median(t), better="higher")
+
+    x = torch.randn(args.batch_size, args.nb_samp, device=args.device)
+    for group, ms in layer_times(model, x, args.warmup, args.iters).items():
+        record("layer_{}_bs{}_ms".format(group, args.batch_size), ms)
+
+    model.train()
+    y = torch.randint(0, 2, (args.batch_size,), device=args.device)
+    times = []
+    for i in range(args.warmup + args.steps):
+        model.zero_grad()
+        _sync(args.device)
+        start = time.perf_counter()
+        train_step(model, x, y)
+        _sync(args.device)
+        if i >= args.warmup:
+            times.append(time.perf_counter() - start)
+    record("train_step_bs{}_ms".format(args.batch_size), 1e3 * np.median(times))
+
+    record("peak_rss_infer_bs1_mb", peak_rss_mb("infer", 1, args.nb_samp, args.threads))
+    record("peak_rss_train_bs{}_mb".format(args.batch_size),
+           peak_rss_mb("train", args.batch_size, args.nb_samp, args.threads))
+
+    result = {"meta": {"torch": torch.__version__, "python": platform.python_version(),
+                       "cpu": platform.processor() or platform.machine(),
+                       "threads": torch.get_num_threads(), "device": str(args.device),
+                       "seed": args.seed, "time": time.strftime("%Y-%m-%d %H:%M:%S")},
+              "metrics": metrics}
+    if args.output:
+        with open(args.output, "w") as f_json:
+            f_json.write(json.dumps(result, indent=4))
+        print("Saved to {}".format(args.output))
+    return result
+
+
+def compare(baseline_path, current_path, tolerance: float) -> int:
+    """Prints relative changes; returns the number of regressions"""
+    with open(baseline_path, "r") as f_json:
+        baseline = json.loads(f_json.read())
+    with open(current_path, "r") as f_json:
+        current = json.loads(f_json.read())
+    for key in ("torch", "cpu", "threads", "device"):
+        if baseline["meta"].get(key) != current["meta"].get(key):
+            print("warning: {} differs ({} vs {})".format(
+                key, baseline["meta"].get(key), current["meta"].get(key)))
+    regressions = 0
+    for name, base in baseline["metrics"].items():
+        if name not in current["metrics"]:
+            print("{:40s} missing".format(name))
+            continue
+        value = current["metrics"][name]["value"]
+        change = (value - base["value"]) / max(abs(base["value"]), 1e-12)
+        worse = change > tolerance if base["better"] == "lower" else change < -tolerance
+        regressions += worse
+        print("{:40s} {:10.3f} -> {:10.3f} {:+7.1%}{}".format(
+            name, base["value"], value, change, "  REGRESSION" if worse else ""))
+    print("{} regression(s) beyond {:.0%}".format(regressions, tolerance))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LSNet benchmarks")
+    parser.add_argument("mode", choices=["checkpointing", "channels_last", "fused_proj",
+                                         "suite", "compare", "rss"])
+    parser.add_argument("files", nargs="*", help="compare: baseline.json current.json")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--nb_samp", type=int, default=64600)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 16],
+                        help="suite: throughput batch sizes; fused_proj: batch sizes")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[16000, 32000, 64600],
+                        help="suite: throughput input lengths")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=min(4, os.cpu_count() or 1),
+                        help="suite / fused_proj / channels_last: torch intra-op threads, fixed for comparability")
+    parser.add_argument("--output", type=str, default=None, help="suite: result JSON")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="compare: allowed relative slowdown")
+    parser.add_argument("--rss_mode", type=str, default="infer", help=argparse.SUPPRESS)
+    parser.add_argument("--device", type=str, default=None,
+                        help="default: cuda if available (suite: cpu)")
+    args = parser.parse_args()
+    if args.device is None:
+        args.device = "cpu" if args.mode == "suite" or not torch.cuda.is_available() else "cuda"
+    if args.mode in ("suite", "rss", "fused_proj", "channels_last"):
+        torch.set_num_threads(args.threads)
+    if args.mode == "checkpointing":
+        bench_checkpointing(args)
+    elif args.mode == "channels_last":
+        bench_channels_last(args)
+    elif args.mode == "fused_proj":
+        bench_fused_proj(args)
+    elif args.mode == "suite":
+        run_suite(args)
+    elif args.mode == "rss":
+        _rss_worker(args)
+    elif args.mode == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs baseline.json current.json")
+        sys.exit(int(compare(args.files[0], args.files[1], args.tolerance) > 0))
@@ -0,0 +1,195 @@
+"""
+Length-bucketed evaluation at natural utterance length.
+
+Utterances are sorted by duration (read from the file headers) and batched
+so that each batch holds similar lengths, capped by a sample budget per
+batch. Each batch is zero-padded to its longest member and scored with
+Model(x, lengths=...), which masks the padded frames through the encoder,
+GAT-T, GraphPool top-k and the readout, so every score equals that of the
+utterance run alone. With --compare_fixed the same trials are also scored
+with the fixed-length pad/crop of data_utils and both throughput and EER /
+min t-DCF are reported.
+
+    python bucketed_eval.py --config config/LSNet.conf \
+        --protocol ASVspoof2021_LA_cm_protocols/trial_metadata.txt \
+        --database_path ASVspoof2021_LA_eval --output_dir exp_result/varlen --compare_fixed
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import soundfile as sf
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+from tqdm import tqdm
+
+from audio_io import audio_path, read_lengths
+from metrics import calculate_tDCF_EER_from_scores
+from protocol_index import load_protocol
+from score_io import write_scores
+
+
+class LengthBucketSampler(Sampler):
+    """
+    Batches of consecutive utterances in length order. A batch closes at
+    batch_size utterances or when padding to its longest member would
+    exceed max_batch_samples.
+    """
+
+    def __init__(self, lengths: np.ndarray, batch_size: int,
+                 max_batch_samples: Optional[int] = None):
+        order = np.argsort(lengths, kind="stable")[::-1]
+        self.batches = []
+        batch = []
+        for i in order.tolist():
+            longest = lengths[batch[0]] if batch else lengths[i]
+            if batch and (len(batch) == batch_size or (
+                    max_batch_samples and longest * (len(batch) + 1) > max_batch_samples)):
+                self.batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            self.batches.append(batch)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        return iter(self.batches)
+
+
+class VarLenDataset(Dataset):
+    def __init__(self, list_IDs: List[str], base_dir, max_len: Optional[int] = None):
+        self.list_IDs = list_IDs
+        self.base_dir = base_dir
+        self.max_len = max_len
+
+    def __len__(self):
+        return len(self.list_IDs)
+
+    def __getitem__(self, index):
+        x, _ = sf.read(audio_path(self.base_dir, self.list_IDs[index]), dtype="float32")
+        if x.ndim > 1:
+            x = x[:, 0]
+        if self.max_len:
+            x = x[:self.max_len]
+        return torch.from_numpy(x), index
+
+
+def pad_collate(items):
+    lengths = torch.tensor([len(x) for x, _ in items])
+    batch_x = torch.zeros(len(items), int(lengths.max()))
+    for row, (x, _) in enumerate(items):
+        batch_x[row, :len(x)] = x
+    return batch_x, lengths, torch.tensor([i for _, i in items])
+
+
+def score_bucketed(model, dataset: VarLenDataset, sampler: LengthBucketSampler, device,
+                   num_workers: int = 0) -> np.ndarray:
+    """Scores in dataset order"""
+    loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=pad_collate,
+                        num_workers=num_workers)
+    scores = np.zeros(len(dataset), dtype=np.float32)
+    model.eval()
+    with torch.no_grad():
+        for batch_x, lengths, index in tqdm(loader):
+            _, batch_out = model(batch_x.to(device), lengths=lengths.to(device))
+            scores[index.numpy()] = batch_out[:, 1].cpu().numpy()
+    return scores
+
+
+def score_fixed(model, dataset: VarLenDataset, batch_size: int, device, nb_samp: int = 64600,
+                num_workers: int = 0) -> np.ndarray:
+    """Scores with the fixed-length pad/crop used by the data_utils eval sets"""
+    from data_utils import pad
+
+    def collate(items):
+        batch_x = np.stack([pad(x.numpy(), nb_samp) for x, _ in items])
+        return torch.from_numpy(batch_x), torch.tensor([i for _, i in items])
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, collate_fn=collate,
+                        num_workers=num_workers)
+    scores = np.zeros(len(dataset), dtype=np.float32)
+    model.eval()
+    with torch.no_grad():
+        for batch_x, index in tqdm(loader):
+            _, batch_out = model(batch_x.to(device))
+            scores[index.numpy()] = batch_out[:, 1].cpu().numpy()
+    return scores
+
+
+def main(args: argparse.Namespace) -> None:
+    from model_factory import get_model
+
+    with open(args.config, "r") as f_json:
+        config = json.loads(f_json.read())
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    output_dir = Path(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    model = get_model(config["model_config"], device)
+    model.load_state_dict(torch.load(args.model_path or config["model_path"], map_location=device))
+    model.eval()
+
+    index = load_protocol(args.protocol)
+    utt_ids = index.utt_ids.tolist()
+    if args.limit:
+        utt_ids = utt_ids[:args.limit]
+    database_path = args.database_path or config["database_path"]
+    lengths = read_lengths(database_path, utt_ids)
+    if args.max_len:
+        lengths = np.minimum(lengths, args.max_len)
+    dataset = VarLenDataset(utt_ids, database_path, args.max_len)
+    batch_size = args.batch_size or config["batch_size"]
+    sampler = LengthBucketSampler(lengths, batch_size, args.max_batch_samples)
+    print("{} trials, {} batches, {:.1f} s of audio".format(
+        len(utt_ids), len(sampler), lengths.sum() / 16000))
+
+    runs = [("bucketed", lambda: score_bucketed(model, dataset, sampler, device,
+                                                args.num_workers))]
+    if args.compare_fixed:
+        runs.append(("fixed", lambda: score_fixed(model, dataset, batch_size, device,
+                                                  config["model_config"].get("nb_samp", 64600),
+                                                  args.num_workers)))
+    keys = index.key_names()[:len(utt_ids)]
+    tags = index.tag_names()[:len(utt_ids)]
+    for name, run in runs:
+        start = time.perf_counter()
+        scores = run()
+        elapsed = time.perf_counter() - start
+        write_scores(output_dir / "{}_score.txt".format(name), utt_ids, scores.tolist(),
+                     tags.tolist(), keys.tolist(), fmt=config.get("score_format", "text"))
+        msg = "{}: {:.1f} utt/s".format(name, len(utt_ids) / elapsed)
+        if len(set(keys.tolist())) == 2:
+            eer, tdcf = calculate_tDCF_EER_from_scores(
+                scores, keys, tags,
+                asv_score_file=Path(config["database_logical_path"]) / config["asv_score_path"],
+                output_file=output_dir / "{}_t-DCF_EER.txt".format(name), printout=False)
+            msg += ", eer {:.3f}, min t-DCF {:.5f}".format(eer, tdcf)
+        print(msg)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Length-bucketed natural-length evaluation")
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--model_path", type=str, default=None)
+    parser.add_argument("--protocol", type=str, required=True,
+                        help="CM protocol / trial metadata of the evaluated set")
+    parser.add_argument("--database_path", type=str, default=None,
+                        help="directory holding flac/ (default: config database_path)")
+    parser.add_argument("--output_dir", type=str, default="./exp_result/varlen")
+    parser.add_argument("--batch_size", type=int, default=None)
+    parser.add_argument("--max_batch_samples", type=int, default=None,
+                        help="cap on batch_size x longest length (default: no cap)")
+    parser.add_argument("--max_len", type=int, default=None,
+                        help="crop utterances longer than this many samples")
+    parser.add_argument("--limit", type=int, default=None, help="score only the first N trials")
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--compare_fixed", action="store_true",
+                        help="also score with fixed-length pad/crop")
+    main(parser.parse_args())
@@ -0,0 +1,119 @@
+"""
+Crop-length curriculum for training.
+
+Early epochs are trained on short random crops, which cost about their
+length in compute, and the crop grows to the full length over `epochs`
+epochs; every later epoch uses the full crop. The crop is set per epoch on
+the `cut` of the training dataset (Dataset_ASVspoof2019_train or
+CachedDataset, also through IndexedDataset / Subset wrappers) before the
+epoch's loader iterator, and so its workers, is created. The model needs no
+change: the spectral nodes (and pos_S) do not depend on the length, and the
+temporal nodes, GraphPool top-k and readout follow the input length.
+Enabled by
+
+    "length_curriculum": {"start": 16000, "end": 64600, "epochs": 10,
+                          "schedule": "linear", "multiple": 1600}
+
+Compare the time-to-target with "target_dev_eer" in the config (main.py
+logs the wall time at which the dev EER first reaches it), e.g. with a
+sweep over [{}, {"length_curriculum": {...}}].
+"""
+
+import argparse
+from typing import List
+
+import numpy as np
+
+SCHEDULES = ("linear", "geometric")
+
+
+class LengthCurriculum:
+    def __init__(self, start: int = 16000, end: int = 64600, epochs: int = 10,
+                 schedule: str = "linear", multiple: int = 1600):
+        if schedule not in SCHEDULES:
+            raise ValueError("schedule must be one of {}, got {}".format(SCHEDULES, schedule))
+        if not 0 < start <= end:
+            raise ValueError("need 0 < start <= end, got {} / {}".format(start, end))
+        self.start = start
+        self.end = end
+        self.epochs = epochs
+        self.schedule = schedule
+        self.multiple = multiple
+
+    def crop(self, epoch: int) -> int:
+        """Crop length (samples) of `epoch`, rounded down to `multiple`"""
+        if epoch >= self.epochs:
+            return self.end
+        t = epoch / self.epochs
+        if self.schedule == "linear":
+            length = self.start + t * (self.end - self.start)
+        else:
+            length = self.start * (self.end / self.start) ** t
+        length = int(length) // self.multiple * self.multiple
+        return min(self.end, max(self.start, length))
+
+    def crops(self, num_epochs: int) -> List[int]:
+        return [self.crop(epoch) for epoch in range(num_epochs)]
+
+
+def set_crop(dataset, cut: int) -> None:
+    """Sets `cut` on the innermost dataset that has one, through wrappers"""
+    while "cut" not in vars(dataset):
+        # IndexedDataset forwards reads of cut, so look at the instance dict
+        if not hasattr(dataset, "dataset"):
+            raise ValueError("{} has no crop length (cut)".format(type(dataset).__name__))
+        dataset = dataset.dataset
+    dataset.cut = cut
+
+
+if __name__ == "__main__":
+    # train-step cost per crop and the projected cost of the schedule
+    import time
+
+    import torch
+
+    from benchmark import DEFAULT_MODEL_CONFIG, train_step
+    from lsnetwork import Model
+
+    parser = argparse.ArgumentParser(description="Crop-length curriculum cost check")
+    parser.add_argument("--start", type=int, default=16000)
+    parser.add_argument("--end", type=int, default=64600)
+    parser.add_argument("--epochs", type=int, default=10, help="curriculum epochs")
+    parser.add_argument("--num_epochs", type=int, default=100, help="epochs of the run")
+    parser.add_argument("--schedule", type=str, default="linear", choices=SCHEDULES)
+    parser.add_argument("--multiple", type=int, default=1600)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = Model(DEFAULT_MODEL_CONFIG).train()
+    curriculum = LengthCurriculum(args.start, args.end, args.epochs, args.schedule,
+                                  args.multiple)
+    crops = curriculum.crops(args.num_epochs)
+
+    step_time = {}
+    for crop in sorted(set(crops) | {args.end}):
+        x = torch.randn(args.batch_size, crop)
+        y = torch.randint(0, 2, (args.batch_size,))
+        train_step(model, x, y)
+        times = []
+        for _ in range(args.steps):
+            start = time.perf_counter()
+            train_step(model, x, y)
+            times.append(time.perf_counter() - start)
+        step_time[crop] = float(np.median(times))
+    full = step_time[args.end]
+    for crop, seconds in step_time.items():
+        print("crop {:6d}: train step {:8.1f} ms ({:.2f} of full)".format(
+            crop, 1e3 * seconds, seconds / full))
+
+    for epoch, crop in enumerate(crops[:args.epochs]):
+        print("epoch {:3d}: crop {:6d}, {:.2f} of a full-length epoch".format(
+            epoch, crop, step_time[crop] / full))
+    first = sum(step_time[c] for c in crops[:args.epochs]) / (args.epochs * full)
+    total = sum(step_time[c] for c in crops) / (len(crops) * full)
+    print("training compute vs fixed {}: first {} epochs {:.2f}, all {} epochs {:.2f}".format(
+        args.end, args.epochs, first, args.num_epochs, total))
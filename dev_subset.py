@@ -0,0 +1,119 @@
+"""
+Sampled dev validation with bootstrap intervals and early stopping.
+
+Each epoch scores a fixed, stratified subset of the dev protocol (the same
+fraction of every attack tag and of the bona fide trials, drawn once from
+`seed`) and reports the EER with a percentile bootstrap interval, resampled
+within each class. The full dev set is only scored when the interval
+reaches the best full-dev EER so far; an epoch whose whole interval lies
+above it cannot be a new best and skips the full pass. Enabled by
+
+    "dev_subset": {"fraction": 0.2, "seed": 0, "n_boot": 1000, "confidence": 0.95}
+
+EarlyStopping stops training once neither the dev EER nor the min t-DCF
+improved by min_delta for `patience` epochs:
+
+    "early_stopping": {"patience": 10, "min_delta": 0.0, "min_epochs": 0}
+"""
+
+import argparse
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from metrics import compute_eer, det_curve_sorted, eer_from_det
+from protocol_index import ProtocolIndex
+
+
+def stratified_subset(index: ProtocolIndex, fraction: float, seed: int = 0,
+                      min_per_stratum: int = 1) -> np.ndarray:
+    """Sorted protocol rows, `fraction` of every (key, tag) stratum"""
+    rng = np.random.default_rng(seed)
+    strata = index.key.astype(np.int64) * (len(index.tags) + 1) + index.tag
+    rows = []
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        n = min(len(members), max(min_per_stratum, int(round(fraction * len(members)))))
+        rows.append(rng.choice(members, n, replace=False))
+    return np.sort(np.concatenate(rows))
+
+
+def bootstrap_eer(bona: np.ndarray, spoof: np.ndarray, n_boot: int = 1000,
+                  confidence: float = 0.95, seed: int = 0) -> Tuple[float, float, float]:
+    """(EER, lower, upper) in %, classes resampled separately"""
+    rng = np.random.default_rng(seed)
+    bona = np.sort(np.asarray(bona, dtype=np.float64), kind="mergesort")
+    spoof = np.sort(np.asarray(spoof, dtype=np.float64), kind="mergesort")
+    eer = eer_from_det(*det_curve_sorted(bona, spoof))[0]
+    boot = np.empty(n_boot)
+    for i in range(n_boot):
+        # sorted index draws give sorted resamples without re-sorting the scores
+        b = bona[np.sort(rng.integers(0, bona.size, bona.size))]
+        s = spoof[np.sort(rng.integers(0, spoof.size, spoof.size))]
+        boot[i] = eer_from_det(*det_curve_sorted(b, s))[0]
+    tail = (1 - confidence) / 2 * 100
+    lower, upper = np.percentile(boot, [tail, 100 - tail])
+    return eer * 100, lower * 100, upper * 100
+
+
+def needs_full_dev(interval: Tuple[float, float, float], best_dev_eer: float) -> bool:
+    """False only when the whole interval lies above the best full-dev EER"""
+    return interval[1] <= best_dev_eer
+
+
+class EarlyStopping:
+    """Plateau detection on dev EER and min t-DCF (lower is better)"""
+
+    def __init__(self, patience: int = 10, min_delta: float = 0.0, min_epochs: int = 0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.min_epochs = min_epochs
+        self.best: Dict[str, float] = {"eer": np.inf, "tdcf": np.inf}
+        self.epochs = 0
+        self.bad_epochs = 0
+
+    def step(self, eer: Optional[float] = None, tdcf: Optional[float] = None) -> bool:
+        """
+        Records one epoch; None marks a metric that was not measured (full
+        dev skipped). Returns True when training should stop.
+        """
+        self.epochs += 1
+        improved = False
+        for name, value in [("eer", eer), ("tdcf", tdcf)]:
+            if value is not None and value < self.best[name] - self.min_delta:
+                self.best[name] = value
+                improved = True
+        self.bad_epochs = 0 if improved else self.bad_epochs + 1
+        return self.epochs >= self.min_epochs and self.bad_epochs >= self.patience
+
+
+if __name__ == "__main__":
+    # synthetic check: interval coverage of the full-set EER and cost per epoch
+    import time
+
+    parser = argparse.ArgumentParser(description="Bootstrap dev-subset EER check")
+    parser.add_argument("--n_bona", type=int, default=2548)
+    parser.add_argument("--n_spoof", type=int, default=22296)
+    parser.add_argument("--fraction", type=float, default=0.2)
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--n_boot", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    covered, widths, elapsed = 0, [], 0.
+    for trial in range(args.trials):
+        bona = rng.normal(2., 1., args.n_bona)
+        spoof = rng.normal(-1., 1.5, args.n_spoof)
+        full = 100 * compute_eer(bona, spoof)[0]
+        nb = int(args.fraction * args.n_bona)
+        ns = int(args.fraction * args.n_spoof)
+        start = time.perf_counter()
+        eer, lower, upper = bootstrap_eer(rng.choice(bona, nb, replace=False),
+                                          rng.choice(spoof, ns, replace=False),
+                                          n_boot=args.n_boot, seed=trial)
+        elapsed += time.perf_counter() - start
+        covered += lower <= full <= upper
+        widths.append(upper - lower)
+    print("full-set EER inside the 95% interval: {}/{}, mean width {:.3f} pt, "
+          "{:.1f} ms per bootstrap".format(covered, args.trials, np.mean(widths),
+                                           1e3 * elapsed / args.trials))
@@ -0,0 +1,395 @@
+"""
+last_hidden embedding index for nearest-neighbour attack attribution.
+
+extract  runs a checkpoint over a protocol-listed corpus and appends the
+         L2-normalised last_hidden vectors (float16) with utt_id and attack
+         tag to an embedding store directory:
+
+             emb.f16     (#rows, dim) float16, row-major
+             utt_id.bin  fixed-width ASCII utt_ids
+             tag.u2      uint16 codes into meta.json "tags"
+
+build    trains a spherical k-means coarse quantiser (IVF) on a sample and
+         writes int8 codes of the vectors reordered by inverted list, so
+         probing a list is one contiguous slice of a memory-mapped file:
+
+             ivf/centroids.npy  (n_lists, dim) float32
+             ivf/offsets.npy    (n_lists + 1,) list boundaries
+             ivf/rows.npy       store row of each reordered vector
+             ivf/codes.i8       reordered vectors, round(127 * v)
+
+         Probed lists are scanned on the int8 codes and the best candidates
+         are re-ranked with the float16 store rows.
+
+query    returns the nearest reference utterances (cosine) for every query
+         embedding and the attack tag with the highest summed similarity.
+
+    python embedding_index.py extract --config config/LSNet.conf --protocol train.trl.txt --output ref
+    python embedding_index.py build ref
+    python embedding_index.py extract --config config/LSNet.conf --protocol eval.trl.txt --output qry
+    python embedding_index.py query ref qry --output attribution.txt
+    python embedding_index.py bench --n 1000000
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+UTT_WIDTH = 16
+
+
+class EmbeddingStore:
+    """Appendable, memory-mappable float16 embedding matrix with metadata"""
+
+    def __init__(self, path, dim: Optional[int] = None, utt_width: int = UTT_WIDTH):
+        self.path = Path(path)
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path, "r") as f_json:
+                self.meta = json.loads(f_json.read())
+        else:
+            if dim is None:
+                raise ValueError("{} is not an embedding store".format(path))
+            self.meta = {"version": 1, "dim": dim, "utt_width": utt_width, "tags": [""]}
+            self._save_meta()
+        self.dim = self.meta["dim"]
+        self.utt_dtype = np.dtype("S{}".format(self.meta["utt_width"]))
+
+    def __len__(self):
+        emb_file = self.path / "emb.f16"
+        return emb_file.stat().st_size // (2 * self.dim) if emb_file.exists() else 0
+
+    def _save_meta(self):
+        tmp = self.path / "meta.json.tmp"
+        with open(tmp, "w") as f_json:
+            f_json.write(json.dumps(self.meta))
+        os.replace(tmp, self.path / "meta.json")
+
+    def append(self, utt_ids: Sequence[str], embeddings: np.ndarray,
+               tags: Optional[Sequence[str]] = None) -> None:
+        """Appends rows; emb.f16 is written last and commits the append"""
+        n = len(utt_ids)
+        if any(len(u) > self.meta["utt_width"] for u in utt_ids):
+            raise ValueError("utt_id longer than {} bytes".format(self.meta["utt_width"]))
+        vocab = self.meta["tags"]
+        if tags is None:
+            tag = np.zeros(n, dtype="<u2")
+        else:
+            new = sorted(set(tags) - set(vocab))
+            if new:
+                vocab.extend(new)
+                self._save_meta()
+            lookup = {v: i for i, v in enumerate(vocab)}
+            tag = np.array([lookup[t] for t in tags], dtype="<u2")
+        emb = np.asarray(embeddings, dtype=np.float32).reshape(n, self.dim)
+        emb = emb / np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        columns = [("utt_id.bin", np.asarray(utt_ids, dtype=self.utt_dtype), self.utt_dtype.itemsize),
+                   ("tag.u2", tag, 2),
+                   ("emb.f16", emb.astype("<f2"), 2 * self.dim)]
+        n_rows = len(self)
+        for name, values, row_bytes in columns:
+            with open(self.path / name, "ab") as fh:
+                # drop rows of an earlier, uncommitted append
+                fh.truncate(n_rows * row_bytes)
+                fh.seek(0, os.SEEK_END)
+                fh.write(values.tobytes())
+
+    def embeddings(self) -> np.ndarray:
+        n = len(self)
+        if n == 0:
+            return np.empty((0, self.dim), dtype="<f2")
+        return np.memmap(self.path / "emb.f16", dtype="<f2", mode="r", shape=(n, self.dim))
+
+    def utt_ids(self) -> np.ndarray:
+        n = len(self)
+        return np.fromfile(self.path / "utt_id.bin", dtype=self.utt_dtype,
+                           count=n).astype(str) if n else np.empty(0, dtype=str)
+
+    def tag_codes(self) -> np.ndarray:
+        n = len(self)
+        if n == 0:
+            return np.empty(0, dtype="<u2")
+        return np.memmap(self.path / "tag.u2", dtype="<u2", mode="r", shape=(n,))
+
+    def tag_names(self) -> np.ndarray:
+        return np.asarray(self.meta["tags"])
+
+
+def _kmeans(x: np.ndarray, n_lists: int, iters: int, seed: int) -> np.ndarray:
+    """Spherical k-means on unit rows; returns unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), n_lists, replace=False)].copy()
+    for _ in range(iters):
+        assign = _assign(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = np.bincount(assign, minlength=n_lists) == 0
+        # re-seed empty lists from random training rows
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        block = np.asarray(x[start:start + chunk], dtype=np.float32)
+        out[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+class IVFIndex:
+    """Inverted-file cosine index over an EmbeddingStore"""
+
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+        ivf = store.path / "ivf"
+        self.centroids = np.load(ivf / "centroids.npy")
+        self.offsets = np.load(ivf / "offsets.npy")
+        self.rows = np.load(ivf / "rows.npy", mmap_mode="r")
+        self.codes = np.memmap(ivf / "codes.i8", dtype=np.int8, mode="r",
+                               shape=(len(self.rows), store.dim))
+        self.emb = store.embeddings()
+        self.tags = store.tag_codes()
+        self.tag_names = store.tag_names()
+
+    @staticmethod
+    def build(store: EmbeddingStore, n_lists: Optional[int] = None, n_train: int = 262144,
+              iters: int = 10, seed: int = 0) -> "IVFIndex":
+        emb = store.embeddings()
+        n = len(emb)
+        if n == 0:
+            raise ValueError("{} is empty".format(store.path))
+        n_lists = min(n_lists or max(1, int(4 * np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, max(n_train, n_lists)), replace=False))
+        centroids = _kmeans(np.asarray(emb[sample], dtype=np.float32), n_lists, iters, seed)
+
+        assign = _assign(emb, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        ivf = store.path / "ivf"
+        os.makedirs(ivf, exist_ok=True)
+        codes = np.memmap(ivf / "codes.i8", dtype=np.int8, mode="w+", shape=emb.shape)
+        for start in range(0, n, 65536):
+            idx = order[start:start + 65536]
+            # gather in sorted row order, then scatter back into list order
+            srt = np.argsort(idx)
+            block = np.empty((len(idx), store.dim), dtype=np.float32)
+            block[srt] = emb[idx[srt]]
+            codes[start:start + len(idx)] = np.rint(127 * block).astype(np.int8)
+        codes.flush()
+        del codes
+        np.save(ivf / "centroids.npy", centroids)
+        np.save(ivf / "offsets.npy", offsets.astype(np.int64))
+        np.save(ivf / "rows.npy", order.astype(np.int64))
+        return IVFIndex(store)
+
+    def search(self, queries: np.ndarray, k: int = 10, nprobe: int = 8,
+               rerank: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (store rows, cosine similarities) of shape (#query, k); -1 pads short
+        results. The rerank * k best int8 candidates are re-scored in float16.
+        """
+        q = np.asarray(queries, dtype=np.float32).reshape(-1, self.store.dim)
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(q @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        out_rows = np.full((len(q), k), -1, dtype=np.int64)
+        out_sims = np.full((len(q), k), -np.inf, dtype=np.float32)
+        for i, lists in enumerate(probes):
+            spans = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+            pos = np.concatenate([np.arange(s, e) for s, e in spans])
+            if len(pos) == 0:
+                continue
+            cand = np.concatenate([self.codes[s:e] for s, e in spans]).astype(np.float32)
+            sims = cand @ q[i]
+            n_short = min(rerank * k, len(sims))
+            short = np.sort(self.rows[pos[np.argpartition(-sims, n_short - 1)[:n_short]]])
+            sims = np.asarray(self.emb[short], dtype=np.float32) @ q[i]
+            top = np.argpartition(-sims, min(k, len(sims)) - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            out_rows[i, :len(top)] = short[top]
+            out_sims[i, :len(top)] = sims[top]
+        return out_rows, out_sims
+
+    def attribute(self, queries: np.ndarray, k: int = 10,
+                  nprobe: int = 8) -> List[List[Tuple[str, float]]]:
+        """Per query, reference tags ranked by summed neighbour similarity"""
+        rows, sims = self.search(queries, k, nprobe)
+        results = []
+        for r, s in zip(rows, sims):
+            votes = {}
+            for row, sim in zip(r[r >= 0], s[r >= 0]):
+                tag = self.tag_names[self.tags[row]]
+                votes[tag] = votes.get(tag, 0.) + float(sim)
+            results.append(sorted(votes.items(), key=lambda kv: -kv[1]))
+        return results
+
+
+def extract_embeddings(data_loader, model, device, store: EmbeddingStore,
+                       tag_of: Optional[dict] = None) -> None:
+    """Appends last_hidden of every utterance in data_loader to store"""
+    import torch
+    from tqdm import tqdm
+
+    model.eval()
+    with torch.no_grad():
+        for batch_x, _, utt_id in tqdm(data_loader):
+            last_hidden, _ = model(batch_x.to(device))
+            tags = [tag_of[u] for u in utt_id] if tag_of is not None else None
+            store.append(list(utt_id), last_hidden.float().cpu().numpy(), tags)
+
+
+def run_extract(args: argparse.Namespace) -> None:
+    import torch
+    from torch.utils.data import DataLoader
+
+    from data_utils import Dataset_ASVspoof2019_devNeval
+    from model_factory import get_model
+    from protocol_index import load_protocol
+
+    with open(args.config, "r") as f_json:
+        config = json.loads(f_json.read())
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = get_model(config["model_config"], device)
+    model.load_state_dict(torch.load(args.model_path or config["model_path"],
+                                     map_location=device))
+
+    index = load_protocol(args.protocol)
+    d_meta, file_list = index.spoof_list()
+    # bona fide rows carry "-" as attack tag in the 2019 protocols
+    tags = np.where(index.key_names() == "bonafide", "bonafide", index.tag_names())
+    dataset = Dataset_ASVspoof2019_devNeval(list_IDs=file_list, labels=d_meta,
+                                            base_dir=Path(args.database_path or
+                                                          config["database_path"]))
+    loader = DataLoader(dataset, batch_size=config["batch_size"], shuffle=False,
+                        drop_last=False, pin_memory=True, num_workers=args.num_workers)
+    store = EmbeddingStore(args.output, dim=config["model_config"]["gat_dims"][1] * 5)
+    extract_embeddings(loader, model, device, store, dict(zip(file_list, tags.tolist())))
+    print("{} embeddings in {}".format(len(store), args.output))
+
+
+def run_build(args: argparse.Namespace) -> None:
+    store = EmbeddingStore(args.store)
+    start = time.perf_counter()
+    index = IVFIndex.build(store, args.n_lists, args.n_train, args.iters, args.seed)
+    print("{} vectors, {} lists, built in {:.1f} s".format(
+        len(index.rows), len(index.centroids), time.perf_counter() - start))
+
+
+def run_query(args: argparse.Namespace) -> None:
+    index = IVFIndex(EmbeddingStore(args.store))
+    queries = EmbeddingStore(args.queries)
+    emb = queries.embeddings()
+    with open(args.output, "w") as fh:
+        for utt_id, start in zip(queries.utt_ids(), range(len(emb))):
+            votes = index.attribute(emb[start:start + 1], args.k, args.nprobe)[0]
+            fh.write("{} {}\n".format(utt_id, " ".join(
+                "{}:{:.3f}".format(tag, score) for tag, score in votes)))
+    print("Attributions saved to {}".format(args.output))
+
+
+def _exact_search(emb: np.ndarray, queries: np.ndarray, k: int, chunk: int = 65536) -> np.ndarray:
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    best_rows = np.empty((len(q), 0), dtype=np.int64)
+    best_sims = np.empty((len(q), 0), dtype=np.float32)
+    for start in range(0, len(emb), chunk):
+        sims = np.concatenate([best_sims, q @ np.asarray(emb[start:start + chunk],
+                                                         dtype=np.float32).T], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(
+            np.arange(start, min(start + chunk, len(emb))), (len(q), sims.shape[1] - best_rows.shape[1]))],
+            axis=1)
+        top = np.argpartition(-sims, min(k, sims.shape[1]) - 1, axis=1)[:, :k]
+        best_rows = np.take_along_axis(rows, top, axis=1)
+        best_sims = np.take_along_axis(sims, top, axis=1)
+    return best_rows
+
+
+def run_bench(args: argparse.Namespace) -> None:
+    """Synthetic clustered vectors: build time, query latency and recall@k"""
+    import tempfile
+
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = EmbeddingStore(tmp, dim=args.dim)
+        # attack clusters with low intrinsic dimension, like trained embeddings
+        centers = rng.standard_normal((64, args.dim)).astype(np.float32)
+        basis = rng.standard_normal((16, args.dim)).astype(np.float32) / 4
+        for start in range(0, args.n, 100000):
+            n = min(100000, args.n - start)
+            c = rng.integers(0, len(centers), n)
+            x = centers[c] + rng.standard_normal((n, 16)).astype(np.float32) @ basis
+            store.append(["u{}".format(start + i) for i in range(n)], x,
+                         ["A{:02d}".format(v % 20) for v in c])
+        start = time.perf_counter()
+        index = IVFIndex.build(store, args.n_lists, args.n_train, args.iters, args.seed)
+        print("build: {} vectors, {} lists, {:.1f} s".format(
+            args.n, len(index.centroids), time.perf_counter() - start))
+
+        emb = store.embeddings()
+        queries = np.asarray(emb[rng.choice(args.n, args.queries, replace=False)], dtype=np.float32)
+        queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+        exact = _exact_search(emb, queries, args.k)
+        latencies, hits = [], 0
+        for q, truth in zip(queries, exact):
+            start = time.perf_counter()
+            rows, _ = index.search(q, args.k, args.nprobe)
+            latencies.append(time.perf_counter() - start)
+            hits += len(set(truth.tolist()) & set(rows[0].tolist()))
+        lat = np.asarray(latencies) * 1e3
+        print("query: p50 {:.3f} ms, p99 {:.3f} ms, recall@{} {:.3f} (nprobe {})".format(
+            np.percentile(lat, 50), np.percentile(lat, 99), args.k,
+            hits / (args.k * len(queries)), args.nprobe))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="last_hidden embedding index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("extract", help="append last_hidden of a protocol to a store")
+    p.add_argument("--config", type=str, required=True)
+    p.add_argument("--model_path", type=str, default=None)
+    p.add_argument("--protocol", type=str, required=True, help="CM protocol of the corpus")
+    p.add_argument("--database_path", type=str, default=None,
+                   help="audio directory (default: config database_path)")
+    p.add_argument("--output", type=str, required=True, help="embedding store directory")
+    p.add_argument("--num_workers", type=int, default=4)
+    p.set_defaults(func=run_extract)
+
+    p = sub.add_parser("build", help="build the IVF index of a store")
+    p.add_argument("store", type=str)
+    p.add_argument("--n_lists", type=int, default=None, help="default: 4 * sqrt(#vectors)")
+    p.add_argument("--n_train", type=int, default=262144, help="k-means sample size")
+    p.add_argument("--iters", type=int, default=10)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=run_build)
+
+    p = sub.add_parser("query", help="attribute query embeddings to reference attacks")
+    p.add_argument("store", type=str, help="indexed reference store")
+    p.add_argument("queries", type=str, help="store of the scored utterances")
+    p.add_argument("--output", type=str, required=True)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nprobe", type=int, default=8)
+    p.set_defaults(func=run_query)
+
+    p = sub.add_parser("bench", help="synthetic build / query benchmark")
+    p.add_argument("--n", type=int, default=1000000)
+    p.add_argument("--dim", type=int, default=160)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nprobe", type=int, default=8)
+    p.add_argument("--n_lists", type=int, default=None)
+    p.add_argument("--n_train", type=int, default=262144)
+    p.add_argument("--iters", type=int, default=10)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=run_bench)
+
+    args = parser.parse_args()
+    args.func(args)
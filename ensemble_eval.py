@@ -0,0 +1,109 @@
+"""
+Score several checkpoints of one architecture in a single pass.
+
+Each batch is decoded once and run through the fixed sinc front end
+(Model.front_end) once; the result is fanned out to every model's
+forward_features. Per-model score files and a fused (mean) score file are
+written, and EER / min t-DCF are reported for each.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from metrics import calculate_tDCF_EER_from_scores
+from protocol_index import load_protocol
+from score_io import write_scores
+
+
+def load_models(model_config, checkpoints: List[str], device):
+    from model_factory import get_model
+
+    models = []
+    for path in checkpoints:
+        model = get_model(model_config, device)
+        model.load_state_dict(torch.load(path, map_location=device))
+        models.append(model.eval())
+        print("Model loaded : {}".format(path))
+    ref = models[0].conv_time
+    for model in models[1:]:
+        conv = model.conv_time
+        if (conv.kernel_size, conv.stride, conv.padding, conv.dilation) != \
+                (ref.kernel_size, ref.stride, ref.padding, ref.dilation) or \
+                not torch.equal(conv.band_pass, ref.band_pass):
+            raise ValueError("Checkpoints do not share the same front end")
+    return models
+
+
+def score_ensemble(data_loader, models, device):
+    """Returns (utt_ids, scores of shape (#models, #utt))"""
+    fname_list = []
+    score_list = [[] for _ in models]
+    with torch.no_grad():
+        for batch_x, _, utt_id in tqdm(data_loader):
+            x_front = models[0].front_end(batch_x.to(device))
+            for i, model in enumerate(models):
+                # x_front is not modified: first_bn returns a new tensor
+                _, batch_out = model.forward_features(x_front)
+                score_list[i].append(batch_out[:, 1].data.cpu().numpy().ravel())
+            fname_list.extend(utt_id)
+    return fname_list, np.stack([np.concatenate(s) for s in score_list])
+
+
+def main(args: argparse.Namespace) -> None:
+    from main import get_loader
+
+    with open(args.config, "r") as f_json:
+        config = json.loads(f_json.read())
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu":
+        from autotune import apply_tuned_config
+        apply_tuned_config()
+    output_dir = Path(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    database_logical_path = Path(config["database_logical_path"])
+    track = config["track"]
+    trial_path = (database_logical_path /
+                  "ASVspoof2019_{}_cm_protocols/partASVspoof2019.{}.cm.{}.trl.txt".format(
+                      track, track, args.subset))
+    _, dev_loader, eval_loader = get_loader(Path(config["database_path"]), database_logical_path,
+                                            args.seed, config)
+    data_loader = dev_loader if args.subset == "dev" else eval_loader
+
+    models = load_models(config["model_config"], args.checkpoints, device)
+    fname_list, scores = score_ensemble(data_loader, models, device)
+
+    trial_index = load_protocol(trial_path)
+    assert fname_list == trial_index.utt_ids.tolist()
+    tags = trial_index.tag_names()
+    keys = trial_index.key_names()
+
+    names = [Path(p).stem for p in args.checkpoints] + ["fused"]
+    all_scores = list(scores) + [scores.mean(axis=0)]
+    for name, model_scores in zip(names, all_scores):
+        save_path = output_dir / "{}_{}_score.txt".format(args.subset, name)
+        write_scores(save_path, fname_list, model_scores.tolist(), tags.tolist(), keys.tolist(),
+                     fmt=config.get("score_format", "text"))
+        eer, tdcf = calculate_tDCF_EER_from_scores(
+            model_scores, keys, tags,
+            asv_score_file=database_logical_path / config["asv_score_path"],
+            output_file=output_dir / "{}_{}_t-DCF_EER.txt".format(args.subset, name),
+            printout=False)
+        print("{}: eer {:.3f}, min t-DCF {:.5f}".format(name, eer, tdcf))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-checkpoint ensemble evaluation")
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--checkpoints", type=str, nargs="+", required=True)
+    parser.add_argument("--output_dir", type=str, default="./exp_result/ensemble")
+    parser.add_argument("--subset", type=str, default="eval", choices=["dev", "eval"])
+    parser.add_argument("--seed", type=int, default=688)
+    main(parser.parse_args())
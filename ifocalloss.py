@@ -1,30 +1,131 @@
-class I-FocalLoss(nn.Module):
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+E = 2.718
+
+
+class IFocalLoss(nn.Module):
 
     def __init__(self, alpha=0.1, gamma=1): # 定义alpha和gamma变量
-        super(BinaryFocalLoss3, self).__init__()
+        super(IFocalLoss, self).__init__()
         self.alpha = alpha
         self.gamma = gamma
 
     # 前向传播
     def forward(self, preds, labels):
-        eps = 1e-7  # 防止数值超出定义域
-        preds = F.softmax(preds, dim=-1)
-        # preds = torch.sigmoid(preds)
-        labels = labels.view(-1, 1)
-        print("labels:",labels)
-        print(labels.shape)
-        # 开始
-        # log = torch.log(preds)
-        # print("log:",log)
-
-        
-        loss_y1 = -1 * self.alpha * 2.718 * torch.pow((1 - preds), self.gamma) * torch.log(preds + eps) * labels
-        # print("loss_y1:",loss_y1)
-
-        loss_y0 = -1 * (1-self.alpha) * 2.718 * torch.pow(preds, self.gamma) * torch.log(1 - preds + eps) * (1 - labels)
-        # print("loss_y0:", loss_y0)
-
-        loss = loss_y0 + loss_y1
-        # print("loss:", loss)
-        
-        return torch.mean(loss, dim=0, keepdim=True)[0, 1]
+        '''
+        preds   :(#bs, 2) logits
+        labels  :(#bs,) 1 for bona fide, 0 for spoof
+        Only the bona fide column of the focal loss is returned, so it is
+        computed from log_softmax directly (log(1 - p1) == log p0).
+        '''
+        log_p = F.log_softmax(preds, dim=-1)
+        labels = labels.view(-1).to(preds.dtype)
+        p1 = log_p[:, 1].exp()
+        p0 = log_p[:, 0].exp()
+
+        loss_y1 = -1 * self.alpha * E * torch.pow(p0, self.gamma) * log_p[:, 1] * labels
+        loss_y0 = -1 * (1 - self.alpha) * E * torch.pow(p1, self.gamma) * log_p[:, 0] * (1 - labels)
+
+        return torch.mean(loss_y0 + loss_y1)
+
+
+class _FocalDistillationFn(torch.autograd.Function):
+    """
+    beta * MSE(teacher, student) + (1 - beta) * I-FocalLoss in one pass.
+    The gradient w.r.t. the student logits is formed in forward and only
+    scaled in backward; the teacher logits get no gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, preds, labels, t_preds, alpha, gamma, beta, weight):
+        n = preds.size(0)
+        log_p = F.log_softmax(preds, dim=-1)
+        log_p0, log_p1 = log_p[:, 0], log_p[:, 1]
+        p0, p1 = log_p0.exp(), log_p1.exp()
+        y = labels.view(-1).to(preds.dtype)
+        c1 = alpha * E * y
+        c0 = (1 - alpha) * E * (1 - y)
+        p0_g, p1_g = torch.pow(p0, gamma), torch.pow(p1, gamma)
+
+        focal = -(c1 * p0_g * log_p1 + c0 * p1_g * log_p0)
+        diff = preds - t_preds
+        # per-sample terms; their mean is beta * MSE + (1 - beta) * focal mean
+        sample_loss = beta * diff.pow(2).mean(dim=1) + (1 - beta) * focal
+        w = torch.ones_like(focal) if weight is None else weight.to(preds.dtype)
+        loss = (w * sample_loss).mean()
+
+        # d focal / d (z1 - z0), with p1 = sigmoid(z1 - z0)
+        d_focal = -c1 * (p0 * p0_g - gamma * p0_g * p1 * log_p1) \
+            + c0 * (p1 * p1_g - gamma * p1_g * p0 * log_p0)
+        grad = diff * (2 * beta / diff.numel())
+        d_focal = d_focal * ((1 - beta) / n)
+        grad[:, 1] += d_focal
+        grad[:, 0] -= d_focal
+        if weight is not None:
+            grad *= w.unsqueeze(1)
+        ctx.save_for_backward(grad)
+        ctx.mark_non_differentiable(sample_loss)
+        return loss, sample_loss
+
+    @staticmethod
+    def backward(ctx, grad_output, _grad_sample_loss):
+        grad, = ctx.saved_tensors
+        return grad * grad_output, None, None, None, None, None, None
+
+
+class FocalDistillationLoss(nn.Module):
+    """
+    Fused distillation (MSE to teacher logits) plus I-FocalLoss.
+    weight: optional (#bs,) per-sample weights (e.g. importance weights of
+    an adaptive sampler). The unweighted per-sample losses of the last call
+    are kept in self.sample_loss.
+    """
+
+    def __init__(self, alpha=0.1, gamma=1, beta=0.5):
+        super(FocalDistillationLoss, self).__init__()
+        self.alpha = alpha
+        self.gamma = gamma
+        self.beta = beta
+        self.sample_loss = None
+
+    def forward(self, preds, labels, t_preds, weight=None):
+        assert preds.size(-1) == 2, "binary logits expected"
+        loss, self.sample_loss = _FocalDistillationFn.apply(
+            preds, labels, t_preds.detach(), self.alpha, self.gamma, self.beta, weight)
+        return loss
+
+
+def _reference_loss(preds, labels, t_preds, alpha=0.1, gamma=1, beta=0.5):
+    # previous train_epoch path: softmax + log focal term, separate MSELoss
+    eps = 1e-7
+    p = F.softmax(preds, dim=-1)
+    y = labels.view(-1, 1).to(preds.dtype)
+    loss_y1 = -1 * alpha * E * torch.pow((1 - p), gamma) * torch.log(p + eps) * y
+    loss_y0 = -1 * (1 - alpha) * E * torch.pow(p, gamma) * torch.log(1 - p + eps) * (1 - y)
+    focal = torch.mean(loss_y0 + loss_y1, dim=0, keepdim=True)[0, 1]
+    return beta * nn.MSELoss()(t_preds, preds) + (1 - beta) * focal
+
+
+if __name__ == "__main__":
+    # loss step cost; the gradient checks are in tests/test_ifocalloss.py
+    import time
+
+    torch.manual_seed(0)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    preds = torch.randn(32, 2, device=device, requires_grad=True)
+    labels = torch.randint(0, 2, (32,), device=device)
+    t_preds = torch.randn(32, 2, device=device)
+    fused_loss = FocalDistillationLoss()
+    for name, fn in [("reference", lambda: _reference_loss(preds, labels, t_preds)),
+                     ("fused", lambda: fused_loss(preds, labels, t_preds))]:
+        for i in range(1100):
+            if i == 100:
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+            fn().backward()
+        if device == "cuda":
+            torch.cuda.synchronize()
+        print("{} loss step: {:.1f} us".format(name, (time.perf_counter() - start) * 1e3))
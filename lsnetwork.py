@@ -10,15 +10,26 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch import Tensor
-import fairseq
-from torchstat import stat
-from thop import profile
-import time
+from torch.utils.checkpoint import checkpoint
 
-from main import get_model
-import json
+# profiling / training modules (thop, main) are only imported under __main__
+# so the model definitions stay cheap to import for inference
 
 
+def _fused_project(x, att_map, with_att, without_att):
+    '''
+    with_att(A x) + without_att(x) as one GEMM with the stacked weights:
+    (A x) W1' + x W2' + b1 + b2 == A (x W1') + (x W2' + b1 + b2)
+    x       :(#bs, #node, #in_dim)
+    att_map :(#bs, #node, #node, 1)
+    The stacked weights are rebuilt on every call (not cached), so weights
+    written through .data (SWA swap_swa_sgd, load_state_dict) are always seen.
+    '''
+    weight = torch.cat([with_att.weight, without_att.weight])
+    bias = torch.cat([torch.zeros_like(with_att.bias), with_att.bias + without_att.bias])
+    out_dim = with_att.out_features
+    y = F.linear(x, weight, bias)
+    return torch.baddbmm(y[..., out_dim:], att_map.squeeze(-1), y[..., :out_dim])
 
 
 class GraphAttentionLayer(nn.Module):
@@ -47,15 +58,19 @@ class GraphAttentionLayer(nn.Module):
         if "temperature" in kwargs:
             self.temp = kwargs["temperature"]
 
-    def forward(self, x):
+        # single GEMM for proj_with_att + proj_without_att
+        self.fused = True
+
+    def forward(self, x, mask=None):
         '''
         x   :(#bs, #node, #dim)
+        mask:(#bs, #node) bool, False for padded nodes (or None)
         '''
         # apply input dropout
         x = self.input_drop(x)
 
         # derive attention map
-        att_map = self._derive_att_map(x)
+        att_map = self._derive_att_map(x, mask)
 
         # projection
         x = self._project(x, att_map)
@@ -79,25 +94,32 @@ class GraphAttentionLayer(nn.Module):
 
         return x * x_mirror
 
-    def _derive_att_map(self, x):
+    def _derive_att_map(self, x, mask=None):
         '''
         x           :(#bs, #node, #dim)
         out_shape   :(#bs, #node, #node, 1)
         '''
         att_map = self._pairwise_mul_nodes(x)
         # size: (#bs, #node, #node, #dim_out)
-        att_map = torch.tanh(self.att_proj(att_map))
+        # in place on the fresh Linear / matmul outputs, which their own
+        # backward does not need
+        att_map = self.att_proj(att_map).tanh_()
         # size: (#bs, #node, #node, 1)
         att_map = torch.matmul(att_map, self.att_weight)
 
         # apply temperature
-        att_map = att_map / self.temp
+        att_map = att_map.div_(self.temp)
 
+        if mask is not None:
+            # padded nodes are never attended to
+            att_map = att_map.masked_fill(~mask[:, None, :, None], float("-inf"))
         att_map = F.softmax(att_map, dim=-2)
 
         return att_map
 
     def _project(self, x, att_map):
+        if self.fused:
+            return _fused_project(x, att_map, self.proj_with_att, self.proj_without_att)
         x1 = self.proj_with_att(torch.matmul(att_map.squeeze(-1), x))
         x2 = self.proj_without_att(x)
 
@@ -154,10 +176,14 @@ class HtrgGraphAttentionLayer(nn.Module):
         if "temperature" in kwargs:
             self.temp = kwargs["temperature"]
 
-    def forward(self, x1, x2, master=None):
+        # single GEMMs for the node and master projections
+        self.fused = True
+
+    def forward(self, x1, x2, master=None, mask1=None):
         '''
         x1  :(#bs, #node, #dim)
         x2  :(#bs, #node, #dim)
+        mask1:(#bs, #node) bool, False for padded x1 nodes (or None)
         '''
         num_type1 = x1.size(1)
         num_type2 = x2.size(1)
@@ -166,19 +192,25 @@ class HtrgGraphAttentionLayer(nn.Module):
         x2 = self.proj_type2(x2)
 
         x = torch.cat([x1, x2], dim=1)
-     
+        mask = None
+        if mask1 is not None:
+            mask = torch.cat([mask1, mask1.new_ones(mask1.size(0), num_type2)], dim=1)
 
         if master is None:
-            master = torch.mean(x, dim=1, keepdim=True)
+            if mask is None:
+                master = torch.mean(x, dim=1, keepdim=True)
+            else:
+                w = mask.unsqueeze(-1).to(x.dtype)
+                master = (x * w).sum(dim=1, keepdim=True) / w.sum(dim=1, keepdim=True)
 
         # apply input dropout
         x = self.input_drop(x)
 
         # derive attention map
-        att_map = self._derive_att_map(x, num_type1, num_type2)
+        att_map = self._derive_att_map(x, num_type1, num_type2, mask)
 
         # directional edge for master node
-        master = self._update_master(x, master)
+        master = self._update_master(x, master, mask)
 
         # projection
         x = self._project(x, att_map)
@@ -196,9 +228,9 @@ class HtrgGraphAttentionLayer(nn.Module):
 
 
 
-    def _update_master(self, x, master):
+    def _update_master(self, x, master, mask=None):
 
-        att_map = self._derive_att_map_master(x, master)
+        att_map = self._derive_att_map_master(x, master, mask)
         master = self._project_master(x, master, att_map)
 
         return master
@@ -217,31 +249,33 @@ class HtrgGraphAttentionLayer(nn.Module):
 
         return x * x_mirror
 
-    def _derive_att_map_master(self, x, master):
+    def _derive_att_map_master(self, x, master, mask=None):
         '''
         x           :(#bs, #node, #dim)
         out_shape   :(#bs, #node, #node, 1)
         '''
         att_map = x * master
-        att_map = torch.tanh(self.att_projM(att_map))
+        att_map = self.att_projM(att_map).tanh_()
 
         att_map = torch.matmul(att_map, self.att_weightM)
 
         # apply temperature
-        att_map = att_map / self.temp
+        att_map = att_map.div_(self.temp)
 
+        if mask is not None:
+            att_map = att_map.masked_fill(~mask.unsqueeze(-1), float("-inf"))
         att_map = F.softmax(att_map, dim=-2)
 
         return att_map
 
-    def _derive_att_map(self, x, num_type1, num_type2):
+    def _derive_att_map(self, x, num_type1, num_type2, mask=None):
         '''
         x           :(#bs, #node, #dim)
         out_shape   :(#bs, #node, #node, 1)
         '''
         att_map = self._pairwise_mul_nodes(x)
         # size: (#bs, #node, #node, #dim_out)
-        att_map = torch.tanh(self.att_proj(att_map))
+        att_map = self.att_proj(att_map).tanh_()
         # size: (#bs, #node, #node, 1)
 
         att_board = torch.zeros_like(att_map[:, :, :, 0]).unsqueeze(-1)
@@ -260,22 +294,32 @@ class HtrgGraphAttentionLayer(nn.Module):
         # att_map = torch.matmul(att_map, self.att_weight12)
 
         # apply temperature
-        att_map = att_map / self.temp
+        att_map = att_map.div_(self.temp)
 
+        if mask is not None:
+            att_map = att_map.masked_fill(~mask[:, None, :, None], float("-inf"))
         att_map = F.softmax(att_map, dim=-2)
 
         return att_map
 
     def _project(self, x, att_map):
+        if self.fused:
+            return _fused_project(x, att_map, self.proj_with_att, self.proj_without_att)
         x1 = self.proj_with_att(torch.matmul(att_map.squeeze(-1), x))
         x2 = self.proj_without_att(x)
 
         return x1 + x2
 
     def _project_master(self, x, master, att_map):
-
-        x1 = self.proj_with_attM(torch.matmul(
-            att_map.squeeze(-1).unsqueeze(1), x))
+        pooled = torch.matmul(att_map.squeeze(-1).unsqueeze(1), x)
+        if self.fused:
+            # one GEMM on [pooled, master] with [W1 W2] and b1 + b2
+            weight = torch.cat([self.proj_with_attM.weight, self.proj_without_attM.weight], dim=1)
+            bias = self.proj_with_attM.bias + self.proj_without_attM.bias
+            master = master.expand(pooled.size(0), -1, -1)
+            return F.linear(torch.cat([pooled, master], dim=-1), weight, bias)
+
+        x1 = self.proj_with_attM(pooled)
         x2 = self.proj_without_attM(master)
 
         return x1 + x2
@@ -303,21 +347,25 @@ class GraphPool(nn.Module):
         self.drop = nn.Dropout(p=p) if p > 0 else nn.Identity()
         self.in_dim = in_dim
 
-    def forward(self, h):
+    def forward(self, h, k=None, max_nodes=None, mask=None):
         Z = self.drop(h)
         weights = self.proj(Z)
         scores = self.sigmoid(weights)
-        new_h = self.top_k_graph(scores, h, self.k)
+        k = self.k if k is None else k
+        if mask is not None:
+            return self.masked_top_k_graph(scores, h, k, mask, max_nodes)
+        new_h = self.top_k_graph(scores, h, k, max_nodes)
 
         return new_h
 
-    def top_k_graph(self, scores, h, k):
+    def top_k_graph(self, scores, h, k, max_nodes=None):
         """
         args
         =====
         scores: attention-based weights (#bs, #node, 1)
         h: graph data (#bs, #node, #dim)
         k: ratio of remaining nodes, (float)
+        max_nodes: upper bound on remaining nodes, (int or None)
 
         returns
         =====
@@ -325,6 +373,8 @@ class GraphPool(nn.Module):
         """
         _, n_nodes, n_feat = h.size()
         n_nodes = max(int(n_nodes * k), 1)
+        if max_nodes is not None:
+            n_nodes = max(min(n_nodes, max_nodes), 1)
         _, idx = torch.topk(scores, n_nodes, dim=1)
         idx = idx.expand(-1, -1, n_feat)
 
@@ -333,6 +383,30 @@ class GraphPool(nn.Module):
 
         return h
 
+    def masked_top_k_graph(self, scores, h, k, mask, max_nodes=None):
+        """
+        top_k_graph over the valid nodes of each graph; each keeps
+        max(int(#valid * k), 1) nodes, as top_k_graph does at its natural size.
+        mask: (#bs, #node) bool, False for padded nodes
+
+        returns
+        =====
+        h: (#bs, max #kept, #dim), mask: (#bs, max #kept)
+        """
+        n_feat = h.size(2)
+        n_keep = (mask.sum(dim=1).to(torch.float64) * k).long().clamp_min(1)
+        if max_nodes is not None:
+            n_keep = n_keep.clamp(max=max(max_nodes, 1))
+        masked = scores.masked_fill(~mask.unsqueeze(-1), float("-inf"))
+        _, idx = torch.topk(masked, int(n_keep.max()), dim=1)
+        idx = idx.expand(-1, -1, n_feat)
+
+        h = h * scores
+        h = torch.gather(h, 1, idx)
+        new_mask = torch.arange(idx.size(1), device=h.device)[None, :] < n_keep[:, None]
+
+        return h, new_mask
+
 
 class CONV(nn.Module):
     @staticmethod
@@ -386,7 +460,10 @@ class CONV(nn.Module):
         self.mel = filbandwidthsf
         self.hsupp = torch.arange(-(self.kernel_size - 1) / 2,
                                   (self.kernel_size - 1) / 2 + 1)
-        self.band_pass = torch.zeros(self.out_channels, self.kernel_size)
+        # fixed filters: a buffer so model.to(device) moves them once; not
+        # persistent, so state_dict keys stay those of the checkpoints
+        self.register_buffer("band_pass", torch.zeros(self.out_channels, self.kernel_size),
+                             persistent=False)
         for i in range(len(self.mel) - 1):
             fmin = self.mel[i]
             fmax = self.mel[i + 1]
@@ -399,14 +476,14 @@ class CONV(nn.Module):
             self.band_pass[i, :] = Tensor(np.hamming(self.kernel_size)) * Tensor(hideal)
 
     def forward(self, x, mask=False):
-        band_pass_filter = self.band_pass.clone().to(x.device)
+        band_pass_filter = self.band_pass
         if mask:
+            # copy before zeroing bands; the unmasked path uses the filters as is
+            band_pass_filter = band_pass_filter.clone()
             A = np.random.uniform(0, 20)
             A = int(A)
             A0 = random.randint(0, band_pass_filter.shape[0] - A)
             band_pass_filter[A0:A0 + A, :] = 0
-        else:
-            band_pass_filter = band_pass_filter
 
         self.filters = (band_pass_filter).view(self.out_channels, 1, self.kernel_size)
 
@@ -453,18 +530,27 @@ class Residual_block(nn.Module):
         
         self.mp = nn.MaxPool2d((1, 3))
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
+        '''
+        mask    :(#bs, 1, 1, #seq), 0. for padded frames (or None); padded
+                 frames are zeroed before every conv so they act like the
+                 convs' own zero padding at the natural length
+        '''
+        if mask is not None:
+            x = x * mask
         identity = x
         
-        if not self.first:
+        if not self.first and self.training:
+            # conv1 reads x, so this only updates the bn1 running stats;
+            # skipped in eval where it has no effect
             out = self.bn1(x)
             out = self.selu(out)
-        else:
-            out = x
         out = self.conv1(x)
        
         out = self.bn2(out)
         out = self.selu(out)
+        if mask is not None:
+            out = out * mask
         out = self.conv2(out)
        
         if self.downsample:
@@ -502,7 +588,8 @@ class Model(nn.Module):
             nn.Sequential(Residual_block(nb_filts=filts[4]))
         )
 
-        self.pos_S = nn.Parameter(torch.randn(1, 23, filts[-1][-1]))
+        # spectral nodes: filts[0] sinc bands max-pooled by 3 in the front end
+        self.pos_S = nn.Parameter(torch.randn(1, filts[0] // 3, filts[-1][-1]))
         self.master1 = nn.Parameter(torch.randn(1, 1, gat_dims[0]))  #[1,1,64]
         self.master2 = nn.Parameter(torch.randn(1, 1, gat_dims[0]))
 
@@ -533,73 +620,229 @@ class Model(nn.Module):
 
         self.out_layer = nn.Linear(5 * gat_dims[1], 2)    #160-->2
 
-    def forward(self, x, Freq_aug=False):
+        # activation checkpointing: "encoder" (or "encoder.<i>"), "gat" (or
+        # "gat_S" / "gat_T"), "htrg" (or "htrg1" / "htrg2")
+        self.checkpoint_segments = set(d_args.get("checkpoint", []))
+
+        # inference-time GraphPool ratios / node caps, see set_pool_ratios
+        self.pool_override = (None, None)
+
+        self.set_fused_projections(d_args.get("fused_projections", True))
+
+        self.channels_last = False
+        self.set_channels_last(d_args.get("channels_last_encoder", False))
+
+    def set_channels_last(self, enabled=True):
+        '''
+        Runs first_bn and the Residual_block stack in channels_last (NHWC)
+        layout, which oneDNN's CPU convs and pools prefer; the encoder output
+        is made contiguous again before the max readouts. Converts the
+        encoder conv weights in place; values and state_dict keys are unchanged.
+        '''
+        self.channels_last = enabled
+        self.encoder.to(memory_format=torch.channels_last if enabled else torch.contiguous_format)
+
+    def set_fused_projections(self, enabled=True):
+        '''
+        Runs the paired projection Linears of the GAT / Htrg layers as
+        single GEMMs. Parameters and state_dict keys are the same either way.
+        '''
+        for module in self.modules():
+            if isinstance(module, (GraphAttentionLayer, HtrgGraphAttentionLayer)):
+                module.fused = enabled
+
+    def set_pool_ratios(self, pool_ratios=None, max_nodes=None):
+        '''
+        Overrides the GraphPool settings of this instance; both None
+        restores the constructed ones. Per-call arguments of forward take
+        precedence.
+        pool_ratios :[S, T, hS/hT(, unused)] as in model_config
+        max_nodes   :[S, T, hS, hT] upper bounds on kept nodes (None = no cap)
+        '''
+        self.pool_override = (pool_ratios, max_nodes)
+
+    def _pool_settings(self, pool_ratios, max_nodes):
+        if pool_ratios is None and max_nodes is None:
+            pool_ratios, max_nodes = self.pool_override
+        ratios = pool_ratios or [None] * 3
+        caps = max_nodes or [None] * 4
+        return {"S": (ratios[0], caps[0]), "T": (ratios[1], caps[1]),
+                "hS": (ratios[2], caps[2]), "hT": (ratios[2], caps[3])}
+
+    def _use_checkpoint(self, name):
+        if not (self.checkpoint_segments and self.training and torch.is_grad_enabled()):
+            return False
+        groups = {name, name.split(".")[0].rstrip("0123456789"), name.split("_")[0]}
+        return bool(groups & self.checkpoint_segments)
+
+    def _segment(self, name, modules, fn, *args):
+        '''
+        Runs fn(*args), recomputing it in backward when the segment is
+        checkpointed. BatchNorm running stats of modules are restored
+        after the recompute so they are only updated once per step.
+        '''
+        if not self._use_checkpoint(name):
+            return fn(*args)
+        state = {"recompute": False}
+
+        def run(*inputs):
+            if not state["recompute"]:
+                state["recompute"] = True
+                return fn(*inputs)
+            bns = [m for mod in modules for m in mod.modules()
+                   if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+            saved = [(m.running_mean.clone(), m.running_var.clone(),
+                      m.num_batches_tracked.clone()) for m in bns]
+            try:
+                # recomputation may stop early by raising, so restore in finally
+                return fn(*inputs)
+            finally:
+                with torch.no_grad():
+                    for m, (mean, var, nbt) in zip(bns, saved):
+                        m.running_mean.copy_(mean)
+                        m.running_var.copy_(var)
+                        m.num_batches_tracked.copy_(nbt)
+
+        return checkpoint(run, *args, use_reentrant=False)
+
+    def _htrg_branch(self, out_T, out_S, master, layer1, pool_hS, pool_hT, layer2, pools,
+                     mask_T=None):
+        out_T1, out_S1, master1 = layer1(out_T, out_S, master=master, mask1=mask_T)
+        out_S1 = pool_hS(out_S1, *pools["hS"])
+        if mask_T is None:
+            out_T1 = pool_hT(out_T1, *pools["hT"])
+        else:
+            out_T1, mask_T = pool_hT(out_T1, *pools["hT"], mask=mask_T)
 
+        out_T_aug, out_S_aug, master_aug = layer2(out_T1, out_S1, master=master1, mask1=mask_T)
+        out_T1 = out_T1 + out_T_aug
+        out_S1 = out_S1 + out_S_aug
+        master1 = master1 + master_aug
+        if mask_T is None:
+            return out_T1, out_S1, master1
+        return out_T1, out_S1, master1, mask_T
+
+    def frame_lengths(self, lengths: Tensor) -> Tensor:
+        '''
+        Valid frames after the front end of inputs of `lengths` samples:
+        the sinc conv has no padding and is followed by a max-pool of 3.
+        '''
+        return torch.div(lengths - self.conv_time.kernel_size + 1, 3, rounding_mode="floor")
+
+    def forward(self, x, Freq_aug=False, pool_ratios=None, max_nodes=None, lengths=None):
+        '''
+        lengths :(#bs,) valid samples per row of a zero-padded batch, or None.
+                 Padded frames are masked out everywhere downstream, so each
+                 row scores as if run alone at its natural length (eval only).
+        '''
+        return self.forward_features(self.front_end(x, Freq_aug=Freq_aug),
+                                     pool_ratios=pool_ratios, max_nodes=max_nodes,
+                                     lengths=lengths)
+
+    def front_end(self, x, Freq_aug=False):
+        '''
+        Fixed (not learned) sinc front end, shared by models with the same
+        filts[0] / first_conv.
+        x           :(#bs, #samp)
+        out_shape   :(#bs, 1, #spec, #seq)
+        '''
         x = x.unsqueeze(1)
         # print(x.shape)
         x = self.conv_time(x, mask=Freq_aug)
         # print("conv_x.shape:", x.shape)    conv_x.shape: torch.Size([4, 70, 64472])
         x = x.unsqueeze(dim=1)
-        x = F.max_pool2d(torch.abs(x), (3, 3))
+        # the sinc filters are fixed, so the conv output needs no autograd
+        # history and abs can reuse its buffer
+        x = F.max_pool2d(torch.abs_(x) if not x.requires_grad else torch.abs(x), (3, 3))
         # print("xmax_pool2d.shape:", x.shape)   xmax_pool2d.shape: torch.Size([4, 1, 23, 21490])
+        return x
+
+    def forward_features(self, x, pool_ratios=None, max_nodes=None, lengths=None):
+        pools = self._pool_settings(pool_ratios, max_nodes)
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
         x = self.first_bn(x)
         x = self.selu(x)
 
+        # valid frames per row at the encoder input (None: no padding)
+        n_frames = None
+        if lengths is not None:
+            n_frames = self.frame_lengths(lengths.to(x.device)).clamp_min(1)
+
+        def time_mask(n, size):
+            return torch.arange(size, device=x.device)[None, :] < n[:, None]
+
         # get embeddings using encoder
         # (#bs, #filt, #spec, #seq)
-        e = self.encoder(x)     # [#bs, C(64), S(23), T(88)]
+        e = x
+        for i, block in enumerate(self.encoder):
+            if n_frames is None:
+                e = self._segment("encoder.{}".format(i), [block], block, e)
+            else:
+                mask = time_mask(n_frames, e.size(3))[:, None, None, :].to(e.dtype)
+                e = block[0](e, mask)
+                n_frames = torch.div(n_frames, 3, rounding_mode="floor").clamp_min(1)
+        # e: [#bs, C(64), S(23), T(88)]
+        if self.channels_last:
+            e = e.contiguous()
+        mask_T = None if n_frames is None else time_mask(n_frames, e.size(3))
 
         # spectral GAT (GAT-S)
-        e_S, _ = torch.max(torch.abs(e), dim=3)  # max along time  #[#bs, C(64), S(23)]
+        e_abs = torch.abs(e)
+        if mask_T is None:
+            e_S, _ = torch.max(e_abs, dim=3)  # max along time  #[#bs, C(64), S(23)]
+        else:
+            e_S, _ = torch.max(e_abs * mask_T[:, None, None, :].to(e.dtype), dim=3)
         e_S = e_S.transpose(1, 2) + self.pos_S
         # print("e_S.shape:", e_S.shape)   e_S.shape: torch.Size([4, 23, 64])
 
-        gat_S = self.GAT_layer_S(e_S)
-        # print("gat_S.shape:", gat_S.shape)    gat_S.shape: torch.Size([4, 23, 64])
-        out_S = self.pool_S(gat_S)  # (#bs, #node, #dim)
+        out_S = self._segment("gat_S", [self.GAT_layer_S],
+                              lambda h: self.pool_S(self.GAT_layer_S(h), *pools["S"]), e_S)
+        # gat_S.shape: torch.Size([4, 23, 64])
+        # (#bs, #node, #dim)
         # print("out_S.shape:", out_S.shape)    out_S.shape: torch.Size([4, 11, 64])
 
         # temporal GAT (GAT-T)
-        e_T, _ = torch.max(torch.abs(e), dim=2)  # max along freq   #[#bs, C(64), T(29)]
+        e_T, _ = torch.max(e_abs, dim=2)  # max along freq   #[#bs, C(64), T(29)]
         e_T = e_T.transpose(1, 2)
-        print("e_t.shape:", e_T.shape)
-        gat_T = self.GAT_layer_T(e_T)
-        print("gat_T.shape:", gat_T.shape)
+        # print("e_t.shape:", e_T.shape)
+        if mask_T is None:
+            out_T = self._segment("gat_T", [self.GAT_layer_T],
+                                  lambda h: self.pool_T(self.GAT_layer_T(h), *pools["T"]), e_T)
+        else:
+            out_T, mask_T = self.pool_T(self.GAT_layer_T(e_T, mask_T), *pools["T"], mask=mask_T)
         # gat_T.shape: torch.Size([4, 88, 64])
-        out_T = self.pool_T(gat_T)
-        print("out_T.shape:", out_T.shape)
         # out_T.shape: torch.Size([4, 61, 64])
 
         # learnable master node
         master1 = self.master1.expand(x.size(0), -1, -1)      #[bs,1,64]
         master2 = self.master2.expand(x.size(0), -1, -1)
 
-        # inference 1
-        out_T1, out_S1, master1 = self.HtrgGAT_layer_ST11(out_T, out_S, master=self.master1)
-        # print("out_T1.shape:", out_T1.shape)
-        # T1.shape: torch.Size([4, 61, 32])
-        # S1.shape: torch.Size([4, 11, 32])
-        out_S1 = self.pool_hS1(out_S1)
-        out_T1 = self.pool_hT1(out_T1)
-        # print("out_T1.shape:", out_T1.shape)torch.Size([bs, 30, 32])
-
-
-        out_T_aug, out_S_aug, master_aug = self.HtrgGAT_layer_ST12(out_T1, out_S1, master=master1)
-        out_T1 = out_T1 + out_T_aug
-
-        out_S1 = out_S1 + out_S_aug
-        master1 = master1 + master_aug
-
-        # inference 2
-        out_T2, out_S2, master2 = self.HtrgGAT_layer_ST21(out_T, out_S, master=self.master2)
-        out_S2 = self.pool_hS2(out_S2)
-        out_T2 = self.pool_hT2(out_T2)
-
-        out_T_aug, out_S_aug, master_aug = self.HtrgGAT_layer_ST22(out_T2, out_S2, master=master2)
-        out_T2 = out_T2 + out_T_aug
-        out_S2 = out_S2 + out_S_aug
-        master2 = master2 + master_aug
-
+        if mask_T is None:
+            # inference 1
+            out_T1, out_S1, master1 = self._segment(
+                "htrg1", [self.HtrgGAT_layer_ST11, self.HtrgGAT_layer_ST12],
+                lambda t, s, m: self._htrg_branch(t, s, m, self.HtrgGAT_layer_ST11, self.pool_hS1,
+                                                  self.pool_hT1, self.HtrgGAT_layer_ST12, pools),
+                out_T, out_S, self.master1)
+            # T1.shape: torch.Size([4, 61, 32]) -> pooled torch.Size([bs, 30, 32])
+            # S1.shape: torch.Size([4, 11, 32])
+
+            # inference 2
+            out_T2, out_S2, master2 = self._segment(
+                "htrg2", [self.HtrgGAT_layer_ST21, self.HtrgGAT_layer_ST22],
+                lambda t, s, m: self._htrg_branch(t, s, m, self.HtrgGAT_layer_ST21, self.pool_hS2,
+                                                  self.pool_hT2, self.HtrgGAT_layer_ST22, pools),
+                out_T, out_S, self.master2)
+        else:
+            # both branches keep the same number of nodes per row
+            out_T1, out_S1, master1, mask_T1 = self._htrg_branch(
+                out_T, out_S, self.master1, self.HtrgGAT_layer_ST11, self.pool_hS1,
+                self.pool_hT1, self.HtrgGAT_layer_ST12, pools, mask_T)
+            out_T2, out_S2, master2, _ = self._htrg_branch(
+                out_T, out_S, self.master2, self.HtrgGAT_layer_ST21, self.pool_hS2,
+                self.pool_hT2, self.HtrgGAT_layer_ST22, pools, mask_T)
+            mask_T = mask_T1
 
         out_T1 = self.drop_way(out_T1)
         out_T2 = self.drop_way(out_T2)
@@ -611,13 +854,18 @@ class Model(nn.Module):
         out_T = torch.max(out_T1, out_T2)
         out_S = torch.max(out_S1, out_S2)
         master = torch.max(master1, master2)
-        print("out_T.shape:", out_T.shape)
+        # print("out_T.shape:", out_T.shape)
         # out_T.shape: torch.Size([bs, 30, 32])
         # print("out_S.shape:", out_S.shape)   out_S.shape: torch.Size([4, 5, 32])
         # print("master.shape:", master.shape)   master.shape: torch.Size([4, 1, 32])
 
-        T_max, _ = torch.max(torch.abs(out_T), dim=1)
-        T_avg = torch.mean(out_T, dim=1)
+        if mask_T is None:
+            T_max, _ = torch.max(torch.abs(out_T), dim=1)
+            T_avg = torch.mean(out_T, dim=1)
+        else:
+            w = mask_T.unsqueeze(-1).to(out_T.dtype)
+            T_max, _ = torch.max(torch.abs(out_T) * w, dim=1)
+            T_avg = (out_T * w).sum(dim=1) / w.sum(dim=1)
         # print("T_max.shape:", T_max.shape)  torch.Size([4, 32])
         # print("T_avg.shape:", T_avg.shape)   torch.Size([4, 32])
 
@@ -639,27 +887,36 @@ class Model(nn.Module):
 
 
 if __name__ == "__main__":
-    torch.cuda.is_available()
+    # quick profile; see benchmark.py for the full benchmark suite
+    import argparse
+    import json
+
+    from benchmark import DEFAULT_MODEL_CONFIG, _timed_forwards
+
+    parser = argparse.ArgumentParser(description="LSNet FLOPs / latency")
+    parser.add_argument("--config", type=str, default=None,
+                        help="configuration file (default: benchmark.DEFAULT_MODEL_CONFIG)")
+    parser.add_argument("--batch_size", type=int, default=1)
+    args = parser.parse_args()
+
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print('Device: {}'.format(device))
-
-    with open('../config/AASIST.conf', "r") as f_json:
-        config = json.loads(f_json.read())
-    model_config = config["model_config"]
-
-    model = get_model(model_config, device)
-    x = torch.randn(1, 64600).to(device)
-
-    flops, params = profile(model, inputs=(x,))
-    print(f"FLOPs: {flops}, Params: {params}")
-    start = time.time()
-    # print(start)
-    last_hidden, output = model(x)
-    # print("lasthidden,shape:",last_hidden.shape)
-    # # output = F.softmax(output, dim=1)
-    end = time.time()
-    # print("output:", output)
-    print(output.shape)
-
-    # print(end)
-    print(end-start)
+    model_config = DEFAULT_MODEL_CONFIG
+    if args.config:
+        with open(args.config, "r") as f_json:
+            model_config = json.loads(f_json.read())["model_config"]
+
+    model = Model(model_config).to(device).eval()
+    x = torch.randn(args.batch_size, model_config.get("nb_samp", 64600)).to(device)
+
+    try:
+        from thop import profile
+        # thop adds counter buffers to the modules it profiles, so use a copy
+        flops, params = profile(Model(model_config).to(device).eval(), inputs=(x,),
+                                verbose=False)
+        print(f"FLOPs: {flops}, Params: {params}")
+    except ImportError:
+        print("Params: {}".format(sum(p.numel() for p in model.parameters())))
+    times = _timed_forwards(model, x, warmup=3, iters=20)
+    print("latency: median {:.1f} ms, p90 {:.1f} ms".format(
+        1e3 * np.median(times), 1e3 * np.percentile(times, 90)))
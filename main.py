@@ -2,13 +2,14 @@ import argparse
 import json
 import os
 import sys
+import time
 import warnings
-from importlib import import_module
 from pathlib import Path
 from shutil import copy
 import shutil
 from typing import Dict, List, Union
 from tqdm import tqdm
+import numpy as np
 from ifocalloss import *
 # from lsnetwork import *
 
@@ -16,14 +17,17 @@ from ifocalloss import *
 
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
-from torch.utils.tensorboard import SummaryWriter
-from torchcontrib.optim import SWA
-from data_utils import (Dataset_ASVspoof2019_train,
-                        Dataset_ASVspoof2019_devNeval, Dataset_ASVspoof2021_eval, genSpoof_list)
-from data_utils2021 import genSpoof_list2021
-from evaluation import calculate_tDCF_EER
-from evaluation2021 import calculate_tDCF_EER2021
+from torch.utils.data import DataLoader, Subset
+from protocol_index import load_protocol
+from metrics import calculate_tDCF_EER_from_scores
+from score_io import write_scores
+from telemetry import StepTelemetry
+from adaptive_sampler import IndexedDataset, LossAwareSampler
+from batch_transport import SlabLoader
+from curriculum import LengthCurriculum, set_crop
+from model_factory import get_model
+from score_cache import ScoreCache, dataset_crop, model_key, protocol_key, weights_hash
+from dev_subset import EarlyStopping, bootstrap_eer, needs_full_dev, stratified_subset
 from utils import create_optimizer, seed_worker, set_seed, str_to_bool
 
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -34,6 +38,11 @@ def main(args: argparse.Namespace) -> None:
     Main function.
     Trains, validates, and evaluates the ASVspoof detection model.
     """
+    # training-only dependencies; kept out of module import (tools that
+    # only build models use model_factory.get_model)
+    from torchcontrib.optim import SWA
+    from data_utils import Dataset_ASVspoof2021_eval
+
     # load experiment configurations
     with open(args.config, "r") as f_json:
         config = json.loads(f_json.read())
@@ -123,14 +132,14 @@ def main(args: argparse.Namespace) -> None:
         print("no. pre-model params:{}".format(nb_params_1))
         print("Model loaded : {}".format(config["model_path"]))
         print("Start evaluation...")
-        produce_evaluation_file(eval_loader, model, device,
-                                pre_eval_score_path, eval_trial_path, lossmodel, config)
+        eval_scores = produce_evaluation_file(eval_loader, model, device,
+                                              pre_eval_score_path, eval_trial_path, lossmodel, config)
         # calculate_tDCF_EER(cm_scores_file=eval_score_path,
         #                    asv_score_file=database_logical_path / config["asv_score_path"],
         #                    output_file=model_tag / "t-DCF_EER.txt")
         print("DONE.")
-        eval_eer, eval_tdcf = calculate_tDCF_EER(
-            cm_scores_file=pre_eval_score_path,
+        eval_eer, eval_tdcf = calculate_tDCF_EER_from_scores(
+            *eval_scores,
             asv_score_file=database_logical_path / config["asv_score_path"],
             output_file=model_tag / "pre_model_t-DCF_EER.txt")
         print('eval_eer:{}'.format(eval_eer))
@@ -143,9 +152,7 @@ def main(args: argparse.Namespace) -> None:
         eval_trial_path_2021LA = (database_logical_path /
                                   "ASVspoof2021_LA_cm_protocols/trial_metadata.txt")
         eval_database_path2021LA = "D:\database\ASV spoof 2021\LA\ASVspoof2021_LA_eval"
-        d_label_eval, file_eval = genSpoof_list2021(dir_meta=eval_trial_path_2021LA,
-                                                is_train=False,
-                                                is_eval=True)
+        d_label_eval, file_eval = load_protocol(eval_trial_path_2021LA).spoof_list()
         eval_set = Dataset_ASVspoof2021_eval(list_IDs=file_eval,
                                              labels=d_label_eval,
                                              base_dir=eval_database_path2021LA)
@@ -203,6 +210,33 @@ def main(args: argparse.Namespace) -> None:
     n_swa_update = 0  # number of snapshots of model to use in SWA
     f_log = open(model_tag / "metric_log.txt", "a")
     f_log.write("=" * 5 + "\n")
+    telemetry = StepTelemetry(model_tag / "telemetry",
+                              interval=config.get("telemetry_interval", 100),
+                              device=device)
+    # wall-clock time (training + dev scoring) until dev EER <= target_dev_eer,
+    # to compare samplers
+    target_dev_eer = config.get("target_dev_eer")
+    train_start = time.time()
+
+    # sampled dev validation and early stopping (dev_subset.py)
+    dev_subset_config = config.get("dev_subset")
+    dev_rows, dev_subset_loader = None, None
+    if dev_subset_config:
+        dev_rows = stratified_subset(load_protocol(dev_trial_path),
+                                     dev_subset_config.get("fraction", 0.2),
+                                     dev_subset_config.get("seed", 0))
+        dev_subset_loader = _data_loader(Subset(dev_loader.dataset, dev_rows.tolist()), config,
+                                         batch_size=config["batch_size"],
+                                         shuffle=False,
+                                         drop_last=False,
+                                         pin_memory=True)
+        print("no. dev subset files:", len(dev_rows))
+    early_stopping = EarlyStopping(**config["early_stopping"]) \
+        if config.get("early_stopping") else None
+    full_dev_time, subset_dev_time, n_full_dev, epochs_run = 0., 0., 0, 0
+    # crop length grows from short to full over the first epochs (curriculum.py)
+    curriculum = LengthCurriculum(**config["length_curriculum"]) \
+        if config.get("length_curriculum") else None
 
 
     # Training
@@ -212,21 +246,59 @@ def main(args: argparse.Namespace) -> None:
             adjust_learning_rate(args, lossmodel_optimzer, epoch)
         elif config["loss"] == "scokdwcedoc":
             adjust_learning_rate(args, lossmodel_optimzer, epoch)
+        if curriculum is not None:
+            crop = curriculum.crop(epoch)
+            set_crop(trn_loader.dataset, crop)
+            print("training crop: {} samples".format(crop))
         running_loss = train_epoch(trn_loader, model, teachermodel, optimizer, device,
-                                   scheduler, lossmodel, lossmodel_optimzer, config)
-        produce_evaluation_file(dev_loader, model, device,
-                                metric_path/"dev_score.txt", dev_trial_path, lossmodel, config)
-        dev_eer, dev_tdcf = calculate_tDCF_EER(
-            cm_scores_file=metric_path/"dev_score.txt",
-            asv_score_file=database_logical_path/config["asv_score_path"],
-            output_file=metric_path/"dev_t-DCF_EER_{}epo.txt".format(epoch),
-            printout=False)
-        print("Loss:{:.5f}, dev_eer: {:.3f}, dev_tdcf:{:.5f}\nDONE.".format(
-            running_loss, dev_eer, dev_tdcf))
-       
-
-        best_dev_tdcf = min(dev_tdcf, best_dev_tdcf)
-        if best_dev_eer >= dev_eer:
+                                   scheduler, lossmodel, lossmodel_optimzer, config,
+                                   telemetry=telemetry)
+        dev_start = time.time()
+        dev_interval = None
+        if dev_subset_loader is not None:
+            sub_scores, sub_keys, _ = produce_evaluation_file(
+                dev_subset_loader, model, device, metric_path/"dev_subset_score.txt",
+                dev_trial_path, lossmodel, config, rows=dev_rows)
+            dev_interval = bootstrap_eer(sub_scores[sub_keys == "bonafide"],
+                                         sub_scores[sub_keys != "bonafide"],
+                                         n_boot=dev_subset_config.get("n_boot", 1000),
+                                         confidence=dev_subset_config.get("confidence", 0.95),
+                                         seed=epoch)
+            subset_dev_time += time.time() - dev_start
+            print("dev subset eer: {:.3f} [{:.3f}, {:.3f}]".format(*dev_interval))
+        if dev_interval is None or needs_full_dev(dev_interval, best_dev_eer):
+            full_start = time.time()
+            dev_scores = produce_evaluation_file(dev_loader, model, device,
+                                                 metric_path/"dev_score.txt", dev_trial_path, lossmodel, config)
+            dev_eer, dev_tdcf = calculate_tDCF_EER_from_scores(
+                *dev_scores,
+                asv_score_file=database_logical_path/config["asv_score_path"],
+                output_file=metric_path/"dev_t-DCF_EER_{}epo.txt".format(epoch),
+                printout=False)
+            full_dev_time += time.time() - full_start
+            n_full_dev += 1
+            print("Loss:{:.5f}, dev_eer: {:.3f}, dev_tdcf:{:.5f}\nDONE.".format(
+                running_loss, dev_eer, dev_tdcf))
+        else:
+            # the whole interval is above the best full-dev EER: not a new best
+            dev_eer, dev_tdcf = None, None
+            print("Loss:{:.5f}, full dev skipped (best dev_eer {:.3f})\nDONE.".format(
+                running_loss, best_dev_eer))
+        if target_dev_eer is not None and dev_eer is not None and dev_eer <= target_dev_eer:
+            log_text = "epoch{:03d}, dev eer {:.3f} <= {} reached after {:.1f} s".format(
+                epoch, dev_eer, target_dev_eer, time.time() - train_start)
+            print(log_text)
+            f_log.write(log_text + "\n")
+            f_log.flush()
+            target_dev_eer = None
+        if isinstance(trn_loader.sampler, LossAwareSampler):
+            trn_loader.sampler.save(metric_path / "sampler_loss.npz")
+        epochs_run = epoch + 1
+        stop = early_stopping is not None and early_stopping.step(dev_eer, dev_tdcf)
+
+        if dev_tdcf is not None:
+            best_dev_tdcf = min(dev_tdcf, best_dev_tdcf)
+        if dev_eer is not None and best_dev_eer >= dev_eer:
             print("best model find at epoch", epoch)
             # print("Saving epoch {} for swa".format(epoch))
 
@@ -241,10 +313,10 @@ def main(args: argparse.Namespace) -> None:
             # do evaluation whenever best model is renewed
             if str_to_bool(config["eval_all_best"]):
                 eval_score_path_1 = metric_path / "eval_score_{:03d}epo.txt".format(epoch)
-                produce_evaluation_file(eval_loader, model, device,
-                                        eval_score_path_1, eval_trial_path, lossmodel, config)
-                eval_eer, eval_tdcf = calculate_tDCF_EER(
-                    cm_scores_file=eval_score_path_1,
+                eval_scores = produce_evaluation_file(eval_loader, model, device,
+                                                      eval_score_path_1, eval_trial_path, lossmodel, config)
+                eval_eer, eval_tdcf = calculate_tDCF_EER_from_scores(
+                    *eval_scores,
                     asv_score_file=database_logical_path / config["asv_score_path"],
                     output_file=metric_path / "t-DCF_EER_{:03d}epo.txt".format(epoch))
 
@@ -270,19 +342,41 @@ def main(args: argparse.Namespace) -> None:
             optimizer_swa.swap_swa_sgd()
             optimizer_swa.bn_update(trn_loader, model, device=device)
 
-       
-
+        if stop:
+            log_text = "epoch{:03d}, early stop: no dev eer / tdcf improvement in {} epochs".format(
+                epoch, early_stopping.patience)
+            print(log_text)
+            f_log.write(log_text + "\n")
+            break
+
+    telemetry.close()
+    # wall-time saved against full dev every epoch for num_epochs, estimated
+    # from the mean full-dev pass and the mean epoch of this run
+    n_skipped_dev = epochs_run - n_full_dev
+    mean_full_dev = full_dev_time / max(n_full_dev, 1)
+    mean_epoch = (time.time() - train_start) / epochs_run
+    saved_dev = n_skipped_dev * mean_full_dev - subset_dev_time
+    saved_stop = (config["num_epochs"] - epochs_run) * mean_epoch
+    log_text = "{} epochs, full dev {}x ({:.1f} s each), subset dev {:.1f} s; " \
+               "saved ~{:.1f} s by sampled dev, ~{:.1f} s by early stopping".format(
+                   epochs_run, n_full_dev, mean_full_dev, subset_dev_time, saved_dev, saved_stop)
+    print(log_text)
+    f_log.write(log_text + "\n")
+    f_log.close()
     print("Start final evaluation")
     epoch += 1
+    if curriculum is not None:
+        # SWA BatchNorm statistics at the full length
+        set_crop(trn_loader.dataset, curriculum.end)
     if n_swa_update > 0:
         optimizer_swa.swap_swa_sgd()
         optimizer_swa.bn_update(trn_loader, model, device=device)
-    produce_evaluation_file(eval_loader, model, device, swa_eval_score_path,
-                            eval_trial_path, lossmodel, config)
-    eval_eer, eval_tdcf = calculate_tDCF_EER(cm_scores_file=swa_eval_score_path,
-                                             asv_score_file=database_logical_path /
-                                             config["asv_score_path"],
-                                             output_file=model_tag / "t-DCF_EER.txt")
+    eval_scores = produce_evaluation_file(eval_loader, model, device, swa_eval_score_path,
+                                          eval_trial_path, lossmodel, config)
+    eval_eer, eval_tdcf = calculate_tDCF_EER_from_scores(*eval_scores,
+                                                         asv_score_file=database_logical_path /
+                                                         config["asv_score_path"],
+                                                         output_file=model_tag / "t-DCF_EER.txt")
     f_log = open(model_tag / "metric_log.txt", "a")
     f_log.write("=" * 5 + "\n")
     f_log.write("swa EER: {:.3f}, min t-DCF: {:.5f}\n".format(eval_eer, eval_tdcf))
@@ -314,19 +408,23 @@ def adjust_learning_rate(args, optimizer, epoch_num):
         param_group['lr'] = lr
 
 
-def get_model(model_config: Dict, device: torch.device):
-    """Define DNN model architecture"""
-    module = import_module("models.{}".format(model_config["architecture"]))
-    _model = getattr(module, "Model")
-    model = _model(model_config).to(device)
-    nb_params = sum([param.view(-1).size()[0] for param in model.parameters()])
-    print("no. model params:{}".format(nb_params))
-
-    return model
+def _data_loader(dataset, config: dict, **kwargs):
+    """
+    DataLoader, or the shared-memory SlabLoader with config shm_transport
+    (opt-in, see batch_transport.py)
+    """
+    num_workers = config.get("num_workers", 0)
+    if str_to_bool(str(config.get("shm_transport", "False"))):
+        kwargs.pop("pin_memory", None)
+        return SlabLoader(dataset, nb_samp=config["model_config"].get("nb_samp", 64600),
+                          num_workers=num_workers, **kwargs)
+    return DataLoader(dataset, num_workers=num_workers, **kwargs)
 
 
 def get_loader(database_path: str, database_logical_path: str, seed: int, config: dict) -> List[torch.utils.data.DataLoader]:
     """Make PyTorch DataLoaders for train / developement / evaluation"""
+    from data_utils import Dataset_ASVspoof2019_train, Dataset_ASVspoof2019_devNeval
+
     track = config["track"]
     prefix_2019 = "partASVspoof2019.{}".format(track)
     prefix_2021 = "ASVspoof2021.{}".format(track)
@@ -350,63 +448,108 @@ def get_loader(database_path: str, database_logical_path: str, seed: int, config
                         track, prefix_2019))
 
 
-    d_label_trn, file_train = genSpoof_list(dir_meta=trn_list_path,
-                                            is_train=True,
-                                            is_eval=False)
+    # decoded audio shared read-only between jobs (audio_cache.py)
+    use_audio_cache = str_to_bool(str(config.get("audio_cache", "False")))
+    if use_audio_cache:
+        from audio_cache import CachedDataset, get_audio_cache
+
+    d_label_trn, file_train = load_protocol(trn_list_path).spoof_list()
     print("no. training files:", len(file_train))
 
-    train_set = Dataset_ASVspoof2019_train(list_IDs=file_train,
-                                           labels=d_label_trn,
-                                           base_dir=trn_database_path)
+    if use_audio_cache:
+        train_set = CachedDataset(file_train, d_label_trn,
+                                  get_audio_cache(trn_list_path, trn_database_path), train=True)
+    else:
+        train_set = Dataset_ASVspoof2019_train(list_IDs=file_train,
+                                               labels=d_label_trn,
+                                               base_dir=trn_database_path)
     gen = torch.Generator()
     gen.manual_seed(seed)
-    trn_loader = DataLoader(train_set,
-                            batch_size=config["batch_size"],
-                            shuffle=True,
-                            drop_last=True,
-                            pin_memory=True,
-                            worker_init_fn=seed_worker,
-                            generator=gen)
-
-    d_label_dev, file_dev = genSpoof_list(dir_meta=dev_trial_path,
-                                          is_train=False,
-                                          is_eval=False)
+    if config.get("adaptive_sampler"):
+        # loss-aware sampling; items carry their index for the loss updates
+        train_set = IndexedDataset(train_set)
+        sampler = LossAwareSampler(len(train_set), seed, **config["adaptive_sampler"])
+    else:
+        sampler = None
+    trn_loader = _data_loader(train_set, config,
+                              batch_size=config["batch_size"],
+                              shuffle=sampler is None,
+                              sampler=sampler,
+                              drop_last=True,
+                              pin_memory=True,
+                              worker_init_fn=seed_worker,
+                              generator=gen)
+
+    d_label_dev, file_dev = load_protocol(dev_trial_path).spoof_list()
     print("no. validation files:", len(file_dev))
 
-    dev_set = Dataset_ASVspoof2019_devNeval(list_IDs=file_dev,
-                                            labels=d_label_dev,
-                                            base_dir=dev_database_path)
-    dev_loader = DataLoader(dev_set,
-                            batch_size=config["batch_size"],
-                            shuffle=False,
-                            drop_last=False,
-                            pin_memory=True)
-
-    d_label_eval, file_eval = genSpoof_list(dir_meta=eval_trial_path,
-                                            is_train=False,
-                                            is_eval=True)
+    if use_audio_cache:
+        dev_set = CachedDataset(file_dev, d_label_dev,
+                                get_audio_cache(dev_trial_path, dev_database_path), train=False)
+    else:
+        dev_set = Dataset_ASVspoof2019_devNeval(list_IDs=file_dev,
+                                                labels=d_label_dev,
+                                                base_dir=dev_database_path)
+    dev_loader = _data_loader(dev_set, config,
+                              batch_size=config["batch_size"],
+                              shuffle=False,
+                              drop_last=False,
+                              pin_memory=True)
+
+    d_label_eval, file_eval = load_protocol(eval_trial_path).spoof_list()
     print("no. eval files:", len(file_eval))
-    eval_set = Dataset_ASVspoof2019_devNeval(list_IDs=file_eval,
-                                             labels=d_label_eval,
-                                             base_dir=eval_database_path)
-    eval_loader = DataLoader(eval_set,
-                             batch_size=config["batch_size"],
-                             shuffle=False,
-                             drop_last=False,
-                             pin_memory=True)
+    if use_audio_cache:
+        eval_set = CachedDataset(file_eval, d_label_eval,
+                                 get_audio_cache(eval_trial_path, eval_database_path), train=False)
+    else:
+        eval_set = Dataset_ASVspoof2019_devNeval(list_IDs=file_eval,
+                                                 labels=d_label_eval,
+                                                 base_dir=eval_database_path)
+    eval_loader = _data_loader(eval_set, config,
+                               batch_size=config["batch_size"],
+                               shuffle=False,
+                               drop_last=False,
+                               pin_memory=True)
 
     return trn_loader, dev_loader, eval_loader
 
 
 def produce_evaluation_file(data_loader: DataLoader, model, device: torch.device,
-                            save_path: str, trial_path: str, lossmodel, config: argparse.Namespace, is_2021eval=False) -> None:
-    """Perform evaluation and save the score to a file"""
+                            save_path: str, trial_path: str, lossmodel, config: argparse.Namespace, is_2021eval=False,
+                            rows=None):
+    """
+    Perform evaluation and save the score to a file.
+    Returns (scores, keys, sources) arrays for metrics; keys and sources
+    are None for 2021 eval.
+    rows: protocol rows scored by data_loader when it covers a subset
+    With config "score_cache" (score_cache.py), trials already scored by
+    the same weights are read from the store and only the rest are run.
+    """
     model.eval()
-    with open(trial_path, "r") as f_trl:
-        trial_lines = f_trl.readlines()
+    trial_index = load_protocol(trial_path)
+    utt_ids = trial_index.utt_ids if rows is None else trial_index.utt_ids[rows]
     fname_list = []
     score_list = []
     model = model.to(device)
+    expected = utt_ids
+    cache = None
+    if config.get("score_cache"):
+        cache = ScoreCache(**config["score_cache"])
+        weights = weights_hash(model.state_dict())
+        cache_key = (model_key(weights, config, lossmodel, model), protocol_key(trial_path),
+                     dataset_crop(data_loader.dataset,
+                                  config["model_config"].get("nb_samp", 64600)))
+        cached = cache.lookup(*cache_key, utt_ids.tolist())
+        missing = np.flatnonzero(np.isnan(cached))
+        print("score cache: {} of {} trials cached".format(
+            len(utt_ids) - len(missing), len(utt_ids)))
+        if len(missing) < len(utt_ids):
+            data_loader = _data_loader(Subset(data_loader.dataset, missing.tolist()), config,
+                                       batch_size=config["batch_size"],
+                                       shuffle=False,
+                                       drop_last=False,
+                                       pin_memory=True)
+            expected = utt_ids[missing]
     for batch_x, batch_y, utt_id in tqdm(data_loader):
         batch_x = batch_x.to(device)
         batch_y = batch_y.view(-1).type(torch.int64).to(device)
@@ -427,19 +570,27 @@ def produce_evaluation_file(data_loader: DataLoader, model, device: torch.device
         fname_list.extend(utt_id)
         score_list.extend(batch_score.tolist())
 
-    assert len(trial_lines) == len(fname_list) == len(score_list)
-    with open(save_path, "w") as fh:
-        if is_2021eval:
-            for fn, score in zip(fname_list, score_list):
-                fh.write("{} {}\n".format(fn, score))
-        else:
-            for fn, score, trl in zip(fname_list, score_list, trial_lines):
-                _, utt_id, _, tag, label = trl.strip().split(' ')
-                # print(fn)
-                # print(utt_id)
-                assert fn == utt_id
-                fh.write("{} {} {} {}\n".format(utt_id, tag, label, score))
-    print("Scores saved to {}".format(save_path))
+    assert len(expected) == len(fname_list) == len(score_list)
+    assert fname_list == expected.tolist()
+    if cache is not None:
+        cache.store(cache_key[0], weights, cache_key[1], cache_key[2], fname_list, score_list,
+                    label=str(save_path))
+        cache.close()
+        cached[missing] = score_list
+        fname_list, score_list = utt_ids.tolist(), cached.tolist()
+    if is_2021eval:
+        saved = write_scores(save_path, fname_list, score_list,
+                             fmt=config.get("score_format", "text"))
+        print("Scores saved to {}".format(saved))
+        return np.array(score_list), None, None
+    tag_names = trial_index.tag_names()
+    key_names = trial_index.key_names()
+    if rows is not None:
+        tag_names, key_names = tag_names[rows], key_names[rows]
+    saved = write_scores(save_path, fname_list, score_list, tag_names.tolist(),
+                         key_names.tolist(), fmt=config.get("score_format", "text"))
+    print("Scores saved to {}".format(saved))
+    return np.array(score_list), key_names, tag_names
 
 
 def train_epoch(
@@ -450,8 +601,11 @@ def train_epoch(
     scheduler: torch.optim.lr_scheduler,
     lossmodel,
     loss_optim,
-    config: argparse.Namespace):
+    config: argparse.Namespace,
+    telemetry: StepTelemetry = None):
     """Train the model for one epoch"""
+    if telemetry is None:
+        telemetry = StepTelemetry(None)
     running_loss = 0
     num_total = 0.0
     ii = 0
@@ -460,45 +614,53 @@ def train_epoch(
     # set objective (Loss) functions
     weight = torch.FloatTensor([0.1, 0.9]).to(device)
     criterion = nn.CrossEntropyLoss(weight=weight)
-    mseloss = nn.MSELoss()
-    focalloss = i-FocalLoss()
+    focal_kd_loss = FocalDistillationLoss(beta=0.5)
     
 
 
+    sampler = trn_loader.sampler if isinstance(trn_loader.sampler, LossAwareSampler) else None
+
     model = model.to(device)
     teachermodel = teachermodel.to(device)
-    for batch_x, batch_y in tqdm(trn_loader):
+    for batch in tqdm(telemetry.iterate(trn_loader), total=len(trn_loader)):
+        batch_x, batch_y = batch[0], batch[1]
         batch_size = batch_x.size(0)
         num_total += batch_size
         ii += 1
-        batch_x = batch_x.to(device)
-        # if ii == 3:
-        #     print("batch_x's shape:", batch_x.shape)  #torch.Size([12, 64600])
-        batch_y = batch_y.view(-1).type(torch.int64).to(device)
-        feat, batch_out = model(batch_x, Freq_aug=str_to_bool(config["freq_aug"]))
+        with telemetry.phase("h2d"):
+            batch_x = batch_x.to(device)
+            # if ii == 3:
+            #     print("batch_x's shape:", batch_x.shape)  #torch.Size([12, 64600])
+            batch_y = batch_y.view(-1).type(torch.int64).to(device)
+        with telemetry.phase("student_forward"):
+            feat, batch_out = model(batch_x, Freq_aug=str_to_bool(config["freq_aug"]))
 
         if config["loss"] == "scokdifloss":
-            t_feat, t_score = teachermodel(batch_x)
-            batch_loss = focalloss(batch_out, batch_y)            
-
-            # begin ！
-            beta = 0.5
-            ts_loss = mseloss(t_score, batch_out)
-            batch_loss = beta * ts_loss + (1-beta) * batch_loss
-            # end
-            optim.zero_grad()
-            batch_loss.backward()
-            optim.step()
+            with telemetry.phase("teacher_forward"), torch.no_grad():
+                t_feat, t_score = teachermodel(batch_x)
+            with telemetry.phase("backward"):
+                # beta * MSE(t_score, batch_out) + (1 - beta) * I-FocalLoss
+                sample_weight = None
+                if sampler is not None:
+                    sample_weight = sampler.weights(batch[2]).to(device)
+                batch_loss = focal_kd_loss(batch_out, batch_y, t_score, sample_weight)
+                optim.zero_grad()
+                batch_loss.backward()
+                optim.step()
 
         running_loss = running_loss + batch_loss.item() * batch_size
+        if sampler is not None:
+            sampler.update(batch[2], focal_kd_loss.sample_loss.cpu().numpy())
 
 
-        if config["optim_config"]["scheduler"] in ["cosine", "keras_decay"]:
-            scheduler.step()
-        elif scheduler is None:
-            pass
-        else:
-            raise ValueError("scheduler error, got:{}".format(scheduler))
+        with telemetry.phase("scheduler"):
+            if config["optim_config"]["scheduler"] in ["cosine", "keras_decay"]:
+                scheduler.step()
+            elif scheduler is None:
+                pass
+            else:
+                raise ValueError("scheduler error, got:{}".format(scheduler))
+        telemetry.end_step(batch_size)
 
     running_loss = running_loss/num_total
     return running_loss
@@ -530,6 +692,10 @@ if __name__ == "__main__":
                         action="store_true",
                         default="true",
                         help="when this flag is given, evaluates given model and exit")
+    parser.add_argument("--no_eval2021LA",
+                        dest="eval2021LA",
+                        action="store_false",
+                        help="train instead of the default 2021 LA evaluation")
 
     parser.add_argument("--comment",
                         type=str,
@@ -0,0 +1,233 @@
+"""
+In-memory EER and min t-DCF computation.
+
+Same definitions as ``evaluation.calculate_tDCF_EER`` (ASVspoof 2019
+evaluation plan), but working on score arrays instead of score files, with
+the organizers' ASV scores parsed once per run and an accumulator that keeps
+the CM scores sorted as they stream in.
+"""
+
+import os
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+PSPOOF = 0.05
+COST_MODEL = {
+    "Pspoof": PSPOOF,  # Prior probability of a spoofing attack
+    "Ptar": (1 - PSPOOF) * 0.99,  # Prior probability of target speaker
+    "Pnon": (1 - PSPOOF) * 0.01,  # Prior probability of nontarget speaker
+    "Cmiss": 1,  # Cost of ASV system falsely rejecting target speaker
+    "Cfa": 10,  # Cost of ASV system falsely accepting nontarget speaker
+    "Cmiss_asv": 1,  # Cost of ASV system falsely rejecting target speaker
+    "Cfa_asv": 10,  # Cost of ASV system falsely accepting nontarget speaker
+    "Cmiss_cm": 1,  # Cost of CM system falsely rejecting target speaker
+    "Cfa_cm": 10,  # Cost of CM system falsely accepting spoof
+}
+ATTACK_TYPES = ["A{:02d}".format(_id) for _id in range(7, 20)]
+
+_asv_cache: Dict[Tuple[str, float], Tuple[float, float, Optional[float]]] = {}
+
+
+def det_curve_sorted(target_sorted: np.ndarray, nontarget_sorted: np.ndarray):
+    """
+    DET curve from already sorted target / nontarget scores.
+    Ties are ordered targets first, as the stable sort of
+    concat(target, nontarget) in compute_det_curve does.
+    """
+    n_tar = target_sorted.size
+    n_non = nontarget_sorted.size
+    n_scores = n_tar + n_non
+    pos_tar = np.arange(n_tar) + np.searchsorted(nontarget_sorted, target_sorted, side="left")
+    pos_non = np.arange(n_non) + np.searchsorted(target_sorted, nontarget_sorted, side="right")
+
+    labels = np.zeros(n_scores)
+    labels[pos_tar] = 1
+    all_scores = np.empty(n_scores, dtype=np.result_type(target_sorted, nontarget_sorted))
+    all_scores[pos_tar] = target_sorted
+    all_scores[pos_non] = nontarget_sorted
+
+    # Compute false rejection and false acceptance rates
+    tar_trial_sums = np.cumsum(labels)
+    nontarget_trial_sums = n_non - (np.arange(1, n_scores + 1) - tar_trial_sums)
+
+    frr = np.concatenate((np.atleast_1d(0), tar_trial_sums / n_tar))
+    far = np.concatenate((np.atleast_1d(1), nontarget_trial_sums / n_non))
+    thresholds = np.concatenate((np.atleast_1d(all_scores[0] - 0.001), all_scores))
+
+    return frr, far, thresholds
+
+
+def compute_det_curve(target_scores: np.ndarray, nontarget_scores: np.ndarray):
+    return det_curve_sorted(np.sort(target_scores, kind="mergesort"),
+                            np.sort(nontarget_scores, kind="mergesort"))
+
+
+def eer_from_det(frr, far, thresholds):
+    abs_diffs = np.abs(frr - far)
+    min_index = np.argmin(abs_diffs)
+    eer = np.mean((frr[min_index], far[min_index]))
+    return eer, thresholds[min_index]
+
+
+def compute_eer(target_scores: np.ndarray, nontarget_scores: np.ndarray):
+    """Returns equal error rate (EER) and the corresponding threshold."""
+    return eer_from_det(*compute_det_curve(target_scores, nontarget_scores))
+
+
+def obtain_asv_error_rates(tar_asv, non_asv, spoof_asv, asv_threshold):
+    # False alarm and miss rates for ASV
+    Pfa_asv = np.sum(non_asv >= asv_threshold) / non_asv.size
+    Pmiss_asv = np.sum(tar_asv < asv_threshold) / tar_asv.size
+
+    # Rate of rejecting spoofs in ASV
+    if spoof_asv.size == 0:
+        Pmiss_spoof_asv = None
+    else:
+        Pmiss_spoof_asv = np.sum(spoof_asv < asv_threshold) / spoof_asv.size
+
+    return Pfa_asv, Pmiss_asv, Pmiss_spoof_asv
+
+
+def load_asv_error_rates(asv_score_file) -> Tuple[float, float, Optional[float]]:
+    """ASV error rates at the ASV EER threshold, parsed once per file version"""
+    asv_score_file = str(asv_score_file)
+    key = (asv_score_file, os.path.getmtime(asv_score_file))
+    if key not in _asv_cache:
+        with open(asv_score_file, "r") as f_asv:
+            cols = [line.split() for line in f_asv if line.strip()]
+        asv_keys = np.array([c[1] for c in cols])
+        asv_scores = np.array([c[2] for c in cols], dtype=np.float64)
+        tar_asv = asv_scores[asv_keys == "target"]
+        non_asv = asv_scores[asv_keys == "nontarget"]
+        spoof_asv = asv_scores[asv_keys == "spoof"]
+        _, asv_threshold = compute_eer(tar_asv, non_asv)
+        _asv_cache[key] = obtain_asv_error_rates(tar_asv, non_asv, spoof_asv, asv_threshold)
+    return _asv_cache[key]
+
+
+def min_tDCF_from_det(Pmiss_cm, Pfa_cm, Pfa_asv, Pmiss_asv, Pmiss_spoof_asv,
+                      cost_model: Dict = COST_MODEL) -> float:
+    C1 = cost_model["Ptar"] * (cost_model["Cmiss_cm"] - cost_model["Cmiss_asv"] * Pmiss_asv) - \
+        cost_model["Pnon"] * cost_model["Cfa_asv"] * Pfa_asv
+    C2 = cost_model["Cfa_cm"] * cost_model["Pspoof"] * (1 - Pmiss_spoof_asv)
+    if C1 < 0 or C2 < 0:
+        raise ValueError("t-DCF weights are negative, check the ASV error rates")
+
+    tDCF_norm = (C1 * Pmiss_cm + C2 * Pfa_cm) / np.minimum(C1, C2)
+    return tDCF_norm[np.argmin(tDCF_norm)]
+
+
+class ScoreAccumulator:
+    """
+    CM scores kept sorted per class (and per attack type) as batches arrive,
+    so EER / min t-DCF can be read at any point without re-sorting.
+    """
+
+    def __init__(self, asv_score_file=None):
+        self.asv_score_file = asv_score_file
+        self.bona = np.empty(0)
+        self.spoof = np.empty(0)
+        self.spoof_by_attack: Dict[str, np.ndarray] = {}
+
+    def __len__(self):
+        return self.bona.size + self.spoof.size
+
+    @staticmethod
+    def _merge(sorted_arr, new):
+        new = np.sort(np.asarray(new, dtype=np.float64), kind="mergesort")
+        return np.insert(sorted_arr, np.searchsorted(sorted_arr, new, side="right"), new)
+
+    def update(self, scores: Sequence[float], keys: Sequence[str],
+               sources: Optional[Sequence[str]] = None) -> None:
+        scores = np.asarray(scores, dtype=np.float64)
+        keys = np.asarray(keys)
+        is_bona = keys == "bonafide"
+        self.bona = self._merge(self.bona, scores[is_bona])
+        self.spoof = self._merge(self.spoof, scores[~is_bona])
+        if sources is not None:
+            sources = np.asarray(sources)[~is_bona]
+            spoof_scores = scores[~is_bona]
+            for attack_type in np.unique(sources):
+                self.spoof_by_attack[attack_type] = self._merge(
+                    self.spoof_by_attack.get(attack_type, np.empty(0)),
+                    spoof_scores[sources == attack_type])
+
+    def eer(self) -> float:
+        return eer_from_det(*det_curve_sorted(self.bona, self.spoof))[0]
+
+    def attack_eers(self) -> Dict[str, float]:
+        return {attack_type: eer_from_det(*det_curve_sorted(self.bona, spoof))[0]
+                for attack_type, spoof in sorted(self.spoof_by_attack.items())}
+
+    def compute(self) -> Tuple[float, float]:
+        """Returns (EER in %, min t-DCF)"""
+        frr, far, thresholds = det_curve_sorted(self.bona, self.spoof)
+        eer_cm = eer_from_det(frr, far, thresholds)[0]
+        min_tDCF = min_tDCF_from_det(frr, far, *load_asv_error_rates(self.asv_score_file))
+        return eer_cm * 100, min_tDCF
+
+
+def calculate_tDCF_EER_from_scores(cm_scores, cm_keys, cm_sources, asv_score_file,
+                                   output_file, printout=True) -> Tuple[float, float]:
+    """Drop-in for calculate_tDCF_EER taking in-memory CM scores"""
+    acc = ScoreAccumulator(asv_score_file)
+    acc.update(cm_scores, cm_keys, cm_sources)
+    eer_cm, min_tDCF = acc.compute()
+
+    if printout:
+        eer_cm_breakdown = acc.attack_eers()
+        lines = ["\nCM SYSTEM\n",
+                 "\tEER\t\t= {:8.9f} % "
+                 "(Equal error rate for countermeasure)\n".format(eer_cm),
+                 "\nTANDEM\n",
+                 "\tmin-tDCF\t\t= {:8.9f}\n".format(min_tDCF),
+                 "\nBREAKDOWN CM SYSTEM\n"]
+        for attack_type in ATTACK_TYPES:
+            _eer = eer_cm_breakdown.get(attack_type, np.nan) * 100
+            lines.append("\tEER {}\t\t= {:8.9f} % (Equal error rate for {}\n".format(
+                attack_type, _eer, attack_type))
+        with open(output_file, "w") as f_res:
+            f_res.writelines(lines)
+        print("".join(lines))
+
+    return eer_cm, min_tDCF
+
+
+if __name__ == "__main__":
+    # benchmark on score sets sized like 2019 LA eval and 2021 LA eval
+    rng = np.random.default_rng(0)
+    for name, n_bona, n_spoof in [("2019 LA eval", 7355, 63882),
+                                  ("2021 LA eval", 14816, 166750)]:
+        bona = rng.normal(2., 1., n_bona)
+        spoof = rng.normal(-2., 1.5, n_spoof)
+
+        start = time.perf_counter()
+        eer, _ = compute_eer(bona, spoof)
+        t_full = time.perf_counter() - start
+
+        acc = ScoreAccumulator()
+        scores = np.concatenate([bona, spoof])
+        keys = np.array(["bonafide"] * n_bona + ["spoof"] * n_spoof)
+        order = rng.permutation(scores.size)
+        start = time.perf_counter()
+        for chunk in np.array_split(order, 100):
+            acc.update(scores[chunk], keys[chunk])
+        t_stream = time.perf_counter() - start
+        start = time.perf_counter()
+        eer_acc = acc.eer()
+        t_read = time.perf_counter() - start
+
+        msg = "{}: eer {:.6f}%, full {:.1f} ms, 100-batch stream {:.1f} ms, read {:.1f} ms".format(
+            name, eer * 100, t_full * 1e3, t_stream * 1e3, t_read * 1e3)
+        try:
+            from evaluation import compute_eer as reference_eer
+            start = time.perf_counter()
+            ref, _ = reference_eer(bona, spoof)
+            msg += ", evaluation.compute_eer {:.1f} ms, |diff| {:.2e}".format(
+                (time.perf_counter() - start) * 1e3, abs(ref - eer_acc))
+        except ImportError:
+            pass
+        assert eer == eer_acc
+        print(msg)
@@ -0,0 +1,22 @@
+"""
+Model construction shared by training (main.py) and the scoring tools.
+
+Kept apart from main.py so that tools which only need a model do not pay for
+main's training imports (data loading, telemetry, sampler, caches) at startup.
+"""
+
+from importlib import import_module
+from typing import Dict
+
+import torch
+
+
+def get_model(model_config: Dict, device: torch.device):
+    """Define DNN model architecture"""
+    module = import_module("models.{}".format(model_config["architecture"]))
+    _model = getattr(module, "Model")
+    model = _model(model_config).to(device)
+    nb_params = sum([param.view(-1).size()[0] for param in model.parameters()])
+    print("no. model params:{}".format(nb_params))
+
+    return model
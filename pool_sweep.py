@@ -0,0 +1,128 @@
+"""
+Latency / dev EER sweep over inference-time GraphPool settings.
+
+Each setting is a set of pool ratios and/or node caps applied through
+Model.set_pool_ratios to one checkpoint (no retraining). For every setting
+the CPU latency at the given batch size and the dev EER / min t-DCF are
+measured, and the table is written to pool_sweep.json and pool_sweep.tsv so
+an operating point can be chosen for a latency budget.
+
+    python pool_sweep.py --config config/LSNet.conf --ratios 0.5,0.7,0.5 0.4,0.5,0.4 \
+        --max_nodes 12,16,8,8 6,8,4,4
+"""
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+
+
+def _parse_list(value: str, cast):
+    return [None if v in ("", "none", "None") else cast(v) for v in value.split(",")]
+
+
+def sweep_settings(ratios: List[str], max_nodes: List[str]) -> List[Dict]:
+    """Constructed setting first, then every ratio x cap combination"""
+    settings = [{"pool_ratios": None, "max_nodes": None}]
+    for r in [None] + [_parse_list(v, float) for v in ratios]:
+        for c in [None] + [_parse_list(v, int) for v in max_nodes]:
+            if r is None and c is None:
+                continue
+            settings.append({"pool_ratios": r, "max_nodes": c})
+    return settings
+
+
+def cpu_latency_ms(model, nb_samp: int, batch_size: int, runs: int,
+                   pool_ratios: Optional[List] = None,
+                   max_nodes: Optional[List] = None) -> float:
+    """Median CPU forward time at the given pooling setting"""
+    x = torch.randn(batch_size, nb_samp)
+    times = []
+    with torch.no_grad():
+        for i in range(runs + 2):
+            start = time.perf_counter()
+            model(x, pool_ratios=pool_ratios, max_nodes=max_nodes)
+            if i >= 2:
+                times.append(time.perf_counter() - start)
+    return 1e3 * sorted(times)[len(times) // 2]
+
+
+def main(args: argparse.Namespace) -> None:
+    from main import get_loader, get_model, produce_evaluation_file
+    from metrics import calculate_tDCF_EER_from_scores
+
+    with open(args.config, "r") as f_json:
+        config = json.loads(f_json.read())
+    model_config = config["model_config"]
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    output_dir = Path(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    database_logical_path = Path(config["database_logical_path"])
+    track = config["track"]
+    dev_trial_path = (database_logical_path /
+                      "ASVspoof2019_{}_cm_protocols/partASVspoof2019.{}.cm.dev.trl.txt".format(
+                          track, track))
+    asv_score_file = database_logical_path / config["asv_score_path"]
+    model_path = args.model_path or config["model_path"]
+
+    model = get_model(model_config, device)
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.eval()
+    cpu_model = get_model(model_config, "cpu")
+    cpu_model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    cpu_model.eval()
+    dev_loader = None
+    if not args.latency_only:
+        _, dev_loader, _ = get_loader(Path(config["database_path"]), database_logical_path,
+                                      args.seed, config)
+
+    nb_samp = model_config.get("nb_samp", 64600)
+    rows = []
+    for setting in sweep_settings(args.ratios, args.max_nodes):
+        row = dict(setting)
+        row["latency_ms"] = cpu_latency_ms(cpu_model, nb_samp, args.batch_size, args.runs,
+                                           **setting)
+        if dev_loader is not None:
+            model.set_pool_ratios(**setting)
+            dev_scores = produce_evaluation_file(dev_loader, model, device,
+                                                 output_dir / "dev_score.txt",
+                                                 dev_trial_path, None, config)
+            row["dev_eer"], row["dev_tdcf"] = calculate_tDCF_EER_from_scores(
+                *dev_scores, asv_score_file=asv_score_file, output_file=None, printout=False)
+        rows.append(row)
+        print(row)
+    model.set_pool_ratios()
+
+    with open(output_dir / "pool_sweep.json", "w") as f_json:
+        f_json.write(json.dumps({"model_path": model_path, "batch_size": args.batch_size,
+                                 "nb_samp": nb_samp, "results": rows}, indent=4))
+    columns = ["pool_ratios", "max_nodes", "latency_ms", "dev_eer", "dev_tdcf"]
+    with open(output_dir / "pool_sweep.tsv", "w") as f_tsv:
+        f_tsv.write("\t".join(columns) + "\n")
+        for row in sorted(rows, key=lambda r: r["latency_ms"]):
+            f_tsv.write("\t".join(str(row.get(c, "")) for c in columns) + "\n")
+    print("Sweep saved to {}".format(output_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GraphPool ratio / node cap sweep")
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--model_path", type=str, default=None,
+                        help="weights to sweep (default: config model_path)")
+    parser.add_argument("--output_dir", type=str, default="./exp_result/pool_sweep")
+    parser.add_argument("--ratios", type=str, nargs="*", default=[],
+                        help="pool ratio settings 'S,T,htrg', e.g. 0.4,0.5,0.4")
+    parser.add_argument("--max_nodes", type=str, nargs="*", default=[],
+                        help="node cap settings 'S,T,hS,hT' (none = no cap)")
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="batch size of the CPU latency measurement")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency_only", action="store_true",
+                        help="skip the dev EER evaluation")
+    parser.add_argument("--seed", type=int, default=688)
+    main(parser.parse_args())
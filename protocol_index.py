@@ -0,0 +1,169 @@
+"""
+Compiled ASVspoof protocol index.
+
+Parses a CM protocol / trial metadata file once into integer-coded arrays
+(utt_id -> speaker, attack tag, key), caches it as .npz and shares the
+in-process copy between the data loaders, the evaluator and the metrics.
+The on-disk cache is invalidated when the protocol's mtime or size change
+(or its content hash, with validate="hash"); an unreadable cache file is
+parsed again from the text protocol and rewritten.
+
+2019 protocols:   SPEAKER UTT_ID - TAG KEY
+2021 trial meta:  SPEAKER UTT_ID CODEC TRANSMISSION TAG KEY TRIM PHASE
+"""
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+KEYS = ["spoof", "bonafide"]  # code == label used by genSpoof_list
+CACHE_DIR = Path(os.environ.get("LSNET_CACHE_DIR",
+                                Path.home() / ".cache" / "lsnet")) / "protocols"
+
+_loaded: Dict[str, "ProtocolIndex"] = {}
+
+
+def _file_digest(path) -> str:
+    with open(path, "rb") as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+class ProtocolIndex:
+    """utt_id-ordered protocol arrays; rows follow the protocol file order"""
+
+    def __init__(self, utt_ids, speaker, tag, key, speakers, tags):
+        self.utt_ids = np.asarray(utt_ids)
+        self.speaker = np.asarray(speaker, dtype=np.int32)
+        self.tag = np.asarray(tag, dtype=np.int16)
+        self.key = np.asarray(key, dtype=np.uint8)
+        self.speakers = np.asarray(speakers)
+        self.tags = np.asarray(tags)
+        self._row = None
+        self.stamp = []
+
+    def __len__(self):
+        return len(self.utt_ids)
+
+    @classmethod
+    def parse(cls, protocol_path) -> "ProtocolIndex":
+        with open(protocol_path, "r") as f_meta:
+            cols = [line.split() for line in f_meta if line.strip()]
+        tag_col, key_col = (3, 4) if cols and len(cols[0]) == 5 else (4, 5)
+        utt_ids = [c[1] for c in cols]
+        speakers, speaker = np.unique([c[0] for c in cols], return_inverse=True)
+        tags, tag = np.unique([c[tag_col] for c in cols], return_inverse=True)
+        key_names = [c[key_col] for c in cols]
+        unknown = set(key_names) - set(KEYS)
+        if unknown:
+            raise ValueError("Unknown keys {} in {}".format(sorted(unknown), protocol_path))
+        key = [KEYS.index(k) for k in key_names]
+        return cls(utt_ids, speaker, tag, key, speakers, tags)
+
+    def save(self, path, stamp) -> None:
+        # unique temp file: concurrent jobs may write the same entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(str(path)), suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f_npz:
+                np.savez(f_npz, utt_ids=self.utt_ids, speaker=self.speaker, tag=self.tag,
+                         key=self.key, speakers=self.speakers, tags=self.tags,
+                         stamp=np.asarray(stamp))
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path) -> Tuple["ProtocolIndex", np.ndarray]:
+        with np.load(path) as data:
+            index = cls(data["utt_ids"], data["speaker"], data["tag"], data["key"],
+                        data["speakers"], data["tags"])
+            return index, data["stamp"]
+
+    def row(self, utt_id: str) -> int:
+        if self._row is None:
+            self._row = {u: i for i, u in enumerate(self.utt_ids.tolist())}
+        return self._row[utt_id]
+
+    def spoof_list(self) -> Tuple[Dict[str, int], List[str]]:
+        """Same (d_meta, file_list) as genSpoof_list / genSpoof_list2021"""
+        file_list = self.utt_ids.tolist()
+        return dict(zip(file_list, self.key.tolist())), file_list
+
+    def key_names(self) -> np.ndarray:
+        return np.asarray(KEYS)[self.key]
+
+    def tag_names(self) -> np.ndarray:
+        return self.tags[self.tag]
+
+
+def load_protocol(protocol_path, validate: str = "mtime") -> ProtocolIndex:
+    """
+    Index for protocol_path, from memory, the on-disk cache or the text file.
+    validate: "mtime" trusts mtime + size, "hash" compares the content hash.
+    """
+    protocol_path = os.path.abspath(str(protocol_path))
+    st = os.stat(protocol_path)
+    stamp = [str(st.st_mtime_ns), str(st.st_size)]
+    digest = _file_digest(protocol_path) if validate == "hash" else None
+
+    def is_valid(cached_stamp):
+        if digest is not None:
+            return cached_stamp[2] == digest
+        return cached_stamp[:2] == stamp
+
+    index = _loaded.get(protocol_path)
+    if index is not None and is_valid(index.stamp):
+        return index
+
+    cache_path = CACHE_DIR / "{}.npz".format(
+        hashlib.sha1(protocol_path.encode()).hexdigest())
+    index = None
+    if cache_path.exists():
+        try:
+            cached, cached_stamp = ProtocolIndex.load(cache_path)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as err:
+            # truncated / corrupt cache: parse the text protocol and rewrite it
+            print("Ignoring unreadable protocol cache {}: {}".format(cache_path, err))
+        else:
+            if is_valid(cached_stamp.tolist()):
+                index = cached
+                index.stamp = cached_stamp.tolist()
+    if index is None:
+        index = ProtocolIndex.parse(protocol_path)
+        index.stamp = stamp + [digest or _file_digest(protocol_path)]
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            index.save(cache_path, index.stamp)
+        except OSError:
+            pass
+    _loaded[protocol_path] = index
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build protocol indexes and time loading")
+    parser.add_argument("protocols", nargs="+", type=str)
+    args = parser.parse_args()
+    for protocol in args.protocols:
+        start = time.perf_counter()
+        ProtocolIndex.parse(protocol).spoof_list()
+        t_text = time.perf_counter() - start
+        load_protocol(protocol)
+        _loaded.clear()
+        start = time.perf_counter()
+        index = load_protocol(protocol)
+        index.spoof_list()
+        t_cache = time.perf_counter() - start
+        start = time.perf_counter()
+        load_protocol(protocol)
+        t_mem = time.perf_counter() - start
+        print("{}: {} trials, text parse {:.1f} ms, cached {:.1f} ms, in-process {:.3f} ms".format(
+            protocol, len(index), t_text * 1e3, t_cache * 1e3, t_mem * 1e3))
@@ -0,0 +1,243 @@
+"""
+Latency-guided structured pruning of LSNet.
+
+Channels are removed in the groups the architecture ties together, so the
+result is an ordinary (smaller) Model config plus weights:
+
+    c1  residual stream of encoder blocks 0-1    filts[1..3]
+    c2  residual stream of encoder blocks 2-4    filts[3..4], pos_S, GAT input
+    g0  gat_dims[0]                              GAT-S/T, master nodes, Htrg input
+    g1  gat_dims[1]                              Htrg layers, readout
+
+Channel importance is the mean |activation| on dev batches. For each width
+ratio the pruned model's CPU latency is measured; ratios meeting the latency
+target are fine-tuned with the existing train_epoch distillation path
+(teacher = the unpruned model) and scored on dev, and the EER / latency
+Pareto points are written to pareto.json.
+"""
+
+import argparse
+import copy
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import torch
+
+from lsnetwork import Model
+
+GROUPS = ["c1", "c2", "g0", "g1"]
+_ENCODER_IN = [None, "c1", "c1", "c2", "c2"]
+_ENCODER_OUT = ["c1", "c1", "c2", "c2", "c2"]
+
+
+def _module_groups(name: str):
+    """(group of dim 0, group of dim 1) of the parameter/buffer `name`"""
+    parts = name.split(".")
+    if parts[0] == "pos_S":
+        return (None, None, "c2")
+    if parts[0] in ("master1", "master2"):
+        return (None, None, "g0")
+    if parts[0] == "encoder":
+        i, layer = int(parts[1]), parts[3]
+        g_in, g_out = _ENCODER_IN[i], _ENCODER_OUT[i]
+        return {"bn1": (g_in, None),
+                "conv1": (g_out, g_in),
+                "conv_downsample": (g_out, g_in),
+                "bn2": (g_out, None),
+                "conv2": (g_out, g_out)}[layer]
+    if parts[0] in ("GAT_layer_S", "GAT_layer_T"):
+        g_in, g_out = "c2", "g0"
+    elif parts[0].startswith("HtrgGAT_layer"):
+        g_in = "g0" if parts[0].endswith("1") else "g1"
+        g_out = "g1"
+        if parts[1] in ("proj_type1", "proj_type2"):
+            return (g_in, g_in)
+    elif parts[0] in ("pool_S", "pool_T"):
+        return (None, "g0")
+    elif parts[0].startswith("pool_h"):
+        return (None, "g1")
+    elif parts[0] == "out_layer":
+        return (None, "g1x5")
+    else:
+        return (None, None)
+    if parts[1].startswith("att_weight") or parts[1] == "bn":
+        return (g_out, None)
+    return (g_out, g_in)
+
+
+def pruned_config(model_config: Dict, widths: Dict[str, int]) -> Dict:
+    config = copy.deepcopy(model_config)
+    c1, c2 = widths["c1"], widths["c2"]
+    filts = config["filts"]
+    config["filts"] = [filts[0], [filts[1][0], c1], [c1, c1], [c1, c2], [c2, c2]]
+    config["gat_dims"] = [widths["g0"], widths["g1"]]
+    return config
+
+
+def group_widths(model_config: Dict) -> Dict[str, int]:
+    filts, gat_dims = model_config["filts"], model_config["gat_dims"]
+    return {"c1": filts[1][1], "c2": filts[-1][-1], "g0": gat_dims[0], "g1": gat_dims[1]}
+
+
+def channel_importance(model: Model, loader, device, n_batches: int) -> Dict[str, torch.Tensor]:
+    """Mean |activation| per channel of each group over n_batches dev batches"""
+    widths = group_widths(model.d_args)
+    scores = {g: torch.zeros(widths[g], device=device) for g in GROUPS}
+    hooks = []
+
+    def add(group, reduce_dims):
+        def hook(_module, _inputs, output):
+            outs = output if isinstance(output, tuple) else (output,)
+            for out in outs:
+                s = out.detach().abs().mean(dim=reduce_dims)
+                scores[group] += s / s.mean().clamp_min(1e-12)
+        return hook
+
+    for i, block in enumerate(model.encoder):
+        hooks.append(block.register_forward_hook(add(_ENCODER_OUT[i], (0, 2, 3))))
+    for layer in (model.GAT_layer_S, model.GAT_layer_T):
+        hooks.append(layer.register_forward_hook(add("g0", (0, 1))))
+    for layer in (model.HtrgGAT_layer_ST11, model.HtrgGAT_layer_ST12,
+                  model.HtrgGAT_layer_ST21, model.HtrgGAT_layer_ST22):
+        hooks.append(layer.register_forward_hook(add("g1", (0, 1))))
+
+    model.eval()
+    with torch.no_grad():
+        for i, batch in enumerate(loader):
+            if i >= n_batches:
+                break
+            model(batch[0].to(device))
+    for h in hooks:
+        h.remove()
+    return scores
+
+
+def prune_model(model: Model, scores: Dict[str, torch.Tensor], ratio: float) -> Model:
+    """Keep the top `ratio` of channels of every group; returns a new Model"""
+    keep = {}
+    for g in GROUPS:
+        n_keep = max(1, int(round(ratio * scores[g].numel())))
+        keep[g] = torch.sort(torch.topk(scores[g], n_keep).indices).values.cpu()
+    g1 = scores["g1"].numel()
+    keep["g1x5"] = torch.cat([keep["g1"] + k * g1 for k in range(5)])
+
+    config = pruned_config(model.d_args, {g: len(keep[g]) for g in GROUPS})
+    state = {}
+    for name, value in model.state_dict().items():
+        value = value.cpu()
+        for dim, group in enumerate(_module_groups(name)):
+            if group is not None and dim < value.dim():
+                value = value.index_select(dim, keep[group])
+        state[name] = value
+
+    pruned = Model(config)
+    pruned.load_state_dict(state)
+    return pruned
+
+
+def cpu_latency_ms(model: Model, nb_samp: int, batch_size: int = 1, runs: int = 10) -> float:
+    model = copy.deepcopy(model).cpu().eval()
+    x = torch.randn(batch_size, nb_samp)
+    times = []
+    with torch.no_grad():
+        for i in range(runs + 2):
+            start = time.perf_counter()
+            model(x)
+            if i >= 2:
+                times.append(time.perf_counter() - start)
+    return 1e3 * sorted(times)[len(times) // 2]
+
+
+def pareto_front(points: List[Dict]) -> List[Dict]:
+    return [p for p in points
+            if not any(q["latency_ms"] <= p["latency_ms"] and q["dev_eer"] <= p["dev_eer"]
+                       and (q["latency_ms"], q["dev_eer"]) != (p["latency_ms"], p["dev_eer"])
+                       for q in points)]
+
+
+def main(args: argparse.Namespace) -> None:
+    from main import get_loader, get_model, produce_evaluation_file, train_epoch
+    from metrics import calculate_tDCF_EER_from_scores
+    from utils import create_optimizer, set_seed
+
+    with open(args.config, "r") as f_json:
+        config = json.loads(f_json.read())
+    model_config = config["model_config"]
+    set_seed(args.seed, config)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    output_dir = Path(args.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    database_path = Path(config["database_path"])
+    database_logical_path = Path(config["database_logical_path"])
+    track = config["track"]
+    dev_trial_path = (database_logical_path /
+                      "ASVspoof2019_{}_cm_protocols/partASVspoof2019.{}.cm.dev.trl.txt".format(
+                          track, track))
+    asv_score_file = database_logical_path / config["asv_score_path"]
+    trn_loader, dev_loader, _ = get_loader(database_path, database_logical_path, args.seed, config)
+
+    teacher = get_model(model_config, device)
+    teacher.load_state_dict(torch.load(args.model_path or config["model_path"], map_location=device))
+    nb_samp = model_config.get("nb_samp", 64600)
+    scores = channel_importance(teacher, dev_loader, device, args.calib_batches)
+
+    ft_config = dict(config, loss="scokdifloss")
+    ft_config["optim_config"] = dict(config["optim_config"], epochs=args.finetune_epochs,
+                                     steps_per_epoch=len(trn_loader))
+    points = []
+    for ratio in args.ratios:
+        model = prune_model(teacher, scores, ratio)
+        latency = cpu_latency_ms(model, nb_samp)
+        n_params = sum(p.numel() for p in model.parameters())
+        print("ratio {:.3f}: {} params, {:.1f} ms".format(ratio, n_params, latency))
+        if args.target_latency_ms and latency > args.target_latency_ms:
+            continue
+
+        model = model.to(device)
+        optimizer, scheduler = create_optimizer(model.parameters(), ft_config["optim_config"])
+        for _ in range(args.finetune_epochs):
+            train_epoch(trn_loader, model, teacher, optimizer, device, scheduler,
+                        None, None, ft_config)
+        tag = "pruned_{:.3f}".format(ratio)
+        dev_scores = produce_evaluation_file(dev_loader, model, device,
+                                             output_dir / "{}_dev_score.txt".format(tag),
+                                             dev_trial_path, None, ft_config)
+        dev_eer, dev_tdcf = calculate_tDCF_EER_from_scores(
+            *dev_scores, asv_score_file=asv_score_file, output_file=None, printout=False)
+
+        torch.save(model.state_dict(), output_dir / "{}.pth".format(tag))
+        with open(output_dir / "{}.conf".format(tag), "w") as f_json:
+            f_json.write(json.dumps(dict(config, model_config=model.d_args,
+                                         model_path=str(output_dir / "{}.pth".format(tag))),
+                                    indent=4))
+        points.append({"ratio": ratio, "params": n_params, "latency_ms": latency,
+                       "dev_eer": dev_eer, "dev_tdcf": dev_tdcf, "config": model.d_args})
+        print("ratio {:.3f}: dev_eer {:.3f}, dev_tdcf {:.5f}".format(ratio, dev_eer, dev_tdcf))
+
+    front = pareto_front(points)
+    with open(output_dir / "pareto.json", "w") as f_json:
+        f_json.write(json.dumps({"points": points, "pareto": front}, indent=4))
+    for p in sorted(front, key=lambda p: p["latency_ms"]):
+        print("pareto: ratio {:.3f}, {:.1f} ms, dev_eer {:.3f}".format(
+            p["ratio"], p["latency_ms"], p["dev_eer"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Structured pruning of LSNet")
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--model_path", type=str, default=None,
+                        help="weights to prune (default: config model_path)")
+    parser.add_argument("--output_dir", type=str, default="./exp_result/pruned")
+    parser.add_argument("--ratios", type=float, nargs="+",
+                        default=[0.875, 0.75, 0.625, 0.5, 0.375, 0.25],
+                        help="fraction of channels kept per group")
+    parser.add_argument("--target_latency_ms", type=float, default=None,
+                        help="skip candidates slower than this (CPU, batch 1)")
+    parser.add_argument("--calib_batches", type=int, default=20)
+    parser.add_argument("--finetune_epochs", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=688)
+    main(parser.parse_args())
@@ -0,0 +1,198 @@
+"""
+Persistent score store shared by evaluation runs.
+
+Scores are keyed by a content hash of the model (weights, buffers,
+model_config, loss, the runtime forward settings set on the instance after
+construction, see runtime_state, and, for ocsoftmax, the loss model's
+weights), the
+protocol they belong to (2019 and 2021 LA eval ids overlap), the crop
+length and the utt_id. The same checkpoint re-scored on the same protocol,
+by --eval, --eval2021LA, the sampled and full dev passes of one epoch or an
+analysis run, only scores the utterances missing from the store. Changed
+weights hash to a new key, so entries never go stale; old keys are evicted
+least recently used, a whole model at a time, once the store holds more
+than max_scores scores. The store is one sqlite file under
+$LSNET_CACHE_DIR (WAL mode, so concurrent sweep jobs can share it).
+Enabled in produce_evaluation_file by
+
+    "score_cache": {"max_scores": 20000000}
+
+    python score_cache.py    # models in the store
+    python score_cache.py --invalidate_checkpoint exp_result/.../swa.pth
+    python score_cache.py --invalidate_protocol ASVspoof2021_LA_cm_protocols/trial_metadata.txt
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+CACHE_FILE = Path(os.environ.get("LSNET_CACHE_DIR",
+                                  Path.home() / ".cache" / "lsnet")) / "scores.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    model TEXT PRIMARY KEY, weights TEXT, label TEXT, last_used REAL, n_scores INTEGER);
+CREATE TABLE IF NOT EXISTS scores (
+    model TEXT, protocol TEXT, crop INTEGER, utt_id TEXT, score REAL,
+    PRIMARY KEY (model, protocol, crop, utt_id)) WITHOUT ROWID;
+"""
+
+
+def weights_hash(state_dict: Dict) -> str:
+    """sha1 over the names, dtypes, shapes and bytes of a state_dict"""
+    digest = hashlib.sha1()
+    for name in sorted(state_dict):
+        tensor = state_dict[name].detach().cpu().contiguous()
+        digest.update("{}:{}:{}".format(name, tensor.dtype, tuple(tensor.shape)).encode())
+        digest.update(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def runtime_state(model) -> Dict:
+    """
+    Forward settings of a Model instance that model_config does not record:
+    set_pool_ratios overrides, channels_last and fused projections (the
+    last two only change rounding, but a store entry should be reproducible)
+    """
+    fused = sorted({getattr(m, "fused") for m in model.modules() if hasattr(m, "fused")})
+    return {"pool_override": [list(v) if v is not None else None
+                              for v in getattr(model, "pool_override", (None, None))],
+            "channels_last": bool(getattr(model, "channels_last", False)),
+            "fused": fused}
+
+
+def model_key(weights: str, config: Dict, lossmodel=None, model=None) -> str:
+    """Key of the scores of a model: weights hash plus what else shapes a score"""
+    parts = {"weights": weights, "model_config": config.get("model_config"),
+             "loss": config.get("loss")}
+    if model is not None:
+        parts["runtime"] = runtime_state(model)
+    if config.get("loss") == "ocsoftmax" and lossmodel is not None:
+        parts["lossmodel"] = weights_hash(lossmodel.state_dict())
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def protocol_key(trial_path) -> str:
+    return os.path.abspath(str(trial_path))
+
+
+def dataset_crop(dataset, default: int = 0) -> int:
+    """`cut` of a dataset, through Subset / IndexedDataset wrappers"""
+    while not hasattr(dataset, "cut") and hasattr(dataset, "dataset"):
+        dataset = dataset.dataset
+    return int(getattr(dataset, "cut", default))
+
+
+class ScoreCache:
+    def __init__(self, path=CACHE_FILE, max_scores: int = 20000000):
+        self.path = Path(path)
+        self.max_scores = max_scores
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def lookup(self, model: str, protocol: str, crop: int, utt_ids: List[str]) -> np.ndarray:
+        """Scores in utt_ids order, NaN where missing"""
+        cached = dict(self.db.execute(
+            "SELECT utt_id, score FROM scores WHERE model = ? AND protocol = ? AND crop = ?",
+            (model, protocol, crop)))
+        with self.db:
+            self.db.execute("UPDATE models SET last_used = ? WHERE model = ?",
+                            (time.time(), model))
+        return np.array([cached.get(u, np.nan) for u in utt_ids], dtype=np.float64)
+
+    def store(self, model: str, weights: str, protocol: str, crop: int, utt_ids: List[str],
+              scores, label: str = "") -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)",
+                [(model, protocol, crop, u, float(s)) for u, s in zip(utt_ids, scores)])
+            n = self.db.execute("SELECT COUNT(*) FROM scores WHERE model = ?",
+                                (model,)).fetchone()[0]
+            self.db.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?, ?)",
+                            (model, weights, label, time.time(), n))
+        self.evict()
+
+    def evict(self) -> int:
+        """Drops least recently used models until at most max_scores remain"""
+        models = self.db.execute(
+            "SELECT model, n_scores FROM models ORDER BY last_used").fetchall()
+        total = sum(n for _, n in models)
+        dropped = []
+        for model, n in models[:-1]:  # never the model just stored / used
+            if total <= self.max_scores:
+                break
+            dropped.append(model)
+            total -= n
+        for model in dropped:
+            self.invalidate(model=model)
+        return len(dropped)
+
+    def invalidate(self, model: Optional[str] = None, weights: Optional[str] = None,
+                   protocol: Optional[str] = None) -> int:
+        """
+        Deletes the scores of a model key, or of every model with a weights
+        hash, restricted to one protocol if given; all scores when nothing
+        is given. Returns the number of scores removed.
+        """
+        models = None
+        if model is not None:
+            models = [model]
+        elif weights is not None:
+            models = [m for m, in self.db.execute(
+                "SELECT model FROM models WHERE weights = ?", (weights,))]
+            if not models:
+                return 0
+        in_models = "model IN ({})".format(",".join("?" * len(models or [])))
+        with self.db:
+            if protocol is None:
+                where = " WHERE " + in_models if models is not None else ""
+                n = self.db.execute("DELETE FROM scores" + where, models or []).rowcount
+                self.db.execute("DELETE FROM models" + where, models or [])
+                return n
+            where = " WHERE protocol = ?" + (" AND " + in_models if models is not None else "")
+            n = self.db.execute("DELETE FROM scores" + where, [protocol] + (models or [])).rowcount
+            self.db.execute("UPDATE models SET n_scores = "
+                            "(SELECT COUNT(*) FROM scores WHERE scores.model = models.model)")
+            self.db.execute("DELETE FROM models WHERE n_scores = 0")
+        return n
+
+    def stats(self) -> List[tuple]:
+        return self.db.execute(
+            "SELECT model, weights, label, last_used, n_scores FROM models "
+            "ORDER BY last_used DESC").fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Persistent score store")
+    parser.add_argument("--path", type=str, default=str(CACHE_FILE))
+    parser.add_argument("--invalidate_checkpoint", type=str, default=None,
+                        help="drop the scores of every model with these weights")
+    parser.add_argument("--invalidate_protocol", type=str, default=None,
+                        help="drop the scores of a protocol / trial metadata file")
+    parser.add_argument("--clear", action="store_true", help="drop all scores")
+    args = parser.parse_args()
+
+    cache = ScoreCache(args.path)
+    if args.invalidate_checkpoint or args.invalidate_protocol or args.clear:
+        weights = None
+        if args.invalidate_checkpoint:
+            weights = weights_hash(torch.load(args.invalidate_checkpoint, map_location="cpu"))
+        protocol = protocol_key(args.invalidate_protocol) if args.invalidate_protocol else None
+        print("{} scores removed".format(cache.invalidate(weights=weights, protocol=protocol)))
+    for model, weights, label, last_used, n in cache.stats():
+        print("{} {} {:9d} scores, used {} {}".format(
+            model[:12], weights[:12], n,
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)), label))
@@ -0,0 +1,293 @@
+"""
+Bulk scoring of an unlabelled corpus.
+
+Audio is decoded in a process pool, gathered into fixed-shape batches and
+scored by one or more model-inference threads. Scores are appended to the
+output file as they are produced (``utt_id score`` per line), so a killed
+run can be restarted with the same arguments and only the missing files
+are scored. The utt_id is the file name without extension; inputs where
+two files share one are rejected.
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import soundfile as sf
+import torch
+
+AUDIO_EXTS = (".flac", ".wav")
+_STOP = object()
+
+
+def list_audio_files(input_path: str) -> List[Tuple[str, str]]:
+    """Return (utt_id, path) pairs from a directory or a file list"""
+    input_path = Path(input_path)
+    if input_path.is_dir():
+        paths = sorted(p for p in input_path.rglob("*")
+                       if p.suffix.lower() in AUDIO_EXTS)
+    else:
+        with open(input_path, "r") as f_lst:
+            paths = [Path(line.strip()) for line in f_lst if line.strip()]
+    # utt_ids are the file stems (as in the ASVspoof protocols); duplicates
+    # would collide in the output and in the resume done-set
+    seen = {}
+    for p in paths:
+        seen.setdefault(p.stem, []).append(str(p))
+    duplicates = {stem: files for stem, files in seen.items() if len(files) > 1}
+    if duplicates:
+        stem, files = sorted(duplicates.items())[0]
+        raise ValueError("{} file names occur more than once under {} (e.g. {}: {})".format(
+            len(duplicates), input_path, stem, ", ".join(files)))
+    return [(p.stem, str(p)) for p in paths]
+
+
+def load_done_set(output_path: str) -> Set[str]:
+    """Read utt_ids already scored in output_path, dropping a torn last line"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as fh:
+        data = fh.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            fh.truncate(end)
+    for line in data[:end].decode().splitlines():
+        if line.strip():
+            done.add(line.split(" ", 1)[0])
+    return done
+
+
+def decode_batch(items: List[Tuple[str, str]], nb_samp: int):
+    """Decode and pad a list of files into a (n, nb_samp) float32 array"""
+    from data_utils import pad
+
+    utt_ids, failed = [], []
+    batch = np.zeros((len(items), nb_samp), dtype=np.float32)
+    for utt_id, path in items:
+        try:
+            x, _ = sf.read(path)
+        except Exception as err:
+            failed.append((utt_id, str(err)))
+            continue
+        if x.ndim > 1:
+            x = x[:, 0]
+        batch[len(utt_ids)] = pad(x, nb_samp)
+        utt_ids.append(utt_id)
+    return utt_ids, batch[:len(utt_ids)], failed
+
+
+class BulkScorer:
+    """Decode -> batch -> score -> append pipeline"""
+
+    def __init__(self, model, device: str, batch_size: int, nb_samp: int,
+                 num_decoders: int, num_model_threads: int = 1):
+        # a Model, or a StaticExecutor wrapping one already on `device`
+        self.model = model.to(device).eval() if isinstance(model, torch.nn.Module) else model
+        self.device = device
+        self.batch_size = batch_size
+        self.nb_samp = nb_samp
+        self.num_decoders = num_decoders
+        self.num_model_threads = num_model_threads
+
+    def run(self, items: List[Tuple[str, str]], output_path: str) -> Dict:
+        """
+        Scores items into output_path. An exception in an inference or
+        writer thread stops the pipeline and is re-raised here, after the
+        scores already produced have been written.
+        """
+        batch_q = queue.Queue(maxsize=2 * self.num_model_threads)
+        score_q = queue.Queue()
+        self._stop = threading.Event()
+        self._errors = queue.Queue()
+        workers = [threading.Thread(target=self._infer, args=(batch_q, score_q),
+                                    daemon=True)
+                   for _ in range(self.num_model_threads)]
+        writer = threading.Thread(target=self._write,
+                                  args=(score_q, output_path), daemon=True)
+        for t in workers:
+            t.start()
+        writer.start()
+
+        stats = {"scored": 0, "failed": 0, "start": time.time()}
+        chunks = [items[i:i + self.batch_size]
+                  for i in range(0, len(items), self.batch_size)]
+        try:
+            self._produce(chunks, batch_q, stats)
+            for _ in workers:
+                self._put(batch_q, _STOP)
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for t in workers:
+                t.join()
+            score_q.put(_STOP)
+            writer.join()
+        if not self._errors.empty():
+            raise self._errors.get()
+        stats["elapsed"] = time.time() - stats.pop("start")
+        return stats
+
+    def _produce(self, chunks, batch_q, stats):
+        max_in_flight = 2 * self.num_decoders
+        with ProcessPoolExecutor(max_workers=self.num_decoders) as pool:
+            pending = []
+            try:
+                for chunk in chunks:
+                    if self._stop.is_set():
+                        return
+                    pending.append(pool.submit(decode_batch, chunk, self.nb_samp))
+                    if len(pending) >= max_in_flight:
+                        self._dispatch(pending.pop(0).result(), batch_q, stats)
+                while pending and not self._stop.is_set():
+                    self._dispatch(pending.pop(0).result(), batch_q, stats)
+            finally:
+                for fut in pending:
+                    fut.cancel()
+
+    def _put(self, q, item) -> bool:
+        """put that gives up once a pipeline thread has failed"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fail(self, err):
+        self._errors.put(err)
+        self._stop.set()
+
+    def _dispatch(self, result, batch_q, stats):
+        utt_ids, batch, failed = result
+        for utt_id, err in failed:
+            print("Failed to decode {}: {}".format(utt_id, err), file=sys.stderr)
+        stats["failed"] += len(failed)
+        if not utt_ids:
+            return
+        if len(utt_ids) < self.batch_size:
+            # keep the input shape fixed; extra rows are dropped after scoring
+            full = np.zeros((self.batch_size, self.nb_samp), dtype=np.float32)
+            full[:len(utt_ids)] = batch
+            batch = full
+        if self._put(batch_q, (utt_ids, batch)):
+            stats["scored"] += len(utt_ids)
+
+    def _infer(self, batch_q, score_q):
+        try:
+            while not self._stop.is_set():
+                try:
+                    item = batch_q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _STOP:
+                    return
+                utt_ids, batch = item
+                batch_x = torch.from_numpy(batch).to(self.device)
+                with torch.no_grad():
+                    _, batch_out = self.model(batch_x)
+                batch_score = batch_out[:len(utt_ids), 1].data.cpu().numpy().ravel()
+                score_q.put((utt_ids, batch_score))
+        except BaseException as err:
+            self._fail(err)
+
+    def _write(self, score_q, output_path):
+        try:
+            with open(output_path, "a") as fh:
+                while True:
+                    item = score_q.get()
+                    if item is _STOP:
+                        return
+                    utt_ids, batch_score = item
+                    fh.write("".join("{} {}\n".format(fn, score)
+                                     for fn, score in zip(utt_ids, batch_score.tolist())))
+                    fh.flush()
+        except BaseException as err:
+            self._fail(err)
+
+
+def main(args: argparse.Namespace) -> None:
+    with open(args.config, "r") as f_json:
+        config = json.loads(f_json.read())
+    model_config = config["model_config"]
+    model_path = args.model_path or config["model_path"]
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+    tuned = None
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    elif device == "cpu":
+        from autotune import apply_tuned_config
+        tuned = apply_tuned_config()
+    batch_size = args.batch_size or (tuned or {}).get("batch_size") or config["batch_size"]
+    # the tuned processes per socket run here as concurrent inference threads
+    num_model_threads = args.num_model_threads or (tuned or {}).get("processes") or 1
+    num_decoders = args.num_decoders or max(
+        1, (os.cpu_count() or 1) - num_model_threads * torch.get_num_threads())
+
+    items = list_audio_files(args.input)
+    done = load_done_set(args.output)
+    todo = [(utt_id, path) for utt_id, path in items if utt_id not in done]
+    print("no. files: {}, already scored: {}, to score: {}".format(
+        len(items), len(items) - len(todo), len(todo)))
+    if not todo:
+        return
+
+    from model_factory import get_model
+    model = get_model(model_config, device)
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    print("Model loaded : {}".format(model_path))
+
+    if args.static:
+        # every batch has the same shape (partial ones are padded)
+        from static_infer import StaticExecutor
+        model = StaticExecutor(model, args.nb_samp, [batch_size],
+                               retain_cpu_heap=args.retain_heap)
+
+    scorer = BulkScorer(model, device, batch_size, args.nb_samp,
+                        num_decoders, num_model_threads)
+    stats = scorer.run(todo, args.output)
+    print("scored: {}, failed: {}, {:.1f} files/s".format(
+        stats["scored"], stats["failed"],
+        stats["scored"] / max(stats["elapsed"], 1e-9)))
+    print("Scores saved to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk scoring of an audio corpus")
+    parser.add_argument("--config", type=str, required=True,
+                        help="configuration file (model_config is used)")
+    parser.add_argument("--input", type=str, required=True,
+                        help="audio directory (searched recursively) or a file list")
+    parser.add_argument("--output", type=str, required=True,
+                        help="score file; appended to and resumed from")
+    parser.add_argument("--model_path", type=str, default=None,
+                        help="model weights (default: config model_path)")
+    parser.add_argument("--batch_size", type=int, default=None,
+                        help="batch size (default: autotuned, else config batch_size)")
+    parser.add_argument("--nb_samp", type=int, default=64600,
+                        help="input length in samples")
+    parser.add_argument("--num_decoders", type=int, default=None,
+                        help="decoding processes (default: spare cores)")
+    parser.add_argument("--num_model_threads", type=int, default=None,
+                        help="model-inference threads (default: autotuned processes on CPU, "
+                             "else 1)")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="torch intra-op threads (default: autotuned on CPU)")
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--static", action="store_true",
+                        help="score through a StaticExecutor planned at load time")
+    parser.add_argument("--retain_heap", action="store_true",
+                        help="with --static on CPU: keep freed memory in the heap "
+                             "(mallopt, process global)")
+    main(parser.parse_args())
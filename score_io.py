@@ -0,0 +1,225 @@
+"""
+Columnar binary score files.
+
+A score store is a directory holding one raw little-endian column per field:
+
+    score.f32   float32 CM scores
+    utt_id.bin  fixed-width ASCII utt_ids
+    tag.u2      uint16 codes into meta.json "tags"   (attack type, e.g. A07)
+    label.u1    uint8 codes into meta.json "labels"  (bonafide / spoof)
+
+Columns are memory-mapped for reading and appended to in place. score.f32 is
+written last on append, so its length is the committed row count and a torn
+append is ignored (and trimmed on the next append). write_scores with
+fmt="columnar" puts the store at the requested path with the .scores
+suffix (dev_score.txt -> dev_score.scores). load_for_metrics reads either
+format back for metrics.calculate_tDCF_EER_from_scores:
+
+    python score_io.py to-columnar dev_score.txt dev_score.scores
+    python score_io.py metrics dev_score.scores --asv_score_file <ASV scores> --output t-DCF_EER.txt
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+UTT_WIDTH = 16
+_COLUMNS = {"utt_id": None, "tag": np.uint16, "label": np.uint8, "score": np.float32}
+STORE_SUFFIX = ".scores"
+_FILES = {"utt_id": "utt_id.bin", "tag": "tag.u2", "label": "label.u1", "score": "score.f32"}
+
+
+class ScoreStore:
+    """Appendable, memory-mappable columnar score file"""
+
+    def __init__(self, path, utt_width: int = UTT_WIDTH):
+        self.path = Path(path)
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            with open(meta_path, "r") as f_json:
+                self.meta = json.loads(f_json.read())
+        else:
+            self.meta = {"version": 1, "utt_width": utt_width, "tags": [""], "labels": [""]}
+            self._save_meta()
+        self.utt_dtype = np.dtype("S{}".format(self.meta["utt_width"]))
+
+    def __len__(self):
+        score_file = self.path / _FILES["score"]
+        return score_file.stat().st_size // 4 if score_file.exists() else 0
+
+    def _save_meta(self):
+        tmp = self.path / "meta.json.tmp"
+        with open(tmp, "w") as f_json:
+            f_json.write(json.dumps(self.meta))
+        os.replace(tmp, self.path / "meta.json")
+
+    def _intern(self, field: str, values: Optional[Sequence[str]], n: int, dtype) -> np.ndarray:
+        if values is None:
+            return np.zeros(n, dtype=dtype)
+        vocab = self.meta[field]
+        uniq, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        new = [v for v in uniq.tolist() if v not in vocab]
+        if new:
+            vocab.extend(new)
+            self._save_meta()
+        lookup = {v: i for i, v in enumerate(vocab)}
+        codes = np.array([lookup[v] for v in uniq.tolist()], dtype=dtype)
+        return codes[inverse.reshape(-1)]
+
+    def append(self, utt_ids: Sequence[str], scores: Sequence[float],
+               tags: Optional[Sequence[str]] = None,
+               labels: Optional[Sequence[str]] = None) -> None:
+        n = len(scores)
+        utt = np.asarray(utt_ids, dtype=self.utt_dtype)
+        if any(len(u) > self.meta["utt_width"] for u in utt_ids):
+            raise ValueError("utt_id longer than {} bytes".format(self.meta["utt_width"]))
+        columns = {"utt_id": utt,
+                   "tag": self._intern("tags", tags, n, np.uint16),
+                   "label": self._intern("labels", labels, n, np.uint8),
+                   "score": np.asarray(scores, dtype="<f4")}
+        n_rows = len(self)
+        for field in _COLUMNS:
+            with open(self.path / _FILES[field], "ab") as fh:
+                # drop rows of an earlier, uncommitted append
+                fh.truncate(n_rows * self._itemsize(field))
+                fh.seek(0, os.SEEK_END)
+                fh.write(columns[field].tobytes())
+
+    def _itemsize(self, field: str) -> int:
+        if field == "utt_id":
+            return self.utt_dtype.itemsize
+        return np.dtype(_COLUMNS[field]).itemsize
+
+    def column(self, field: str) -> np.ndarray:
+        """Memory-mapped view of the committed rows of one column"""
+        n = len(self)
+        dtype = self.utt_dtype if field == "utt_id" else np.dtype(_COLUMNS[field]).newbyteorder("<")
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.path / _FILES[field], dtype=dtype, mode="r", shape=(n,))
+
+    def scores(self) -> np.ndarray:
+        return self.column("score")
+
+    def utt_ids(self) -> np.ndarray:
+        return self.column("utt_id").astype(str)
+
+    def tags(self) -> np.ndarray:
+        return np.asarray(self.meta["tags"])[self.column("tag")]
+
+    def labels(self) -> np.ndarray:
+        return np.asarray(self.meta["labels"])[self.column("label")]
+
+
+def is_score_store(path) -> bool:
+    return (Path(path) / "meta.json").exists()
+
+
+def load_for_metrics(path) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    (scores, keys, sources) of a score store or text score file for
+    metrics.calculate_tDCF_EER_from_scores; keys and sources are None when
+    the file has no labels (2021 eval). A store is read memory-mapped.
+    """
+    if is_score_store(path):
+        store = ScoreStore(path)
+        if len(store.meta["labels"]) == 1:
+            return store.scores(), None, None
+        return store.scores(), store.labels(), store.tags()
+    with open(path, "r") as fh:
+        cols = [line.split() for line in fh if line.strip()]
+    scores = np.array([float(c[-1]) for c in cols])
+    if cols and len(cols[0]) == 4:
+        return scores, np.array([c[2] for c in cols]), np.array([c[1] for c in cols])
+    return scores, None, None
+
+
+def score_path(save_path, fmt: str = "text") -> Path:
+    """Path written by write_scores: a columnar store gets the .scores suffix"""
+    save_path = Path(save_path)
+    return save_path.with_suffix(STORE_SUFFIX) if fmt == "columnar" else save_path
+
+
+def write_scores(save_path, utt_ids: List[str], scores: List[float],
+                 tags: Optional[List[str]] = None, labels: Optional[List[str]] = None,
+                 fmt: str = "text") -> Path:
+    """
+    Write scores as the usual text file, or as a (fresh) score store at
+    score_path(save_path, fmt). Returns the path written.
+    """
+    if fmt == "columnar":
+        store_path = score_path(save_path, fmt)
+        if store_path.exists():
+            for name in list(_FILES.values()) + ["meta.json"]:
+                if (store_path / name).exists():
+                    os.remove(store_path / name)
+        ScoreStore(store_path).append(utt_ids, scores, tags, labels)
+        return store_path
+    with open(save_path, "w") as fh:
+        if tags is None:
+            for fn, score in zip(utt_ids, scores):
+                fh.write("{} {}\n".format(fn, score))
+        else:
+            for fn, tag, label, score in zip(utt_ids, tags, labels, scores):
+                fh.write("{} {} {} {}\n".format(fn, tag, label, score))
+    return Path(save_path)
+
+
+def text_to_columnar(text_path, store_path) -> ScoreStore:
+    """Convert a 'utt_id score' or 'utt_id tag label score' file"""
+    with open(text_path, "r") as fh:
+        cols = [line.split() for line in fh if line.strip()]
+    utt_ids = [c[0] for c in cols]
+    scores = [float(c[-1]) for c in cols]
+    tags = labels = None
+    if cols and len(cols[0]) == 4:
+        tags = [c[1] for c in cols]
+        labels = [c[2] for c in cols]
+    width = max([UTT_WIDTH] + [len(u) for u in utt_ids])
+    store = ScoreStore(store_path, utt_width=width)
+    store.append(utt_ids, scores, tags, labels)
+    return store
+
+
+def columnar_to_text(store_path, text_path) -> None:
+    store = ScoreStore(store_path)
+    scores = store.scores().tolist()
+    if len(store.meta["labels"]) == 1:
+        write_scores(text_path, store.utt_ids().tolist(), scores)
+    else:
+        write_scores(text_path, store.utt_ids().tolist(), scores,
+                     store.tags().tolist(), store.labels().tolist())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert or re-evaluate score files")
+    parser.add_argument("command", choices=["to-columnar", "to-text", "metrics"])
+    parser.add_argument("src", type=str, help="score file or store")
+    parser.add_argument("dst", type=str, nargs="?", default=None,
+                        help="converted file (to-columnar / to-text)")
+    parser.add_argument("--asv_score_file", type=str, default=None,
+                        help="ASV score file for the min t-DCF (metrics)")
+    parser.add_argument("--output", type=str, default="t-DCF_EER.txt",
+                        help="EER / t-DCF breakdown (metrics)")
+    args = parser.parse_args()
+    if args.command == "metrics":
+        from metrics import calculate_tDCF_EER_from_scores
+
+        if args.asv_score_file is None:
+            parser.error("metrics needs --asv_score_file")
+        cm_scores, cm_keys, cm_sources = load_for_metrics(args.src)
+        if cm_keys is None:
+            parser.error("{} has no labels to evaluate against".format(args.src))
+        calculate_tDCF_EER_from_scores(cm_scores, cm_keys, cm_sources, args.asv_score_file,
+                                       args.output)
+    elif args.dst is None:
+        parser.error("{} needs dst".format(args.command))
+    elif args.command == "to-columnar":
+        text_to_columnar(args.src, args.dst)
+    else:
+        columnar_to_text(args.src, args.dst)
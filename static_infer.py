@@ -0,0 +1,217 @@
+"""
+Static-shape inference executor.
+
+Online scoring runs one input length and a few batch sizes. StaticExecutor
+plans every (batch size, nb_samp) shape once at load time and reuses its
+buffers on every call:
+
+- CUDA: each shape is captured as a CUDA graph over a static input buffer.
+  All graphs share one memory pool, so every activation has a fixed
+  address and a call is a copy into the input, a replay and a copy out.
+- CPU: full batches run straight on the caller's tensor; partial ones go
+  through a preallocated input buffer of the next planned size. With
+  retain_cpu_heap=True the glibc heap is also told to keep freed memory
+  (mallopt) rather than returning every large activation to the kernel with
+  munmap and page-faulting fresh zeroed pages back in on the next forward;
+  the warm-up forwards of each planned shape then leave exactly the blocks
+  that later calls of the same shape request, so the heap acts as the
+  activation arena. mallopt is process global: it changes the allocator
+  for everything in the process (data loaders, training) and cannot be
+  undone, so it is opt-in and meant for dedicated scoring processes.
+  There is no explicit activation arena (preallocated out= tensors) on
+  CPU: the intermediates are allocated inside the ATen / oneDNN kernels of
+  Model.forward, and pinning them would mean re-writing the forward op by
+  op. Without retain_cpu_heap, full batches of a size whose activations
+  exceed the mmap threshold page-fault as much as the plain forward.
+
+Batches larger than the biggest plan are split. Rows of a batch are
+independent in eval, so the stale rows of a partly filled buffer do not
+affect the scores of the filled ones.
+
+    executor = StaticExecutor(model, nb_samp=64600, batch_sizes=[1, 8, 32],
+                              retain_cpu_heap=True)
+    last_hidden, output = executor(batch_x)
+"""
+
+import argparse
+import ctypes
+import resource
+import threading
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+import torch
+
+M_TRIM_THRESHOLD = -1
+M_MMAP_THRESHOLD = -3
+
+_heap_retained = False
+
+
+def retain_heap(threshold: int = 1 << 30) -> bool:
+    """
+    Keep freed blocks of up to `threshold` bytes in the glibc heap (no
+    munmap / trim), so repeated same-shape forwards reuse warm pages.
+    Process global and permanent; returns False where mallopt is unavailable.
+    """
+    global _heap_retained
+    if _heap_retained:
+        return True
+    try:
+        libc = ctypes.CDLL("libc.so.6")
+    except OSError:
+        return False
+    _heap_retained = bool(libc.mallopt(M_MMAP_THRESHOLD, threshold)) and \
+        bool(libc.mallopt(M_TRIM_THRESHOLD, threshold))
+    return _heap_retained
+
+
+class _Plan:
+    def __init__(self, batch_size: int, x: torch.Tensor):
+        self.batch_size = batch_size
+        self.x = x
+        self.graph = None
+        self.outputs = None
+        self.lock = threading.Lock()
+
+
+class StaticExecutor:
+    def __init__(self, model, nb_samp: int, batch_sizes: Sequence[int] = (1,),
+                 warmup: int = 3, cuda_graphs: bool = True,
+                 retain_cpu_heap: bool = False):
+        self.model = model.eval()
+        self.nb_samp = nb_samp
+        self.device = next(model.parameters()).device
+        self.use_graphs = cuda_graphs and self.device.type == "cuda"
+        self.plans: Dict[int, _Plan] = {}
+        if retain_cpu_heap and self.device.type == "cpu":
+            # process global, see retain_heap()
+            retain_heap()
+        self._pool = torch.cuda.graph_pool_handle() if self.use_graphs else None
+        # largest first, so smaller graphs fit in the pool of the larger ones
+        for batch_size in sorted(set(batch_sizes), reverse=True):
+            self.plans[batch_size] = self._plan(batch_size, warmup)
+        self.batch_sizes: List[int] = sorted(self.plans)
+
+    def _plan(self, batch_size: int, warmup: int) -> _Plan:
+        plan = _Plan(batch_size, torch.zeros(batch_size, self.nb_samp, device=self.device))
+        if not self.use_graphs:
+            with torch.inference_mode():
+                for _ in range(warmup):
+                    self.model(plan.x)
+            return plan
+
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream), torch.no_grad():
+            for _ in range(warmup):
+                self.model(plan.x)
+        torch.cuda.current_stream().wait_stream(stream)
+        plan.graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(plan.graph, pool=self._pool), torch.no_grad():
+            plan.outputs = self.model(plan.x)
+        return plan
+
+    def _run(self, plan: _Plan, x: torch.Tensor):
+        n = x.size(0)
+        if plan.graph is None and n == plan.batch_size:
+            # full CPU batch: no shared buffer, so calls may run concurrently
+            with torch.inference_mode():
+                return self.model(x.to(self.device))
+        with plan.lock:
+            plan.x[:n].copy_(x, non_blocking=True)
+            if plan.graph is not None:
+                plan.graph.replay()
+                return tuple(out[:n].clone() for out in plan.outputs)
+            with torch.inference_mode():
+                return tuple(out[:n] for out in self.model(plan.x))
+
+    def __call__(self, x: torch.Tensor):
+        '''
+        x   :(#bs, nb_samp)
+        Returns (last_hidden, output) as Model.forward.
+        '''
+        if x.size(1) != self.nb_samp:
+            raise ValueError("StaticExecutor planned for {} samples, got {}".format(
+                self.nb_samp, x.size(1)))
+        chunks = []
+        start = 0
+        while start < x.size(0):
+            rest = x.size(0) - start
+            batch_size = next((b for b in self.batch_sizes if b >= rest), self.batch_sizes[-1])
+            n = min(rest, batch_size)
+            chunks.append(self._run(self.plans[batch_size], x[start:start + n]))
+            start += n
+        if len(chunks) == 1:
+            return chunks[0]
+        return tuple(torch.cat(parts) for parts in zip(*chunks))
+
+
+def _sustained(fn, x, iters: int):
+    """Latencies (s) and minor page faults per call over `iters` calls"""
+    device = x.device
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+        allocs = torch.cuda.memory_stats().get("allocation.all.allocated", 0)
+    lat = []
+    for _ in range(iters):
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        fn(x)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        lat.append(time.perf_counter() - start)
+    stats = {"faults": (resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults) / iters}
+    if device.type == "cuda":
+        stats["cuda_allocs"] = (torch.cuda.memory_stats().get("allocation.all.allocated", 0)
+                                - allocs) / iters
+    return np.array(lat), stats
+
+
+if __name__ == "__main__":
+    from benchmark import DEFAULT_MODEL_CONFIG
+    from lsnetwork import Model
+
+    parser = argparse.ArgumentParser(description="Static executor vs plain forward under load")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--nb_samp", type=int, default=64600)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--retain_heap", action="store_true",
+                        help="keep freed CPU memory in the heap (process global mallopt)")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    torch.manual_seed(0)
+    model = Model(DEFAULT_MODEL_CONFIG).to(device).eval()
+
+    def plain(x):
+        with torch.no_grad():
+            return model(x)
+
+    # the plain runs go first: retain_heap is process wide
+    results = {}
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, args.nb_samp, device=device)
+        plain(x)
+        results[batch_size] = {"plain": _sustained(plain, x, args.iters)}
+    start = time.perf_counter()
+    executor = StaticExecutor(model, args.nb_samp, args.batch_sizes,
+                              retain_cpu_heap=args.retain_heap)
+    print("planned {} in {:.1f} s on {}".format(args.batch_sizes, time.perf_counter() - start,
+                                                device))
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, args.nb_samp, device=device)
+        results[batch_size]["static"] = _sustained(executor, x, args.iters)
+        ref = plain(x)[1]
+        diff = (executor(x)[1] - ref).abs().max().item()
+        for name, (lat, stats) in results[batch_size].items():
+            print("bs {:3d} {:6s}: p50 {:8.2f} ms, p99 {:8.2f} ms, {}".format(
+                batch_size, name, 1e3 * np.percentile(lat, 50), 1e3 * np.percentile(lat, 99),
+                ", ".join("{} {:.0f}/call".format(k, v) for k, v in stats.items())))
+        print("bs {:3d} max |score diff| {:.1e}".format(batch_size, diff))
@@ -0,0 +1,295 @@
+"""
+Config sweep scheduler packing training runs onto one node.
+
+A grid of config overrides (dotted keys into the base config) is expanded
+into runs, each written as its own config under <sweep_dir>/configs and
+launched as `main.py --no_eval2021LA`. The node's cores are split into
+disjoint sets of --cores_per_job; each job is pinned to one set with
+matching OMP/MKL thread counts (and, with --gpus, given one GPU round
+robin), so concurrent jobs do not oversubscribe the CPU. All jobs share
+$LSNET_CACHE_DIR: the protocol indexes are compiled once by the scheduler
+and, with "audio_cache" in the base config, the decoded audio of every
+protocol too, so jobs map read-only copies instead of re-parsing and
+re-decoding.
+
+The queue is checkpointed in <sweep_dir>/state.json after every change;
+re-running the same command resumes it (interrupted runs are queued again,
+failed runs retried up to --max_attempts). Runs are atomic: main.py keeps
+no resumable per-epoch state, so a requeued or retried run deletes the
+output directory of its earlier attempt and trains again from epoch 0. Finished runs are collected
+into <sweep_dir>/results.tsv with the SWA eval EER / min t-DCF, best eval
+EER and, with "target_dev_eer" in the base config, the seconds until the
+dev EER reached it, from their metric_log.txt.
+
+grid.json, either a product of values per key
+    {"optim_config.base_lr": [1e-4, 3e-4], "model_config.pool_ratios": [[0.5, 0.7, 0.5, 0.5]]}
+or an explicit list of overrides
+    [{"loss": "scokdifloss"}, {"loss": "scokdifloss", "model_config.temperatures": [2, 2, 50, 50]}]
+
+    python sweep.py --config config/LSNet.conf --grid grid.json --sweep_dir exp_result/sweep1 \
+        --cores_per_job 8 --gpus 0 1
+"""
+
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(os.path.dirname(os.path.abspath(__file__)))
+
+
+def expand_grid(grid) -> List[Dict]:
+    if isinstance(grid, list):
+        return [dict(g) for g in grid]
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[k] for k in keys])]
+
+
+def apply_overrides(config: Dict, overrides: Dict) -> Dict:
+    config = copy.deepcopy(config)
+    for dotted, value in overrides.items():
+        node = config
+        *parents, leaf = dotted.split(".")
+        for key in parents:
+            node = node.setdefault(key, {})
+        node[leaf] = value
+    return config
+
+
+def run_id(i: int, overrides: Dict) -> str:
+    digest = hashlib.sha1(json.dumps(overrides, sort_keys=True).encode()).hexdigest()[:8]
+    return "r{:03d}_{}".format(i, digest)
+
+
+def core_sets(cores_per_job: int, max_jobs: Optional[int] = None) -> List[List[int]]:
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+        else list(range(os.cpu_count() or 1))
+    cores_per_job = min(cores_per_job, len(cores))
+    sets = [cores[i:i + cores_per_job]
+            for i in range(0, len(cores) - cores_per_job + 1, cores_per_job)]
+    return sets[:max_jobs] if max_jobs else sets
+
+
+def parse_metric_log(path) -> Dict:
+    """SWA eval EER / t-DCF, best eval EER and time-to-target from a main.py metric_log.txt"""
+    result = {}
+    if not os.path.exists(path):
+        return result
+    with open(path, "r") as f_log:
+        text = f_log.read()
+    swa = re.findall(r"swa EER: ([\d.]+), min t-DCF: ([\d.]+)", text)
+    if swa:
+        result["eval_eer"], result["eval_tdcf"] = float(swa[-1][0]), float(swa[-1][1])
+    best = re.findall(r"best eer:([\d.]+)% , best tdcf:([\d.]+)", text)
+    if best:
+        result["best_eval_eer"] = min(float(e) for e, _ in best)
+        result["best_eval_tdcf"] = min(float(t) for _, t in best)
+    # wall time until dev EER <= target_dev_eer, when the config sets one
+    target = re.findall(r"reached after ([\d.]+) s", text)
+    if target:
+        result["time_to_target"] = float(target[-1])
+    return result
+
+
+class SweepState:
+    """Run queue checkpointed to state.json"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.runs: Dict[str, Dict] = {}
+        if self.path.exists():
+            with open(self.path, "r") as f_json:
+                self.runs = json.loads(f_json.read())["runs"]
+
+    def save(self) -> None:
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, "w") as f_json:
+            f_json.write(json.dumps({"runs": self.runs}, indent=4))
+        os.replace(tmp, self.path)
+
+    def add(self, rid: str, overrides: Dict, config_path: str) -> None:
+        if rid not in self.runs:
+            self.runs[rid] = {"overrides": overrides, "config": config_path,
+                              "status": "pending", "attempts": 0}
+
+    def requeue(self, max_attempts: int) -> None:
+        for run in self.runs.values():
+            if run["status"] == "running" or (
+                    run["status"] == "failed" and run["attempts"] < max_attempts):
+                run["status"] = "pending"
+
+    def pending(self) -> List[str]:
+        return [rid for rid, run in self.runs.items() if run["status"] == "pending"]
+
+
+def model_tag_dir(output_dir, config: Dict, config_path, comment: str) -> Path:
+    # same naming as main.main
+    return Path(output_dir) / "{}_{}_ep{}_bs{}_{}".format(
+        config["track"], os.path.splitext(os.path.basename(config_path))[0],
+        config["num_epochs"], config["batch_size"], comment)
+
+
+def run_dir(run: Dict, rid: str, sweep_dir) -> Path:
+    with open(run["config"], "r") as f_json:
+        config = json.loads(f_json.read())
+    return model_tag_dir(Path(sweep_dir) / "runs", config, run["config"], rid)
+
+
+def warm_caches(config: Dict, num_workers: int) -> None:
+    """Compile the protocol indexes (and decoded audio) once for all jobs"""
+    from protocol_index import load_protocol
+
+    track = config["track"]
+    prefix_2019 = "partASVspoof2019.{}".format(track)
+    protocols = [Path(config["database_logical_path"]) /
+                 "ASVspoof2019_{}_cm_protocols/{}.cm.{}.trl.txt".format(track, prefix_2019, part)
+                 for part in ("train", "dev", "eval")]
+    for protocol in protocols:
+        print("{}: {} trials".format(protocol, len(load_protocol(protocol))))
+    if str(config.get("audio_cache", "False")).lower() in ("true", "1", "yes"):
+        from audio_cache import get_audio_cache
+        for protocol in protocols:
+            get_audio_cache(protocol, config["database_path"], num_workers)
+
+
+def launch(run: Dict, rid: str, cores: List[int], gpu: Optional[str], args) -> subprocess.Popen:
+    env = dict(os.environ, LSNET_CACHE_DIR=str(args.cache_dir),
+               OMP_NUM_THREADS=str(len(cores)), MKL_NUM_THREADS=str(len(cores)))
+    if gpu is not None:
+        env["CUDA_VISIBLE_DEVICES"] = gpu
+    tag_dir = run_dir(run, rid, args.sweep_dir)
+    if tag_dir.exists():
+        # an earlier attempt; its metric_log.txt would be appended to
+        shutil.rmtree(tag_dir)
+    log = open(Path(args.sweep_dir) / "logs" / "{}.log".format(rid), "a")
+    cmd = [sys.executable, str(ROOT / "main.py"), "--config", run["config"],
+           "--output_dir", str(Path(args.sweep_dir) / "runs"), "--comment", rid,
+           "--seed", str(args.seed), "--no_eval2021LA"]
+
+    def pin():
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            cwd=str(ROOT), preexec_fn=pin)
+    log.close()
+    return proc
+
+
+def write_results(state: SweepState, args) -> List[Dict]:
+    rows = []
+    for rid, run in sorted(state.runs.items()):
+        row = {"run": rid, "status": run["status"],
+               "overrides": json.dumps(run["overrides"], sort_keys=True),
+               "hours": (run.get("finished", run.get("started", 0)) - run.get("started", 0)) / 3600}
+        row.update(run.get("result", {}))
+        rows.append(row)
+    rows.sort(key=lambda r: r.get("eval_eer", float("inf")))
+    cols = ["run", "status", "eval_eer", "eval_tdcf", "best_eval_eer", "best_eval_tdcf",
+            "time_to_target", "hours", "overrides"]
+    with open(Path(args.sweep_dir) / "results.tsv", "w") as f_tsv:
+        f_tsv.write("\t".join(cols) + "\n")
+        for row in rows:
+            f_tsv.write("\t".join("{:.4f}".format(row[c]) if isinstance(row.get(c), float)
+                                  else str(row.get(c, "")) for c in cols) + "\n")
+    return rows
+
+
+def main(args: argparse.Namespace) -> None:
+    with open(args.config, "r") as f_json:
+        base = json.loads(f_json.read())
+    with open(args.grid, "r") as f_json:
+        grid = expand_grid(json.loads(f_json.read()))
+    sweep_dir = Path(args.sweep_dir)
+    for sub in ("configs", "logs", "runs"):
+        os.makedirs(sweep_dir / sub, exist_ok=True)
+
+    state = SweepState(sweep_dir / "state.json")
+    for i, overrides in enumerate(grid):
+        rid = run_id(i, overrides)
+        config_path = sweep_dir / "configs" / "{}.conf".format(rid)
+        if not config_path.exists():
+            with open(config_path, "w") as f_json:
+                f_json.write(json.dumps(apply_overrides(base, overrides), indent=4))
+        state.add(rid, overrides, str(config_path.resolve()))
+    state.requeue(args.max_attempts)
+    state.save()
+
+    slots = core_sets(args.cores_per_job, args.max_jobs)
+    print("{} runs ({} pending), {} slots of {} cores".format(
+        len(state.runs), len(state.pending()), len(slots), len(slots[0])))
+    if not args.skip_warm:
+        warm_caches(base, num_workers=len(slots) * len(slots[0]))
+
+    queue = state.pending()
+    running = {}  # slot -> (rid, proc)
+    try:
+        while queue or running:
+            for slot in range(len(slots)):
+                if slot in running or not queue:
+                    continue
+                rid = queue.pop(0)
+                run = state.runs[rid]
+                gpu = args.gpus[slot % len(args.gpus)] if args.gpus else None
+                running[slot] = (rid, launch(run, rid, slots[slot], gpu, args))
+                run.update(status="running", attempts=run["attempts"] + 1,
+                           cores=slots[slot], gpu=gpu, started=time.time())
+                state.save()
+                print("started {} on cores {} {}".format(rid, slots[slot], run["overrides"]))
+            time.sleep(args.poll)
+            for slot, (rid, proc) in list(running.items()):
+                if proc.poll() is None:
+                    continue
+                del running[slot]
+                run = state.runs[rid]
+                tag_dir = run_dir(run, rid, sweep_dir)
+                run.update(status="done" if proc.returncode == 0 else "failed",
+                           returncode=proc.returncode, finished=time.time(),
+                           result=parse_metric_log(tag_dir / "metric_log.txt"))
+                state.save()
+                write_results(state, args)
+                print("{} {} (exit {}) {}".format(rid, run["status"], proc.returncode,
+                                                  run["result"]))
+    except KeyboardInterrupt:
+        # running jobs are requeued on the next start
+        for rid, proc in running.values():
+            proc.terminate()
+        raise
+
+    for row in write_results(state, args):
+        print("{run}\t{status}\t{eer}\t{tdcf}\t{overrides}".format(
+            eer=row.get("eval_eer", "-"), tdcf=row.get("eval_tdcf", "-"), **row))
+    print("results: {}".format(sweep_dir / "results.tsv"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Config sweep scheduler")
+    parser.add_argument("--config", type=str, required=True, help="base configuration file")
+    parser.add_argument("--grid", type=str, required=True, help="JSON grid of config overrides")
+    parser.add_argument("--sweep_dir", type=str, default="./exp_result/sweep")
+    parser.add_argument("--cores_per_job", type=int, default=8)
+    parser.add_argument("--max_jobs", type=int, default=None,
+                        help="concurrent jobs (default: as many core sets as fit)")
+    parser.add_argument("--gpus", type=str, nargs="+", default=None,
+                        help="CUDA devices handed to the jobs round robin")
+    parser.add_argument("--cache_dir", type=str,
+                        default=os.environ.get("LSNET_CACHE_DIR",
+                                               str(Path.home() / ".cache" / "lsnet")),
+                        help="shared LSNET_CACHE_DIR of all jobs")
+    parser.add_argument("--seed", type=int, default=688)
+    parser.add_argument("--max_attempts", type=int, default=2)
+    parser.add_argument("--poll", type=float, default=10.)
+    parser.add_argument("--skip_warm", action="store_true",
+                        help="do not pre-build the shared caches")
+    args = parser.parse_args()
+    os.environ["LSNET_CACHE_DIR"] = args.cache_dir
+    main(args)
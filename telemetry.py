@@ -0,0 +1,140 @@
+"""
+Training step telemetry.
+
+Every step only the data wait and the step wall time are measured (two
+perf_counter calls). Every `interval` steps one step is sampled: its phases
+are timed with device synchronisation, and the interval's samples/sec, data
+wait share, dataloader queue depth and peak memory are logged to TensorBoard
+and to a JSONL file.
+"""
+
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Optional
+
+import torch
+
+
+class StepTelemetry:
+    def __init__(self, log_dir: Optional[str], interval: int = 100, device="cpu"):
+        self.interval = interval if log_dir else 0
+        self.device = device
+        self.step = 0
+        self.writer = None
+        self.f_jsonl = None
+        if self.interval:
+            from torch.utils.tensorboard import SummaryWriter
+
+            os.makedirs(log_dir, exist_ok=True)
+            self.writer = SummaryWriter(log_dir=str(log_dir))
+            self.f_jsonl = open(Path(log_dir) / "telemetry.jsonl", "a")
+        self._loader_iter = None
+        self._reset_window()
+        self._t_paused = self._t_window
+
+    def _reset_window(self):
+        self.window = {"steps": 0, "samples": 0, "data_wait": 0., "step_time": 0.}
+        self.phases: Dict[str, float] = {}
+        self._t_window = time.perf_counter()
+
+    @property
+    def sampled(self) -> bool:
+        return self.interval > 0 and self.step % self.interval == 0
+
+    def _sync(self):
+        if str(self.device).startswith("cuda"):
+            torch.cuda.synchronize()
+
+    def iterate(self, loader):
+        """Yields loader batches, timing how long each one is waited for"""
+        if not self.interval:
+            yield from loader
+            return
+        # time outside iterate() (dev / eval passes between epochs) is not
+        # part of the throughput window
+        self._t_window += time.perf_counter() - self._t_paused
+        self._loader_iter = iter(loader)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    batch = next(self._loader_iter)
+                except StopIteration:
+                    break
+                self._t_step = time.perf_counter()
+                self.window["data_wait"] += self._t_step - start
+                yield batch
+        finally:
+            self._loader_iter = None
+            self._t_paused = time.perf_counter()
+
+    def phase(self, name: str):
+        """Context manager timing `name` with device sync on sampled steps"""
+        if not self.sampled:
+            return nullcontext()
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        self._sync()
+        start = time.perf_counter()
+        yield
+        self._sync()
+        self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - start
+
+    def _queue_depth(self) -> Optional[int]:
+        it = self._loader_iter
+        if it is None or not hasattr(it, "_data_queue"):
+            return None
+        try:
+            return it._data_queue.qsize()
+        except NotImplementedError:
+            # qsize() is unavailable on macOS; fall back to outstanding batches
+            return it._send_idx - it._rcvd_idx
+
+    def _peak_memory_mb(self) -> float:
+        if str(self.device).startswith("cuda"):
+            peak = torch.cuda.max_memory_allocated() / 2 ** 20
+            torch.cuda.reset_peak_memory_stats()
+            return peak
+        # ru_maxrss is in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def end_step(self, batch_size: int) -> None:
+        if not self.interval:
+            return
+        self.window["steps"] += 1
+        self.window["samples"] += batch_size
+        self.window["step_time"] += time.perf_counter() - self._t_step
+        if self.sampled:
+            self._log()
+        self.step += 1
+
+    def _log(self):
+        elapsed = time.perf_counter() - self._t_window
+        record = {
+            "step": self.step,
+            "samples_per_sec": self.window["samples"] / max(elapsed, 1e-9),
+            "data_wait_ms": 1e3 * self.window["data_wait"] / self.window["steps"],
+            "step_ms": 1e3 * self.window["step_time"] / self.window["steps"],
+            "data_wait_frac": self.window["data_wait"] / max(elapsed, 1e-9),
+            "queue_depth": self._queue_depth(),
+            "peak_memory_mb": self._peak_memory_mb(),
+        }
+        for name, seconds in self.phases.items():
+            record["phase_{}_ms".format(name)] = 1e3 * seconds
+        for key, value in record.items():
+            if key != "step" and value is not None:
+                self.writer.add_scalar("telemetry/{}".format(key), value, self.step)
+        self.f_jsonl.write(json.dumps(record) + "\n")
+        self.f_jsonl.flush()
+        self._reset_window()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.f_jsonl.close()
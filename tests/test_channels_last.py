@@ -0,0 +1,65 @@
+"""The channels_last encoder path must match the NCHW one"""
+
+import copy
+
+import pytest
+import torch
+
+from benchmark import DEFAULT_MODEL_CONFIG
+from lsnetwork import Model
+
+NB_SAMP = 16000
+
+
+@pytest.fixture(scope="module")
+def models():
+    torch.manual_seed(1234)
+    nchw = Model(DEFAULT_MODEL_CONFIG)
+    channels_last = copy.deepcopy(nchw)
+    channels_last.set_channels_last(True)
+    return nchw, channels_last
+
+
+def test_eval_outputs(models):
+    x = torch.randn(3, NB_SAMP)
+    lengths = torch.tensor([NB_SAMP, NB_SAMP // 2, NB_SAMP // 3])
+    outs = []
+    for model in models:
+        model.eval()
+        with torch.no_grad():
+            outs.append((model(x), model(x, lengths=lengths)))
+    for ref, out in zip(*outs):
+        torch.testing.assert_close(out[0], ref[0])
+        torch.testing.assert_close(out[1], ref[1])
+
+
+def test_train_outputs_and_grads(models):
+    x = torch.randn(2, NB_SAMP)
+    y = torch.tensor([0, 1])
+    results = []
+    for model in models:
+        model = copy.deepcopy(model).train()
+        torch.manual_seed(0)
+        _, out = model(x)
+        torch.nn.functional.cross_entropy(out, y).backward()
+        results.append((out.detach(), {n: p.grad for n, p in model.named_parameters()
+                                       if p.grad is not None}))
+    (ref_out, ref_grads), (out, grads) = results
+    # the layouts sum in a different order; batch-statistics BatchNorm and
+    # SELU amplify that to ~1e-3 relative in the gradients (fp32)
+    torch.testing.assert_close(out, ref_out, rtol=1e-4, atol=1e-4)
+    assert grads.keys() == ref_grads.keys()
+    ref = torch.cat([g.flatten() for g in ref_grads.values()])
+    new = torch.cat([grads[n].flatten() for n in ref_grads])
+    assert (new - ref).norm() <= 1e-2 * ref.norm()
+    scale = ref.abs().max().item()
+    for name, grad in ref_grads.items():
+        torch.testing.assert_close(grads[name], grad, rtol=1e-2, atol=1e-2 * scale, msg=name)
+
+
+def test_weights_keep_values(models):
+    nchw, channels_last = models
+    for (name, a), (_, b) in zip(nchw.state_dict().items(), channels_last.state_dict().items()):
+        torch.testing.assert_close(b, a, rtol=0, atol=0, msg=name)
+    assert channels_last.encoder[0][0].conv1.weight.is_contiguous(
+        memory_format=torch.channels_last)
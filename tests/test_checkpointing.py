@@ -0,0 +1,50 @@
+"""Activation checkpointing must not change gradients or BatchNorm statistics"""
+
+import copy
+import random
+
+import pytest
+import torch
+
+from benchmark import CHECKPOINT_POLICIES, DEFAULT_MODEL_CONFIG
+from lsnetwork import Model
+
+NB_SAMP = 16000
+
+
+def _train_step(model, batch_x, batch_y, seed=0):
+    torch.manual_seed(seed)
+    random.seed(seed)
+    model.train()
+    model.zero_grad()
+    _, batch_out = model(batch_x)
+    torch.nn.functional.cross_entropy(batch_out, batch_y).backward()
+    grads = {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+    buffers = {n: b.clone() for n, b in model.named_buffers()
+               if n.endswith(("running_mean", "running_var", "num_batches_tracked"))}
+    return grads, buffers
+
+
+@pytest.fixture(scope="module")
+def reference():
+    torch.manual_seed(1234)
+    base = Model(DEFAULT_MODEL_CONFIG)
+    batch_x = torch.randn(2, NB_SAMP)
+    batch_y = torch.tensor([0, 1])
+    return base, batch_x, batch_y, _train_step(copy.deepcopy(base), batch_x, batch_y)
+
+
+@pytest.mark.parametrize("policy", [p for p in CHECKPOINT_POLICIES if p != "none"])
+def test_checkpointing_matches_plain(reference, policy):
+    base, batch_x, batch_y, (ref_grads, ref_buffers) = reference
+    model = copy.deepcopy(base)
+    model.checkpoint_segments = set(CHECKPOINT_POLICIES[policy])
+    grads, buffers = _train_step(model, batch_x, batch_y)
+
+    assert grads.keys() == ref_grads.keys()
+    for name in ref_grads:
+        torch.testing.assert_close(grads[name], ref_grads[name], msg=name)
+    assert buffers.keys() == ref_buffers.keys() and ref_buffers
+    for name in ref_buffers:
+        # running stats are updated once per step, not again by the recompute
+        torch.testing.assert_close(buffers[name], ref_buffers[name], msg=name)
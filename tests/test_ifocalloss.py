@@ -0,0 +1,80 @@
+"""The fused distillation + I-FocalLoss backward must match autograd"""
+
+import pytest
+import torch
+import torch.nn as nn
+
+from ifocalloss import FocalDistillationLoss, IFocalLoss, _reference_loss
+
+GAMMAS = [1, 2, 0.5]
+
+
+def _inputs(seed=0, n=16):
+    torch.manual_seed(seed)
+    preds = torch.randn(n, 2, dtype=torch.float64, requires_grad=True)
+    labels = torch.randint(0, 2, (n,))
+    t_preds = torch.randn(n, 2, dtype=torch.float64)
+    return preds, labels, t_preds
+
+
+def _separate(preds, labels, t_preds, gamma, beta=0.5):
+    return beta * nn.MSELoss()(t_preds, preds) + (1 - beta) * IFocalLoss(gamma=gamma)(preds, labels)
+
+
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_gradcheck(gamma):
+    preds, labels, t_preds = _inputs()
+    weight = torch.rand(len(labels), dtype=torch.float64)
+    loss = FocalDistillationLoss(gamma=gamma, beta=0.3)
+    assert torch.autograd.gradcheck(lambda p: loss(p, labels, t_preds), (preds,))
+    assert torch.autograd.gradcheck(lambda p: loss(p, labels, t_preds, weight), (preds,))
+
+
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_matches_separate_losses(gamma):
+    preds, labels, t_preds = _inputs()
+    fused = FocalDistillationLoss(gamma=gamma)(preds, labels, t_preds)
+    separate = _separate(preds, labels, t_preds, gamma)
+    torch.testing.assert_close(fused, separate)
+    g_fused, = torch.autograd.grad(fused, preds)
+    g_separate, = torch.autograd.grad(separate, preds)
+    torch.testing.assert_close(g_fused, g_separate, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_matches_reference_loss(gamma):
+    # the reference adds eps inside the logs, so it only agrees to ~eps
+    preds, labels, t_preds = _inputs()
+    fused = FocalDistillationLoss(gamma=gamma)(preds, labels, t_preds)
+    ref = _reference_loss(preds, labels, t_preds, gamma=gamma)
+    torch.testing.assert_close(fused, ref, rtol=0, atol=1e-6)
+    g_fused, = torch.autograd.grad(fused, preds)
+    g_ref, = torch.autograd.grad(ref, preds)
+    torch.testing.assert_close(g_fused, g_ref, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("gamma", GAMMAS)
+def test_weighted_matches_per_sample_sum(gamma):
+    preds, labels, t_preds = _inputs()
+    n = len(labels)
+    weight = torch.rand(n, dtype=torch.float64)
+    loss = FocalDistillationLoss(gamma=gamma)
+    fused = loss(preds, labels, t_preds, weight)
+    ref = sum(w * _separate(preds[i:i + 1], labels[i:i + 1], t_preds[i:i + 1], gamma)
+              for i, w in enumerate(weight)) / n
+    torch.testing.assert_close(fused, ref)
+    g_fused, = torch.autograd.grad(fused, preds)
+    g_ref, = torch.autograd.grad(ref, preds)
+    torch.testing.assert_close(g_fused, g_ref, rtol=0, atol=1e-12)
+    # sample_loss is unweighted and per sample
+    assert loss.sample_loss.shape == (n,)
+    torch.testing.assert_close(loss.sample_loss.mean(),
+                               _separate(preds, labels, t_preds, gamma).detach())
+
+
+def test_teacher_gets_no_gradient():
+    preds, labels, t_preds = _inputs()
+    t_preds.requires_grad_(True)
+    FocalDistillationLoss()(preds, labels, t_preds).backward()
+    assert t_preds.grad is None
+    assert preds.grad is not None
@@ -0,0 +1,38 @@
+"""Import cost of the model and tool entry points (python -X importtime)"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds allowed on top of `import torch`
+BUDGET = 0.5
+
+# modules that must not be pulled in by importing a model
+HEAVY_MODULES = ["fairseq", "torchstat", "thop", "torchcontrib", "tensorboard",
+                 "main", "data_utils", "evaluation", "evaluation2021"]
+
+
+def _import_profile(module: str):
+    """(cumulative import seconds of `module` after torch, modules loaded)"""
+    code = "import torch, sys, {}; print(' '.join(sys.modules))".format(module)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith("import time:") and line.split("|")[-1].strip() == module:
+            cumulative = int(line.split("|")[1]) / 1e6
+    return cumulative, set(proc.stdout.split())
+
+
+@pytest.mark.parametrize("module", ["lsnetwork", "model_factory"])
+def test_import_budget(module):
+    seconds, loaded = _import_profile(module)
+    assert seconds is not None
+    assert seconds <= BUDGET, "import {} took {:.3f} s".format(module, seconds)
+    leaked = sorted(m for m in HEAVY_MODULES if m in loaded)
+    assert not leaked, "import {} pulled in {}".format(module, leaked)
@@ -0,0 +1,63 @@
+"""Score store keys must separate every setting that changes a score"""
+
+import numpy as np
+import pytest
+import torch
+
+from benchmark import DEFAULT_MODEL_CONFIG
+from lsnetwork import Model
+from score_cache import ScoreCache, model_key, weights_hash
+
+CONFIG = {"model_config": DEFAULT_MODEL_CONFIG, "loss": "CCE"}
+UTT_IDS = ["LA_E_{}".format(i) for i in range(3)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ScoreCache(tmp_path / "scores.sqlite")
+    yield cache
+    cache.close()
+
+
+def _scores(model, x):
+    with torch.no_grad():
+        return model(x)[1][:, 1].numpy()
+
+
+def test_pool_settings_get_separate_entries(cache):
+    torch.manual_seed(0)
+    model = Model(DEFAULT_MODEL_CONFIG).eval()
+    x = torch.randn(len(UTT_IDS), 16000)
+    weights = weights_hash(model.state_dict())
+
+    default_key = model_key(weights, CONFIG, model=model)
+    default_scores = _scores(model, x)
+    cache.store(default_key, weights, "protocol", 16000, UTT_IDS, default_scores)
+
+    model.set_pool_ratios([0.9, 0.9, 0.9], max_nodes=[4, 4, 4, 4])
+    pooled_key = model_key(weights, CONFIG, model=model)
+    assert pooled_key != default_key
+    assert np.isnan(cache.lookup(pooled_key, "protocol", 16000, UTT_IDS)).all()
+    pooled_scores = _scores(model, x)
+    assert not np.allclose(pooled_scores, default_scores)
+    cache.store(pooled_key, weights, "protocol", 16000, UTT_IDS, pooled_scores)
+
+    assert {row[0] for row in cache.stats()} == {default_key, pooled_key}
+    np.testing.assert_allclose(cache.lookup(pooled_key, "protocol", 16000, UTT_IDS),
+                               pooled_scores, rtol=1e-6)
+    model.set_pool_ratios()
+    assert model_key(weights, CONFIG, model=model) == default_key
+    np.testing.assert_allclose(cache.lookup(default_key, "protocol", 16000, UTT_IDS),
+                               default_scores, rtol=1e-6)
+
+
+def test_invalidate_by_weights_drops_every_setting(cache):
+    torch.manual_seed(0)
+    model = Model(DEFAULT_MODEL_CONFIG).eval()
+    weights = weights_hash(model.state_dict())
+    for ratios in (None, [0.9, 0.9, 0.9]):
+        model.set_pool_ratios(ratios)
+        cache.store(model_key(weights, CONFIG, model=model), weights, "protocol", 16000,
+                    UTT_IDS, np.zeros(len(UTT_IDS)))
+    assert cache.invalidate(weights=weights) == 2 * len(UTT_IDS)
+    assert cache.stats() == []
@@ -0,0 +1,77 @@
+"""BulkScorer must surface pipeline-thread failures instead of hanging"""
+
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+import score_corpus
+from score_corpus import BulkScorer
+
+NB_SAMP = 8
+BATCH_SIZE = 2
+
+
+def _decode(items, nb_samp):
+    # stands in for decode_batch in the (forked) decoder processes
+    return [u for u, _ in items], np.zeros((len(items), nb_samp), dtype=np.float32), []
+
+
+class _Scorer(torch.nn.Module):
+    def __init__(self, fail_after=None):
+        super().__init__()
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def forward(self, x):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise RuntimeError("inference failed")
+        return None, torch.stack([-x.sum(1), x.sum(1) + self.calls], dim=1)
+
+
+def _run(model, n_items, output_path, num_model_threads=1):
+    items = [("utt{}".format(i), "utt{}.flac".format(i)) for i in range(n_items)]
+    scorer = BulkScorer(model, "cpu", BATCH_SIZE, NB_SAMP, num_decoders=1,
+                        num_model_threads=num_model_threads)
+    result = {}
+
+    def target():
+        try:
+            result["stats"] = scorer.run(items, str(output_path))
+        except BaseException as err:
+            result["error"] = err
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive(), "BulkScorer.run hung"
+    return result
+
+
+@pytest.fixture(autouse=True)
+def fake_decoder(monkeypatch):
+    monkeypatch.setattr(score_corpus, "decode_batch", _decode)
+
+
+def test_scores_every_item(tmp_path):
+    result = _run(_Scorer(), 7, tmp_path / "scores.txt")
+    assert result["stats"]["scored"] == 7
+    assert score_corpus.load_done_set(str(tmp_path / "scores.txt")) == {
+        "utt{}".format(i) for i in range(7)}
+
+
+@pytest.mark.parametrize("num_model_threads", [1, 2])
+def test_inference_error_is_raised(tmp_path, num_model_threads):
+    # more batches than batch_q holds, so the producer would block on put
+    result = _run(_Scorer(fail_after=1), 40, tmp_path / "scores.txt", num_model_threads)
+    assert isinstance(result.get("error"), RuntimeError)
+    assert str(result["error"]) == "inference failed"
+    # the batch scored before the failure is kept for the resume
+    assert len(score_corpus.load_done_set(str(tmp_path / "scores.txt"))) >= BATCH_SIZE
+
+
+def test_writer_error_is_raised(tmp_path):
+    result = _run(_Scorer(), 40, tmp_path / "missing" / "scores.txt")
+    assert isinstance(result.get("error"), FileNotFoundError)
@@ -0,0 +1,40 @@
+"""Text and columnar score files must read back the same metric inputs"""
+
+import numpy as np
+import pytest
+
+from score_io import load_for_metrics, write_scores
+
+UTT_IDS = ["LA_E_{}".format(i) for i in range(6)]
+SCORES = [1.5, -2.25, 0.5, -3.0, 2.0, -0.75]
+TAGS = ["-", "A07", "-", "A19", "-", "A07"]
+LABELS = ["bonafide", "spoof", "bonafide", "spoof", "bonafide", "spoof"]
+
+
+@pytest.mark.parametrize("fmt", ["text", "columnar"])
+def test_labelled_round_trip(tmp_path, fmt):
+    path = write_scores(tmp_path / "eval_score.txt", UTT_IDS, SCORES, TAGS, LABELS, fmt=fmt)
+    scores, keys, sources = load_for_metrics(path)
+    np.testing.assert_allclose(scores, SCORES)
+    assert keys.tolist() == LABELS
+    assert sources.tolist() == TAGS
+
+
+@pytest.mark.parametrize("fmt", ["text", "columnar"])
+def test_unlabelled_round_trip(tmp_path, fmt):
+    path = write_scores(tmp_path / "eval_score.txt", UTT_IDS, SCORES, fmt=fmt)
+    scores, keys, sources = load_for_metrics(path)
+    np.testing.assert_allclose(scores, SCORES)
+    assert keys is None and sources is None
+
+
+def test_feeds_metrics(tmp_path):
+    from metrics import ScoreAccumulator
+
+    path = write_scores(tmp_path / "eval_score.txt", UTT_IDS, SCORES, TAGS, LABELS,
+                        fmt="columnar")
+    acc = ScoreAccumulator()
+    acc.update(*load_for_metrics(path))
+    # every bona fide score is above every spoof score
+    assert acc.eer() == 0
+    assert sorted(acc.attack_eers()) == ["A07", "A19"]